@@ -1,9 +1,16 @@
 # firebase_config.py
+"""
+Lazy Firebase setup.
+
+Nothing is initialized at import time: credential parsing and client
+creation happen on the first call to get_clients() (or the first access of
+`db`, `bucket` or `firebase_auth`), so gunicorn boots, migrations and tests
+that never publish do not pay for it.
+"""
 import os
 import json
 import base64
-import firebase_admin
-from firebase_admin import credentials, firestore, storage, auth
+import threading
 
 # Load environment variables from .env file if available
 try:
@@ -22,6 +29,9 @@ def _init_firebase():
     3. GOOGLE_APPLICATION_CREDENTIALS (file path)
     4. Application Default Credentials (fallback)
     """
+    import firebase_admin
+    from firebase_admin import credentials, firestore, storage, auth
+
     if firebase_admin._apps:
         # Already initialized
         db = firestore.client()
@@ -78,5 +88,31 @@ def _init_firebase():
 
     return db, bucket, auth
 
-# Initialize Firebase and export
-db, bucket, firebase_auth = _init_firebase()
+_clients = None
+_clients_lock = threading.Lock()
+
+
+def get_clients():
+    """Return (db, bucket, auth), initializing Firebase on first use"""
+    global _clients
+    if _clients is None:
+        with _clients_lock:
+            if _clients is None:
+                _clients = _init_firebase()
+    return _clients
+
+
+def get_db():
+    """Firestore client, initialized on first use"""
+    return get_clients()[0]
+
+
+def __getattr__(name):
+    # Keeps `from firebase_config import db, bucket` working without eager init
+    if name == "db":
+        return get_clients()[0]
+    if name == "bucket":
+        return get_clients()[1]
+    if name == "firebase_auth":
+        return get_clients()[2]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
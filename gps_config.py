@@ -3,6 +3,7 @@
 
 # 🚀 QUICK MODE TOGGLE - Change this to switch GPS modes instantly
 CURRENT_MODE = "SIMULATOR"  # Options: "SIMULATOR", "MOBILE", "REAL_GPS"
+USE_SIMULATOR = CURRENT_MODE == "SIMULATOR"
 
 # GPS Source Settings
 GPS_SOURCES = {
@@ -28,6 +29,13 @@ MOBILE_GPS_CONFIG = {
     'default_speed': 0.0,
     'default_heading': 0.0,
     'update_interval': 5,  # seconds
+    # Offline buffering: fixes are queued in a local SQLite file and uploaded in
+    # gzip batches, so nothing is lost while the link is down
+    'queue_path': 'gps_queue.sqlite3',
+    'max_queued_fixes': 100000,  # oldest fixes are dropped beyond this
+    'batch_size': 100,  # fixes per upload request
+    'upload_interval': 15,  # seconds between uploads (0 = upload every fix)
+    'max_backoff': 300,  # seconds, cap for exponential retry backoff
 }
 
 # 📝 HACKATHON NOTES:
@@ -0,0 +1,315 @@
+"""
+Asyncio load simulator: thousands of virtual vehicles from one event loop.
+
+bus_simulator.py runs one thread and one fresh HTTP connection per bus, which
+tops out at a few dozen buses. Here every vehicle is a small state object; a
+single scheduler wakes the ones that are due, and their fixes are posted over
+a pool of keep-alive connections (to /api/update_locations/ in batches, or
+/api/update_location/ one by one with --batch-size 1). Routes are generated
+around seed points (by default the BUS_ROUTES waypoints), so runs with the
+same --seed are reproducible.
+
+    python load_simulator.py --vehicles 10000 --interval 5 --batch-size 200 --connections 16
+"""
+import argparse
+import asyncio
+import heapq
+import math
+import random
+import time
+from datetime import datetime, timezone
+
+from bus_simulator import BUS_ROUTES
+from tracking_app.http_pool import ConnectionPool, HTTPError
+
+EARTH_RADIUS_M = 6371000.0
+
+
+# ============= Geometry =============
+
+def offset_point(lat, lng, distance_m, bearing_deg):
+    """Point `distance_m` from (lat, lng) along `bearing_deg` (flat-earth, fine for a city)"""
+    bearing = math.radians(bearing_deg)
+    dlat = distance_m * math.cos(bearing) / EARTH_RADIUS_M
+    dlng = distance_m * math.sin(bearing) / (EARTH_RADIUS_M * math.cos(math.radians(lat)))
+    return lat + math.degrees(dlat), lng + math.degrees(dlng)
+
+
+def distance_m(a, b):
+    """Equirectangular distance in metres between two (lat, lng) points"""
+    mean_lat = math.radians((a[0] + b[0]) / 2)
+    dx = math.radians(b[1] - a[1]) * math.cos(mean_lat)
+    dy = math.radians(b[0] - a[0])
+    return EARTH_RADIUS_M * math.hypot(dx, dy)
+
+
+def bearing_deg(a, b):
+    lat1, lat2 = math.radians(a[0]), math.radians(b[0])
+    dlng = math.radians(b[1] - a[1])
+    y = math.sin(dlng) * math.cos(lat2)
+    x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dlng)
+    return (math.degrees(math.atan2(y, x)) + 360) % 360
+
+
+def default_seeds():
+    """Distinct waypoints of the demo routes"""
+    return sorted({point for info in BUS_ROUTES.values() for point in info['route']})
+
+
+def generate_route(rng, seed, stops=8, radius_km=5.0):
+    """A closed loop of `stops` waypoints scattered around `seed`, ordered by angle"""
+    angles = sorted(rng.uniform(0, 360) for _ in range(stops))
+    points = [
+        offset_point(seed[0], seed[1], rng.uniform(0.2, 1.0) * radius_km * 1000, angle)
+        for angle in angles
+    ]
+    return points + points[:1]
+
+
+# ============= Vehicles =============
+
+class VirtualVehicle:
+    """One simulated vehicle driving its loop at a varying speed"""
+    __slots__ = ('bus_id', 'route', 'leg', 'progress_m', 'speed_kmh', 'speed_range', 'heading', 'rng')
+
+    def __init__(self, bus_id, route, speed_range, rng):
+        # advance() walks legs until the distance is used up; on a loop with no
+        # length it would never finish
+        if len(route) < 2 or not any(distance_m(a, b) > 0 for a, b in zip(route, route[1:])):
+            raise ValueError(f'Route of {bus_id} has zero length')
+        self.bus_id = bus_id
+        self.route = route
+        self.rng = rng
+        self.speed_range = speed_range
+        self.leg = rng.randrange(len(route) - 1)
+        self.progress_m = 0.0
+        self.speed_kmh = rng.uniform(*speed_range)
+        self.heading = bearing_deg(route[self.leg], route[self.leg + 1])
+
+    def position(self):
+        start, end = self.route[self.leg], self.route[self.leg + 1]
+        length = distance_m(start, end) or 1.0
+        fraction = min(1.0, self.progress_m / length)
+        return (start[0] + (end[0] - start[0]) * fraction,
+                start[1] + (end[1] - start[1]) * fraction)
+
+    def advance(self, seconds):
+        """Drive for `seconds`; occasionally change speed or stop at a light"""
+        if self.rng.random() < 0.2:
+            self.speed_kmh = 0.0 if self.rng.random() < 0.25 else self.rng.uniform(*self.speed_range)
+        remaining = self.speed_kmh / 3.6 * seconds
+        while remaining > 0:
+            start, end = self.route[self.leg], self.route[self.leg + 1]
+            left = distance_m(start, end) - self.progress_m
+            if remaining < left:
+                self.progress_m += remaining
+                break
+            remaining -= max(left, 0.0)
+            self.leg = (self.leg + 1) % (len(self.route) - 1)
+            self.progress_m = 0.0
+        self.heading = bearing_deg(self.route[self.leg], self.route[self.leg + 1])
+
+    def fix(self, noise_m=0.0):
+        """Location payload for the current position, with GPS noise"""
+        lat, lng = self.position()
+        if noise_m:
+            lat, lng = offset_point(lat, lng, abs(self.rng.gauss(0, noise_m)), self.rng.uniform(0, 360))
+        return {
+            'bus_id': self.bus_id,
+            'latitude': round(lat, 6),
+            'longitude': round(lng, 6),
+            'speed': round(self.speed_kmh, 1),
+            'heading': round(self.heading, 1),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        }
+
+
+def build_fleet(count, seed=0, prefix='LOAD', seeds=None, stops=8, radius_km=5.0, speed_range=(10, 50)):
+    """`count` vehicles with procedurally generated routes (deterministic for a given seed)"""
+    rng = random.Random(seed)
+    seeds = seeds or default_seeds()
+    width = max(5, len(str(count)))
+    return [
+        VirtualVehicle(f'{prefix}-{i:0{width}d}', generate_route(rng, rng.choice(seeds), stops, radius_km),
+                       speed_range, random.Random(rng.random()))
+        for i in range(count)
+    ]
+
+
+# ============= Simulation =============
+
+class LoadStats:
+    """Request/fix counters and latency percentiles"""
+
+    def __init__(self):
+        self.requests = 0
+        self.fixes = 0
+        self.errors = 0
+        self.statuses = {}
+        self.latencies = []
+        self.error_samples = {}  # status -> first response body seen
+
+    def record(self, status, fixes, seconds, body=b''):
+        self.requests += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 200:
+            self.fixes += fixes
+        else:
+            self.error_samples.setdefault(status, body[:200].decode('utf-8', 'replace'))
+        self.latencies.append(seconds)
+
+    def percentile(self, q):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def summary(self, elapsed):
+        elapsed = max(elapsed, 1e-9)
+        return (
+            f'{self.requests} requests ({self.requests / elapsed:.0f}/s), '
+            f'{self.fixes} fixes accepted ({self.fixes / elapsed:.0f}/s), {self.errors} errors, '
+            f'p50 {self.percentile(50) * 1000:.0f} ms, p95 {self.percentile(95) * 1000:.0f} ms, '
+            f'p99 {self.percentile(99) * 1000:.0f} ms, status {self.statuses}'
+        )
+
+
+class LoadSimulator:
+    """Schedules fixes for a fleet of VirtualVehicles and posts them through a ConnectionPool"""
+
+    def __init__(self, vehicles, server_url='http://127.0.0.1:8000', interval=5.0, jitter=0.2,
+                 batch_size=100, connections=8, noise_m=5.0, seed=0, timeout=10.0, linger=None):
+        self.vehicles = vehicles
+        self.server_url = server_url
+        self.interval = interval
+        self.jitter = jitter
+        self.batch_size = batch_size
+        # How long a partial batch may wait for more fixes (like a gateway buffering devices)
+        self.linger = min(1.0, interval / 4) if linger is None else linger
+        self.connections = connections
+        self.noise_m = noise_m
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.stats = LoadStats()
+        self.started_at = None
+        self.elapsed = 0.0
+        self.connections_opened = 0
+
+    def _next_delay(self):
+        return self.interval * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    async def _send(self, pool, fixes):
+        if self.batch_size == 1:
+            path, payload = '/api/update_location/', fixes[0]
+        else:
+            path, payload = '/api/update_locations/', {'fixes': fixes}
+        started = time.perf_counter()
+        try:
+            status, body = await pool.post_json(path, payload)
+        except (OSError, asyncio.TimeoutError, HTTPError, asyncio.IncompleteReadError, ValueError):
+            self.stats.errors += 1
+            return
+        self.stats.record(status, len(fixes), time.perf_counter() - started, body)
+
+    async def run(self, duration=None, report_every=10.0, report=print):
+        """Drive the fleet for `duration` seconds (forever when None); returns LoadStats"""
+        loop = asyncio.get_running_loop()
+        pool = ConnectionPool(self.server_url, size=self.connections, timeout=self.timeout)
+        # Each in-flight request holds a slot, so a slow server slows the schedule instead of queueing
+        in_flight = asyncio.Semaphore(self.connections * 2)
+        tasks = set()
+        started = loop.time()
+        self.started_at = time.monotonic()
+        last_report = started
+        # Spread the first fixes over one interval so the fleet does not start in lockstep
+        due = [(started + self.rng.uniform(0, self.interval), i, started) for i in range(len(self.vehicles))]
+        heapq.heapify(due)
+
+        async def send(fixes):
+            try:
+                await self._send(pool, fixes)
+            finally:
+                in_flight.release()
+
+        async def flush(fixes):
+            await in_flight.acquire()
+            task = loop.create_task(send(fixes))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        pending, pending_since = [], None
+        try:
+            while duration is None or loop.time() - started < duration:
+                now = loop.time()
+                while due and due[0][0] <= now:
+                    _, index, previous = heapq.heappop(due)
+                    vehicle = self.vehicles[index]
+                    vehicle.advance(now - previous)
+                    if not pending:
+                        pending_since = now
+                    pending.append(vehicle.fix(self.noise_m))
+                    heapq.heappush(due, (now + self._next_delay(), index, now))
+                    if len(pending) >= self.batch_size:
+                        await flush(pending)
+                        pending = []
+                if pending and now - pending_since >= self.linger:
+                    await flush(pending)
+                    pending = []
+
+                if report_every and now - last_report >= report_every:
+                    last_report = now
+                    report(f'[{datetime.now().strftime("%H:%M:%S")}] {self.stats.summary(now - started)}')
+                wake = due[0][0] - loop.time() if due else 0.05
+                await asyncio.sleep(min(max(wake, 0.0), 0.05))
+        finally:
+            if pending:
+                await flush(pending)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            await pool.close()
+        self.elapsed = loop.time() - started
+        self.connections_opened = pool.opened
+        return self.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Drive thousands of virtual vehicles against the ingest API')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server base URL (http only)')
+    parser.add_argument('--vehicles', type=int, default=1000)
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between fixes of one vehicle')
+    parser.add_argument('--jitter', type=float, default=0.2, help='Relative interval jitter (0.2 = +/-20%%)')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='Fixes per request to /api/update_locations/ (1 = /api/update_location/)')
+    parser.add_argument('--connections', type=int, default=8, help='Keep-alive connections in the pool')
+    parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for routes and schedule')
+    parser.add_argument('--prefix', default='LOAD', help='bus_id prefix of the virtual vehicles')
+    parser.add_argument('--radius-km', type=float, default=5.0, help='Route spread around each seed point')
+    parser.add_argument('--stops', type=int, default=8, help='Waypoints per generated route')
+    parser.add_argument('--noise-m', type=float, default=5.0, help='GPS noise (standard deviation, metres)')
+    parser.add_argument('--report-every', type=float, default=10.0)
+    args = parser.parse_args(argv)
+    if args.radius_km <= 0:
+        parser.error('--radius-km must be positive')
+
+    fleet = build_fleet(args.vehicles, seed=args.seed, prefix=args.prefix,
+                        stops=max(2, args.stops), radius_km=args.radius_km)
+    simulator = LoadSimulator(fleet, server_url=args.url, interval=args.interval, jitter=args.jitter,
+                              batch_size=max(1, args.batch_size), connections=args.connections,
+                              noise_m=args.noise_m, seed=args.seed)
+    rate = args.vehicles / args.interval
+    print(f'🚌 Simulating {args.vehicles} vehicles against {args.url} (~{rate:.0f} fixes/s, '
+          f'batch {simulator.batch_size}, {args.connections} connections)')
+    print('Press Ctrl+C to stop\n')
+    try:
+        stats = asyncio.run(simulator.run(duration=args.duration, report_every=args.report_every))
+        print(f'\n✅ Done in {simulator.elapsed:.1f}s: {stats.summary(simulator.elapsed)}')
+        for status, body in sorted(stats.error_samples.items()):
+            print(f'   HTTP {status}: {body}')
+    except KeyboardInterrupt:
+        elapsed = time.monotonic() - simulator.started_at if simulator.started_at else 0.0
+        print(f'\n🛑 Stopped after {elapsed:.1f}s: {simulator.stats.summary(elapsed)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,12 @@ Sends live GPS data from mobile device to the backend API
 """
 
 import requests
+import gzip
 import json
+import random
+import sqlite3
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 import sys
 import os
 
@@ -16,45 +19,156 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from gps_config import MOBILE_GPS_CONFIG
 
+class FixQueue:
+    """Persistent FIFO of fixes waiting for upload, in a local SQLite file (survives restarts)"""
+
+    def __init__(self, path, max_fixes=100000):
+        self.max_fixes = max_fixes
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS fixes (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)"
+        )
+        self.db.commit()
+
+    def push(self, fix):
+        with self.db:
+            cursor = self.db.execute("INSERT INTO fixes (payload) VALUES (?)", (json.dumps(fix),))
+            # Ids are consecutive and only the oldest are ever removed, so this keeps the newest max_fixes
+            self.db.execute("DELETE FROM fixes WHERE id <= ?", (cursor.lastrowid - self.max_fixes,))
+
+    def peek(self, limit):
+        """The oldest `limit` fixes as (id, fix) pairs, without removing them"""
+        rows = self.db.execute("SELECT id, payload FROM fixes ORDER BY id LIMIT ?", (limit,))
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def ack(self, last_id):
+        """Remove every fix up to and including `last_id` (after a successful upload)"""
+        with self.db:
+            self.db.execute("DELETE FROM fixes WHERE id <= ?", (last_id,))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM fixes").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
 class MobileGPSSender:
-    def __init__(self, server_url=None, bus_id=None):
+    def __init__(self, server_url=None, bus_id=None, queue_path=None):
         # 🚀 Auto-load defaults from config for fast hackathon setup
         self.server_url = server_url or MOBILE_GPS_CONFIG['server_url']
         self.bus_id = bus_id or MOBILE_GPS_CONFIG['default_bus_id']
         self.update_interval = MOBILE_GPS_CONFIG['update_interval']
+        self.batch_size = MOBILE_GPS_CONFIG.get('batch_size', 100)
+        self.upload_interval = MOBILE_GPS_CONFIG.get('upload_interval', 15)
+        self.max_backoff = MOBILE_GPS_CONFIG.get('max_backoff', 300)
+        self.queue = FixQueue(queue_path or MOBILE_GPS_CONFIG.get('queue_path', 'gps_queue.sqlite3'),
+                              MOBILE_GPS_CONFIG.get('max_queued_fixes', 100000))
+        self.session = requests.Session()  # keep-alive across uploads
+        self.compress = True
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_upload = 0.0
         self.running = False
         
-    def send_gps_data(self, latitude, longitude, speed=0.0, heading=0.0):
-        """Send GPS data to the backend API"""
-        url = f"{self.server_url}/api/update_location/"
-        data = {
+    def send_gps_data(self, latitude, longitude, speed=0.0, heading=0.0, force=False):
+        """Queue a GPS fix and upload the queue when due; True once the fix has reached the server"""
+        self.queue.push({
             'bus_id': self.bus_id,
             'latitude': float(latitude),
             'longitude': float(longitude),
             'speed': float(speed),
-            'heading': float(heading)
-        }
-        
+            'heading': float(heading),
+            # Stamped now: a fix uploaded later keeps the time it was taken
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        })
+        self.flush(force=force)
+        pending = len(self.queue)
+        if pending:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] 📦 GPS fix queued: ({latitude:.6f}, {longitude:.6f}) - {pending} waiting for upload")
+            return False
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ GPS data sent: ({latitude:.6f}, {longitude:.6f}) - Speed: {speed:.1f}km/h")
+        return True
+
+    def flush(self, force=False):
+        """
+        Upload queued fixes in gzip batches to /api/update_locations/; returns how many were delivered.
+        Without `force`, waits for upload_interval or a full batch, and for the backoff after a failure.
+        """
+        now = time.monotonic()
+        if now < self.retry_at:
+            return 0
+        if (not force and now - self.last_upload < self.upload_interval
+                and len(self.queue) < self.batch_size):
+            return 0
+        self.last_upload = now
+        delivered = 0
+        while True:
+            batch = self.queue.peek(self.batch_size)
+            if not batch:
+                return delivered
+            outcome = self._upload([fix for _, fix in batch])
+            if outcome == 'retry':
+                self._back_off()
+                return delivered
+            if outcome == 'too_large' and len(batch) > 1:
+                # The server takes smaller batches (INGEST_MAX_BATCH): halve them and try again now
+                self.batch_size = max(1, len(batch) // 2)
+                continue
+            self.queue.ack(batch[-1][0])
+            self.failures = 0
+            if outcome == 'sent':
+                delivered += len(batch)
+
+    def _upload(self, fixes):
+        """POST one batch: 'sent', 'dropped' (the server refused it for good), 'too_large' or 'retry'"""
+        url = f"{self.server_url}/api/update_locations/"
+        body = json.dumps({'fixes': fixes}).encode()
+        headers = {'Content-Type': 'application/json'}
+        if self.compress:
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
         try:
-            headers = {'Content-Type': 'application/json'}
-            response = requests.post(url, data=json.dumps(data), headers=headers, timeout=10)
-            
-            if response.status_code == 200:
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ GPS data sent: ({latitude:.6f}, {longitude:.6f}) - Speed: {speed:.1f}km/h")
-                return True
-            else:
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] ❌ Error: {response.status_code} - {response.text}")
-                return False
-                
+            response = self.session.post(url, data=body, headers=headers, timeout=10)
         except requests.exceptions.ConnectionError:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] 🔌 Connection error - Is the Django server running?")
-            return False
+            return 'retry'
         except requests.exceptions.Timeout:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏰ Request timeout")
-            return False
+            return 'retry'
         except Exception as e:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] ❌ Error: {e}")
-            return False
+            return 'retry'
+
+        if response.status_code == 200:
+            try:
+                rejected = response.json().get('rejected', [])
+            except (ValueError, AttributeError):
+                # Not our API answering (e.g. a captive portal): nothing was stored yet
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ Unexpected response from {url}, will retry")
+                return 'retry'
+            if rejected:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ Server rejected {len(rejected)} fix(es): {rejected[0]['error']}")
+            return 'sent'
+        if response.status_code == 415 and self.compress:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️ Server does not accept gzip, sending uncompressed")
+            self.compress = False
+            return self._upload(fixes)
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ❌ Error: {response.status_code} - {response.text}")
+        if response.status_code == 413:
+            return 'too_large'
+        if response.status_code == 400:
+            return 'dropped'  # retrying the same batch can never succeed
+        return 'retry'
+
+    def _back_off(self):
+        """Exponential backoff with jitter, so many senders don't reconnect in lockstep"""
+        self.failures += 1
+        delay = min(self.max_backoff, self.update_interval * 2 ** (self.failures - 1))
+        delay *= random.uniform(0.5, 1.0)
+        self.retry_at = time.monotonic() + delay
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏳ {len(self.queue)} fixes buffered, retrying in {delay:.0f}s")
     
     def test_connection(self):
         """Test connection to Django server"""
@@ -98,11 +212,11 @@ class MobileGPSSender:
                 speed = float(speed_input) if speed_input else 0.0
                 heading = float(heading_input) if heading_input else 0.0
                 
-                success = self.send_gps_data(latitude, longitude, speed, heading)
+                success = self.send_gps_data(latitude, longitude, speed, heading, force=True)
                 if success:
                     print("✅ Data sent successfully!")
                 else:
-                    print("❌ Failed to send data")
+                    print("📦 Not sent yet - kept in the offline queue")
                     
             except ValueError:
                 print("❌ Invalid input. Please enter valid numbers.")
@@ -130,10 +244,7 @@ class MobileGPSSender:
             
             self.running = True
             while self.running:
-                success = self.send_gps_data(latitude, longitude, speed, heading)
-                if not success:
-                    print("⚠️ Failed to send data, retrying...")
-                
+                self.send_gps_data(latitude, longitude, speed, heading)
                 time.sleep(self.update_interval)
                 
         except ValueError:
@@ -141,6 +252,10 @@ class MobileGPSSender:
         except KeyboardInterrupt:
             print("\n🛑 Stopping auto mode...")
             self.running = False
+            self.retry_at = 0.0
+            self.flush(force=True)
+            if len(self.queue):
+                print(f"📦 {len(self.queue)} fixes stay queued and will be uploaded next time")
 
 def main():
     """🚀 Hackathon-ready main function with auto-loaded defaults"""
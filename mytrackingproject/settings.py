@@ -54,6 +54,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'tracking_app.metrics.MetricsMiddleware',  # <- after WhiteNoise: static files aren't measured
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # <- before CommonMiddleware
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +62,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'tracking_app.profiling.ProfilingMiddleware',  # <- after auth: the X-Profile header is staff-only
 ]
 
 ROOT_URLCONF = 'mytrackingproject.urls'
@@ -108,6 +110,19 @@ DATABASES = {
     'default': env.db('DATABASE_URL')
 }
 
+# -------------------------
+# Cache
+# -------------------------
+# CACHE_URL selects the backend (django-environ syntax). The default locmem
+# cache lives inside each worker process, so with several gunicorn workers
+# every worker computes and refreshes its own copy of the dashboard
+# analytics. Point it at a shared cache, e.g. redis://127.0.0.1:6379/1 or
+# dbcache://tracking_cache (after `python manage.py createcachetable`), to
+# share entries and the single-refresher lock between workers.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://')
+}
+
 
 
 
@@ -182,3 +197,136 @@ LOGGING = {
         'tracking_app': {'handlers': ['console'], 'level': 'DEBUG'},
     },
 }
+
+
+# -------------------------
+# Realtime fan-out (Firestore)
+# -------------------------
+# Write realtime updates to the LocationOutbox table in the ingest transaction;
+# `python manage.py drain_outbox` publishes them. Set to False to queue directly
+# on the in-process sink instead (no worker needed, but no delivery guarantee).
+REALTIME_OUTBOX = os.environ.get("REALTIME_OUTBOX", "True") == "True"
+# Sink used for realtime location pushes: "firestore", "memory", "file" or "" (disabled)
+REALTIME_SINK = os.environ.get("REALTIME_SINK", "firestore")
+REALTIME_SINK_FILE = os.environ.get("REALTIME_SINK_FILE", str(BASE_DIR / "realtime_sink.ndjson"))
+# Seconds between background flushes (updates per bus are coalesced in between)
+REALTIME_FLUSH_INTERVAL = float(os.environ.get("REALTIME_FLUSH_INTERVAL", "1.0"))
+# Minimum seconds between two 'history' entries of the same bus
+REALTIME_HISTORY_INTERVAL = float(os.environ.get("REALTIME_HISTORY_INTERVAL", "30"))
+
+# Upper bound for django.setup() in a fresh interpreter (checked by the test
+# suite and `python manage.py profile_startup`)
+STARTUP_TIME_BUDGET_MS = float(os.environ.get("STARTUP_TIME_BUDGET_MS", "1500"))
+
+
+# -------------------------
+# Location ingest pipeline
+# -------------------------
+# Stages run in order on every batch of fixes (see tracking_app/ingest.py)
+INGEST_STAGES = [
+    'tracking_app.ingest.ValidateStage',
+    'tracking_app.ingest.DedupeStage',
+    'tracking_app.ingest.DeadBandStage',
+    'tracking_app.ingest.PersistStage',
+    'tracking_app.ingest.DeriveStage',
+    'tracking_app.ingest.FanoutStage',
+]
+# Largest batch accepted by /api/update_locations/
+INGEST_MAX_BATCH = int(os.environ.get("INGEST_MAX_BATCH", "1000"))
+# Largest request body after undoing Content-Encoding: gzip (guards against gzip bombs)
+INGEST_MAX_DECODED_BYTES = int(os.environ.get("INGEST_MAX_DECODED_BYTES", str(10 * 1024 * 1024)))
+# Fixes stamped more than this many seconds after server time are rejected
+INGEST_MAX_CLOCK_SKEW_SECONDS = float(os.environ.get("INGEST_MAX_CLOCK_SKEW_SECONDS", "300"))
+# Dead-band: don't store a fix that moved less than METERS, turned less than
+# DEGREES and came less than SECONDS after the last stored fix of that bus
+# (Bus.last_seen is still refreshed). METERS=0 disables it.
+INGEST_DEADBAND_METERS = float(os.environ.get("INGEST_DEADBAND_METERS", "10"))
+INGEST_DEADBAND_DEGREES = float(os.environ.get("INGEST_DEADBAND_DEGREES", "15"))
+INGEST_DEADBAND_SECONDS = float(os.environ.get("INGEST_DEADBAND_SECONDS", "60"))
+# Per-minute rollups (admin analytics): a gap longer than this between two
+# fixes of a bus is not counted as distance travelled
+ROLLUP_MAX_GAP_SECONDS = float(os.environ.get("ROLLUP_MAX_GAP_SECONDS", "600"))
+# Days kept at one-minute resolution; older rollups are folded into one row
+# per bus per day by `python manage.py enforce_retention`
+ROLLUP_MINUTE_DAYS = int(os.environ.get("ROLLUP_MINUTE_DAYS", "7"))
+# Derived bus state: a speed between consecutive fixes at or above this counts as moving
+MOVING_SPEED_KMH = float(os.environ.get("MOVING_SPEED_KMH", "3"))
+
+
+# -------------------------
+# Request metrics and profiling
+# -------------------------
+# Per-endpoint latency, query, payload and cache counters (tracking_app/metrics.py)
+# served in Prometheus text format on /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True") == "True"
+# Bearer token a scraper sends as "Authorization: Bearer <token>"; without one
+# only staff sessions can read /metrics
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# Opt-in request profiling (tracking_app/profiling.py): staff requests sending
+# "X-Profile: 1" are profiled, plus this fraction of all requests (0 = none)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+# Newest profiles kept (oldest are deleted), top functions and SQL statements stored per profile
+PROFILE_DIR = os.environ.get("PROFILE_DIR", str(BASE_DIR / "profiles"))
+PROFILE_BUFFER_SIZE = int(os.environ.get("PROFILE_BUFFER_SIZE", "50"))
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "30"))
+PROFILE_MAX_QUERIES = int(os.environ.get("PROFILE_MAX_QUERIES", "500"))
+
+
+# -------------------------
+# History archive
+# -------------------------
+# Per-owner, per-day columnar files written by `python manage.py archive_history`
+# (see tracking_app/archive.py)
+ARCHIVE_ROOT = os.environ.get("ARCHIVE_ROOT", str(BASE_DIR / "archive"))
+
+
+# -------------------------
+# Location history retention
+# -------------------------
+# Days of history kept for owners without a RetentionPolicy (0 = forever);
+# enforced by `python manage.py enforce_retention --loop` on raw fixes,
+# compacted trips, rollups and archive files alike. Keep it longer than the
+# `archive_history --days` horizon or nothing old enough is left to archive.
+LOCATION_RETENTION_DAYS = int(os.environ.get("LOCATION_RETENTION_DAYS", "0"))
+# Rows deleted per transaction by the retention engine and the admin cleanup API
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "1000"))
+
+
+# -------------------------
+# History API
+# -------------------------
+# /api/bus/<bus_id>/history/: window used when "from" is omitted, the longest
+# from/to range accepted (longer requests get a 400), and the hard cap on
+# returned points (the path is simplified until it fits)
+HISTORY_DEFAULT_HOURS = float(os.environ.get("HISTORY_DEFAULT_HOURS", "24"))
+HISTORY_MAX_HOURS = float(os.environ.get("HISTORY_MAX_HOURS", "168"))
+HISTORY_MAX_POINTS = int(os.environ.get("HISTORY_MAX_POINTS", "2000"))
+
+
+# -------------------------
+# Dashboard analytics cache
+# -------------------------
+# /api/admin/analytics/ is cached per owner: fresh for SOFT_TTL seconds, then
+# served stale while one background recompute runs; dropped after HARD_TTL
+ANALYTICS_CACHE_SOFT_TTL = float(os.environ.get("ANALYTICS_CACHE_SOFT_TTL", "15"))
+ANALYTICS_CACHE_HARD_TTL = float(os.environ.get("ANALYTICS_CACHE_HARD_TTL", "600"))
+# Recompute stale entries in a background thread (False: inline, after the stale value is read)
+SWR_REFRESH_IN_BACKGROUND = os.environ.get("SWR_REFRESH_IN_BACKGROUND", "True") == "True"
+
+
+# -------------------------
+# List API pagination
+# -------------------------
+# Page size when a list endpoint gets ?cursor= without ?limit=, and the largest ?limit= accepted
+LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", "100"))
+LIST_PAGE_MAX = int(os.environ.get("LIST_PAGE_MAX", "1000"))
+
+
+# -------------------------
+# Benchmarks
+# -------------------------
+# `python manage.py benchmark` compares against this file (record it with
+# --save-baseline on the machine that runs the comparison) and fails when
+# throughput or latency is worse by more than BENCHMARK_TOLERANCE
+BENCHMARK_BASELINE = os.environ.get("BENCHMARK_BASELINE", str(BASE_DIR / "benchmarks" / "baseline.json"))
+BENCHMARK_TOLERANCE = float(os.environ.get("BENCHMARK_TOLERANCE", "0.3"))
@@ -50,4 +50,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('tracking_app.urls')),
     path("api/device/update-location/", tracking_views.device_update_location, name="device_update_location"),
+    path('metrics', tracking_views.metrics, name='metrics'),
 ]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Route, Bus, BusLocation, BusStop, UserLocation, Driver, Schedule, ScheduleException
+from .models import Route, Bus, BusLocation, BusStop, UserLocation, Driver, Schedule, ScheduleException, RetentionPolicy
 
 @admin.register(Route)
 class RouteAdmin(admin.ModelAdmin):
@@ -67,3 +67,8 @@ class ScheduleExceptionAdmin(admin.ModelAdmin):
         if request.user.is_superuser:
             return qs
         return qs.filter(owner=request.user)
+
+@admin.register(RetentionPolicy)
+class RetentionPolicyAdmin(admin.ModelAdmin):
+    list_display = ("owner", "retention_days", "updated_at")
+    search_fields = ("owner__username",)
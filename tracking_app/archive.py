@@ -0,0 +1,285 @@
+# tracking_app/archive.py
+"""
+Columnar cold-history archive.
+
+History older than the hot window is moved out of BusLocation into one file
+per owner per day:  <ARCHIVE_ROOT>/owner_<id>/<YYYY-MM-DD>[.<n>].dpc
+
+File layout (little-endian, self-describing):
+    8 bytes   magic b'DPCOL01\\n'
+    4 bytes   header length H (uint32)
+    H bytes   JSON header: rows, columns [{name, type, offset}], buses {pk: bus_id}, ...
+    padding   to an 8-byte boundary
+    columns   one fixed-width array per column, each 8-byte aligned
+
+Rows are sorted by timestamp (int64 microseconds since the epoch, UTC), so
+ArchiveReader can binary-search a time range on the memory-mapped timestamp
+column and read only the pages it touches instead of loading whole files.
+"""
+import array
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+
+from .models import BusLocation
+
+MAGIC = b'DPCOL01\n'
+FORMAT_VERSION = 1
+
+# (name, array typecode); 'q' = int64, 'd' = float64
+COLUMNS = (
+    ('timestamp_us', 'q'),
+    ('bus_pk', 'q'),
+    ('latitude', 'd'),
+    ('longitude', 'd'),
+    ('speed', 'd'),
+    ('heading', 'd'),
+)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def archive_root():
+    return Path(getattr(settings, 'ARCHIVE_ROOT', Path(settings.BASE_DIR) / 'archive'))
+
+
+def owner_dir(owner_id, root=None):
+    return Path(root or archive_root()) / f"owner_{owner_id if owner_id is not None else 'none'}"
+
+
+def to_micros(value):
+    return int((value - _EPOCH) / timedelta(microseconds=1))
+
+
+def from_micros(value):
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def _as_little_endian(arr):
+    if sys.byteorder != 'little':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr
+
+
+# ============= Writing =============
+
+class ArchiveWriter:
+    """
+    Streams rows into per-column temp files, then assembles the final file.
+    Memory stays bounded by `buffer_rows` regardless of how many rows a day has.
+    """
+
+    def __init__(self, path, meta=None, buffer_rows=65536):
+        self.path = Path(path)
+        self.meta = meta or {}
+        self.buffer_rows = buffer_rows
+        self.rows = 0
+        self.buses = {}
+        self._buffers = [array.array(code) for _, code in COLUMNS]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._spill = [tempfile.TemporaryFile(dir=self.path.parent) for _ in COLUMNS]
+        self.min_ts = self.max_ts = None
+
+    def append(self, timestamp, bus_pk, latitude, longitude, speed, heading):
+        ts = to_micros(timestamp)
+        if self.max_ts is not None and ts < self.max_ts:
+            raise ValueError('rows must be appended in timestamp order')
+        if self.min_ts is None:
+            self.min_ts = ts
+        self.max_ts = ts
+        values = (ts, bus_pk, latitude, longitude, speed or 0.0, heading or 0.0)
+        for buf, value in zip(self._buffers, values):
+            buf.append(value)
+        self.rows += 1
+        if len(self._buffers[0]) >= self.buffer_rows:
+            self._spill_buffers()
+
+    def _spill_buffers(self):
+        for i, buf in enumerate(self._buffers):
+            _as_little_endian(buf).tofile(self._spill[i])
+            self._buffers[i] = array.array(buf.typecode)
+
+    def close(self):
+        """Write header + columns to a temp file, fsync and atomically rename into place"""
+        self._spill_buffers()
+        columns, offset = [], 0
+        for (name, code), spill in zip(COLUMNS, self._spill):
+            size = spill.tell()
+            columns.append({'name': name, 'type': code, 'offset': offset, 'bytes': size})
+            offset = _align(offset + size)
+        header = dict(self.meta, version=FORMAT_VERSION, rows=self.rows, columns=columns,
+                      buses={str(pk): bus_id for pk, bus_id in self.buses.items()},
+                      min_timestamp_us=self.min_ts, max_timestamp_us=self.max_ts)
+        header_bytes = json.dumps(header, sort_keys=True).encode()
+        data_start = _align(len(MAGIC) + 4 + len(header_bytes))
+
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        with open(tmp_path, 'wb') as out:
+            out.write(MAGIC)
+            out.write(struct.pack('<I', len(header_bytes)))
+            out.write(header_bytes)
+            out.write(b'\0' * (data_start - out.tell()))
+            for column, spill in zip(columns, self._spill):
+                spill.seek(0)
+                while True:
+                    chunk = spill.read(1 << 20)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                out.write(b'\0' * (data_start + _align(column['offset'] + column['bytes']) - out.tell()))
+                spill.close()
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self.path)
+        return self.path
+
+
+def next_archive_path(owner_id, day, root=None):
+    """<owner dir>/<day>.dpc, or <day>.<n>.dpc if the day was archived before"""
+    directory = owner_dir(owner_id, root)
+    path = directory / f'{day.isoformat()}.dpc'
+    n = 1
+    while path.exists():
+        path = directory / f'{day.isoformat()}.{n}.dpc'
+        n += 1
+    return path
+
+
+def archive_day(owner_id, day, root=None, chunk_size=5000):
+    """
+    Write all BusLocation rows of one owner for one UTC day to a new archive file.
+    Returns (path, rows, max_pk) or (None, 0, None) when there is nothing to archive.
+    """
+    start = datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
+    rows = (
+        BusLocation.objects
+        .filter(bus__owner_id=owner_id, last_updated__gte=start, last_updated__lt=start + timedelta(days=1))
+        .order_by('last_updated', 'id')
+        .values_list('id', 'bus_id', 'bus__bus_id', 'latitude', 'longitude', 'speed', 'heading', 'last_updated')
+        .iterator(chunk_size=chunk_size)
+    )
+    writer = None
+    max_pk = None
+    for pk, bus_pk, bus_code, lat, lng, speed, heading, ts in rows:
+        if writer is None:
+            writer = ArchiveWriter(next_archive_path(owner_id, day, root),
+                                   meta={'owner_id': owner_id, 'day': day.isoformat()})
+        writer.buses[bus_pk] = bus_code
+        writer.append(ts, bus_pk, lat, lng, speed, heading)
+        max_pk = pk if max_pk is None else max(max_pk, pk)
+    if writer is None:
+        return None, 0, None
+    return writer.close(), writer.rows, max_pk
+
+
+# ============= Reading =============
+
+class ArchiveReader:
+    """Memory-mapped view of one archive file; columns are zero-copy memoryviews"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a DristiPath archive file')
+        (header_len,) = struct.unpack_from('<I', self._mmap, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(self._mmap[start:start + header_len])
+        self.rows = self.header['rows']
+        self.buses = {int(pk): bus_id for pk, bus_id in self.header['buses'].items()}
+        self._data_start = _align(start + header_len)
+        self._view = memoryview(self._mmap)
+        self._columns = {}
+
+    def column(self, name):
+        """memoryview of a column, backed by the mapping (pages load on access)"""
+        if name not in self._columns:
+            if sys.byteorder != 'little':
+                raise NotImplementedError('archive reads require a little-endian host')
+            spec = next(c for c in self.header['columns'] if c['name'] == name)
+            begin = self._data_start + spec['offset']
+            self._columns[name] = self._view[begin:begin + spec['bytes']].cast(spec['type'])
+        return self._columns[name]
+
+    def scan(self, start=None, end=None, bus_pk=None):
+        """Yield row dicts with start <= timestamp < end, optionally for one bus"""
+        timestamps = self.column('timestamp_us')
+        lo = bisect.bisect_left(timestamps, to_micros(start)) if start is not None else 0
+        hi = bisect.bisect_left(timestamps, to_micros(end)) if end is not None else self.rows
+        bus_col = self.column('bus_pk')
+        lat, lng = self.column('latitude'), self.column('longitude')
+        speed, heading = self.column('speed'), self.column('heading')
+        for i in range(lo, hi):
+            if bus_pk is not None and bus_col[i] != bus_pk:
+                continue
+            yield {
+                'bus_id': self.buses.get(bus_col[i]),
+                'latitude': lat[i],
+                'longitude': lng[i],
+                'speed': speed[i],
+                'heading': heading[i],
+                'timestamp': from_micros(timestamps[i]),
+            }
+
+    def close(self):
+        self._columns.clear()
+        if getattr(self, '_view', None) is not None:
+            self._view.release()
+            self._view = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def file_day(path):
+    """Start (UTC) of the day an archive file holds"""
+    return datetime.strptime(Path(path).name[:10], '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+
+
+def archive_files(owner_id, start=None, end=None, root=None):
+    """Archive files of an owner whose day overlaps [start, end), in day order"""
+    directory = owner_dir(owner_id, root)
+    if not directory.exists():
+        return []
+    files = []
+    for path in sorted(directory.glob('*.dpc')):
+        day = file_day(path)
+        if start is not None and day + timedelta(days=1) <= start:
+            continue
+        if end is not None and day >= end:
+            continue
+        files.append(path)
+    return files
+
+
+def expired_files(owner_id, before, root=None):
+    """Archive files of an owner whose whole day ends at or before `before`"""
+    return [path for path in archive_files(owner_id, end=before, root=root)
+            if file_day(path) + timedelta(days=1) <= before]
+
+
+def read_range(owner_id, start=None, end=None, bus_pk=None, root=None):
+    """Stream archived rows of an owner for a time range"""
+    for path in archive_files(owner_id, start, end, root):
+        with ArchiveReader(path) as reader:
+            yield from reader.scan(start, end, bus_pk)
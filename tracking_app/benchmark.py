@@ -0,0 +1,335 @@
+# tracking_app/benchmark.py
+"""
+Ingest and read benchmarks with regression thresholds.
+
+A benchmark run seeds a synthetic fleet (owner "__benchmark_fleet__", buses BENCH-*),
+drives each registered scenario through Django's test client (in-process,
+with query counts) or against a live server over HTTP, and reports
+throughput, p50/p95/p99 latency, queries per call and peak RSS. Results can
+be saved as a baseline JSON file and later runs compared against it: lower
+throughput or higher latency beyond the tolerance, or any extra query per
+call, counts as a regression.
+
+Run it against a scratch database: seeded rows are removed afterwards, but
+the ingest scenarios also write outbox rows and rollups while running.
+Seeding and cleanup delete the benchmark owner's data, so they refuse to run
+outside a test database unless allow_destructive is set.
+"""
+import json
+import os
+import random
+import sys
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.backends.base.creation import TEST_DATABASE_PREFIX
+from django.test import Client
+from django.utils import timezone
+
+from .models import Bus, BusLocation, LocationOutbox, Route
+from .retention import delete_in_batches
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Reserved so a real account can never be mistaken for the benchmark owner
+BENCH_OWNER = '__benchmark_fleet__'
+BENCH_PREFIX = 'BENCH-'
+# A PREDEFINED_LOCATIONS point: every fix stays within its match radius so the
+# read endpoints never fall back to network reverse geocoding
+CENTER = (28.6139, 77.2090)
+SPREAD = 0.004
+
+SCENARIOS = OrderedDict()
+
+
+def scenario(name):
+    """Register `func(driver, fleet, iteration) -> items processed` as a benchmark scenario"""
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def peak_rss_mb():
+    """High-water resident set size of this process (None where unsupported)"""
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class QueryCounter:
+    """connection.execute_wrapper() hook counting statements (no DEBUG query log needed)"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def is_test_database():
+    """True when connected to a database created by Django's test runner"""
+    name = str(connection.settings_dict.get('NAME') or '')
+    return (os.path.basename(name).startswith(TEST_DATABASE_PREFIX)
+            or name == ':memory:' or 'mode=memory' in name)
+
+
+def check_destructive(allow_destructive):
+    if not (allow_destructive or is_test_database()):
+        raise ValueError(
+            f'Benchmarks delete the "{BENCH_OWNER}" user and its data; '
+            f'pass allow_destructive (--allow-destructive) to run outside a test database'
+        )
+
+
+# ============= Fleet =============
+
+class BenchFleet:
+    """The seeded buses and the next synthetic fix for each"""
+
+    def __init__(self, bus_ids, seed=0):
+        self.bus_ids = bus_ids
+        self.rng = random.Random(seed)
+        self.positions = {
+            bus_id: (CENTER[0] + self.rng.uniform(-SPREAD, SPREAD), CENTER[1] + self.rng.uniform(-SPREAD, SPREAD))
+            for bus_id in bus_ids
+        }
+        self.steps = dict.fromkeys(bus_ids, 0)
+        # Fixes are stamped in the recent past, one second apart per bus
+        self.clock = timezone.now() - timedelta(hours=1)
+
+    def next_fix(self, iteration):
+        bus_id = self.bus_ids[iteration % len(self.bus_ids)]
+        lat, lng = self.positions[bus_id]
+        # Shuttle back and forth in ~110 m steps, well outside the ingest dead band
+        self.steps[bus_id] += 1
+        lat += 0.001 * (self.steps[bus_id] % 6)
+        self.clock += timedelta(milliseconds=10)
+        return {
+            'bus_id': bus_id,
+            'latitude': round(lat, 6),
+            'longitude': round(lng, 6),
+            'speed': round(self.rng.uniform(10, 50), 1),
+            'heading': 0.0,
+            'timestamp': self.clock.isoformat(),
+        }
+
+
+def seed_fleet(buses=100, history=20, seed=0, chunk_size=5000, allow_destructive=False):
+    """Create the benchmark owner, routes, buses and `history` fixes per bus; returns a BenchFleet"""
+    cleanup(allow_destructive)
+    rng = random.Random(seed)
+    owner = User.objects.create(username=BENCH_OWNER, is_staff=True)
+    owner.set_unusable_password()
+    owner.save(update_fields=['password'])
+
+    routes = Route.objects.bulk_create([
+        Route(owner=owner, route_id=f'{BENCH_PREFIX}R{i:03d}', name=f'Benchmark Route {i}',
+              start_location='A', end_location='B')
+        for i in range(max(1, buses // 10))
+    ])
+    bus_ids = [f'{BENCH_PREFIX}{i:05d}' for i in range(buses)]
+    Bus.objects.bulk_create([
+        Bus(owner=owner, bus_id=bus_id, bus_number=bus_id, route=routes[i % len(routes)])
+        for i, bus_id in enumerate(bus_ids)
+    ])
+    bus_pks = dict(Bus.objects.filter(owner=owner).values_list('bus_id', 'pk'))
+
+    start = timezone.now() - timedelta(days=1)
+    batch = []
+    for bus_id in bus_ids:
+        lat = CENTER[0] + rng.uniform(-SPREAD, SPREAD)
+        lng = CENTER[1] + rng.uniform(-SPREAD, SPREAD)
+        for step in range(history):
+            batch.append(BusLocation(
+                bus_id=bus_pks[bus_id], latitude=lat + (step % 6) * 0.001, longitude=lng,
+                speed=rng.uniform(0, 50), heading=0.0,
+                last_updated=start + timedelta(seconds=30 * step),
+            ))
+            if len(batch) >= chunk_size:
+                BusLocation.objects.bulk_create(batch)
+                batch = []
+    BusLocation.objects.bulk_create(batch)
+    return BenchFleet(bus_ids, seed)
+
+
+def cleanup(allow_destructive=False):
+    """Remove everything seed_fleet() and the ingest scenarios created"""
+    check_destructive(allow_destructive)
+    owner = User.objects.filter(username=BENCH_OWNER).first()
+    if owner is None:
+        return
+    delete_in_batches(BusLocation.objects.filter(bus__owner=owner), batch_size=5000)
+    delete_in_batches(LocationOutbox.objects.filter(payload__bus_id__startswith=BENCH_PREFIX), batch_size=5000)
+    owner.delete()
+
+
+# ============= Drivers =============
+
+class ClientDriver:
+    """In-process requests through django.test.Client; queries and RSS are measured"""
+    in_process = True
+
+    def __init__(self):
+        self.client = Client(HTTP_HOST='localhost')
+
+    def get(self, path, params=None):
+        return self.client.get(path, params or {}).status_code
+
+    def post_json(self, path, payload):
+        return self.client.post(path, json.dumps(payload), content_type='application/json').status_code
+
+
+class LiveDriver:
+    """Requests to a running server over one keep-alive session (server queries/RSS are not visible)"""
+    in_process = False
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def get(self, path, params=None):
+        return self.session.get(self.base_url + path, params=params or {}, timeout=30).status_code
+
+    def post_json(self, path, payload):
+        return self.session.post(self.base_url + path, json=payload, timeout=30).status_code
+
+
+# ============= Scenarios =============
+
+@scenario('update_location')
+def bench_update_location(driver, fleet, iteration):
+    status = driver.post_json('/api/update_location/', fleet.next_fix(iteration))
+    return 1 if status == 200 else None
+
+
+@scenario('update_locations_batch')
+def bench_update_locations_batch(driver, fleet, iteration):
+    fixes = [fleet.next_fix(iteration * 50 + i) for i in range(50)]
+    status = driver.post_json('/api/update_locations/', {'fixes': fixes})
+    return len(fixes) if status == 200 else None
+
+
+@scenario('get_locations')
+def bench_get_locations(driver, fleet, iteration):
+    return 1 if driver.get('/api/get_locations/') == 200 else None
+
+
+@scenario('find_nearest_buses')
+def bench_find_nearest_buses(driver, fleet, iteration):
+    params = {'lat': CENTER[0], 'lng': CENTER[1], 'radius': 2, 'limit': 10}
+    return 1 if driver.get('/api/find_nearest_buses/', params) == 200 else None
+
+
+def run_scenario(name, driver, fleet, iterations):
+    """Time `iterations` calls of one scenario; returns its result dict"""
+    func = SCENARIOS[name]
+    latencies, items, errors = [], 0, 0
+    queries = QueryCounter()
+    with connection.execute_wrapper(queries):
+        started = time.perf_counter()
+        for i in range(iterations):
+            call_started = time.perf_counter()
+            done = func(driver, fleet, i)
+            latencies.append(time.perf_counter() - call_started)
+            if done is None:
+                errors += 1
+            else:
+                items += done
+        elapsed = time.perf_counter() - started
+    return {
+        'scenario': name,
+        'iterations': iterations,
+        'items': items,
+        'errors': errors,
+        'throughput': round(items / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries_per_call': round(queries.count / iterations, 2) if driver.in_process and iterations else None,
+        'peak_rss_mb': peak_rss_mb() if driver.in_process else None,
+    }
+
+
+def run_benchmarks(buses=100, history=20, iterations=50, names=None, live_url=None, seed=0, keep=False,
+                   allow_destructive=False):
+    """Seed, run the selected scenarios (all by default) and clean up; returns a report dict"""
+    names = list(names or SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+    fleet = seed_fleet(buses, history, seed, allow_destructive=allow_destructive)
+    driver = LiveDriver(live_url) if live_url else ClientDriver()
+    try:
+        results = OrderedDict((name, run_scenario(name, driver, fleet, iterations)) for name in names)
+    finally:
+        if not keep:
+            cleanup(allow_destructive)
+    return {
+        'params': {'buses': buses, 'history': history, 'iterations': iterations,
+                   'driver': 'live' if live_url else 'client'},
+        'database': connection.vendor,
+        'scenarios': results,
+    }
+
+
+# ============= Baselines =============
+
+def default_baseline_path():
+    return getattr(settings, 'BENCHMARK_BASELINE', str(settings.BASE_DIR / 'benchmarks' / 'baseline.json'))
+
+
+def load_baseline(path):
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def save_baseline(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as fh:
+        json.dump(report, fh, indent=2)
+        fh.write('\n')
+
+
+def compare(report, baseline, tolerance=0.3):
+    """Regression messages for `report` against `baseline` (empty when within tolerance)"""
+    # The iteration count only changes precision; fleet size and driver change the numbers
+    keys = ('buses', 'history', 'driver')
+    recorded = baseline.get('params', {})
+    if any(report['params'][key] != recorded.get(key) for key in keys):
+        return [f'Baseline was recorded with {recorded}, this run used {report["params"]}']
+    regressions = []
+    for name, result in report['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        if result['errors'] > base.get('errors', 0):
+            regressions.append(f'{name}: {result["errors"]} errors (baseline {base.get("errors", 0)})')
+        if result['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f'{name}: throughput {result["throughput"]}/s (baseline {base["throughput"]}/s)')
+        for key in ('p50_ms', 'p99_ms'):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(f'{name}: {key} {result[key]} (baseline {base[key]})')
+        if (result['queries_per_call'] is not None and base.get('queries_per_call') is not None
+                and result['queries_per_call'] > base['queries_per_call']):
+            regressions.append(
+                f'{name}: {result["queries_per_call"]} queries per call (baseline {base["queries_per_call"]})')
+    return regressions
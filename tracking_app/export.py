@@ -0,0 +1,134 @@
+# tracking_app/export.py
+"""
+Streaming export of location history.
+
+Rows are read with QuerySet.iterator() (a server-side cursor on PostgreSQL),
+formatted one at a time and grouped into ~64 KB blocks, optionally gzip
+compressed on the fly. Memory use does not depend on the export size. Used by
+the admin export endpoint and the export_locations command. read_export()
+parses such a file back (used by replay_history).
+"""
+import csv
+import gzip
+import io
+import itertools
+import json
+import zlib
+from datetime import datetime
+
+from .models import BusLocation
+
+FORMATS = ('csv', 'ndjson')
+FIELDS = ('bus_id', 'latitude', 'longitude', 'speed', 'heading', 'timestamp')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+BLOCK_SIZE = 64 * 1024
+
+
+def export_rows(owner, start=None, end=None, bus_ids=None, chunk_size=2000):
+    """(bus_id, latitude, longitude, speed, heading, last_updated) tuples, oldest first (owner=None: all owners)"""
+    queryset = BusLocation.objects.all()
+    if owner is not None:
+        queryset = queryset.filter(bus__owner=owner)
+    if start is not None:
+        queryset = queryset.filter(last_updated__gte=start)
+    if end is not None:
+        queryset = queryset.filter(last_updated__lte=end)
+    if bus_ids:
+        queryset = queryset.filter(bus__bus_id__in=bus_ids)
+    return (
+        queryset
+        .order_by('last_updated', 'id')
+        .values_list('bus__bus_id', 'latitude', 'longitude', 'speed', 'heading', 'last_updated')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+class _Echo:
+    """File-like object whose write() returns the line, so csv.writer can stream"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for bus_id, lat, lng, speed, heading, ts in rows:
+        yield writer.writerow((bus_id, lat, lng, speed, heading, ts.isoformat()))
+
+
+def ndjson_lines(rows):
+    for bus_id, lat, lng, speed, heading, ts in rows:
+        yield json.dumps({
+            'bus_id': bus_id,
+            'latitude': lat,
+            'longitude': lng,
+            'speed': speed,
+            'heading': heading,
+            'timestamp': ts.isoformat(),
+        }) + '\n'
+
+
+def _blocks(lines, size=BLOCK_SIZE):
+    """Join text lines into encoded blocks of roughly `size` bytes"""
+    block, length = [], 0
+    for line in lines:
+        block.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(block).encode('utf-8')
+            block, length = [], 0
+    if block:
+        yield ''.join(block).encode('utf-8')
+
+
+def gzip_stream(chunks, level=6):
+    """Gzip-compress an iterable of bytes incrementally"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(rows, fmt='csv', compress=False):
+    """Iterable of bytes for `rows` in the given format"""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unsupported export format "{fmt}"; use one of {", ".join(FORMATS)}')
+    lines = csv_lines(rows) if fmt == 'csv' else ndjson_lines(rows)
+    chunks = _blocks(lines)
+    return gzip_stream(chunks) if compress else chunks
+
+
+def read_export(path):
+    """
+    (bus_id, latitude, longitude, speed, heading, timestamp) tuples from an
+    export file, CSV or NDJSON, gzip-compressed or not (detected from content)
+    """
+    with open(path, 'rb') as raw:
+        compressed = raw.read(2) == b'\x1f\x8b'
+    opener = gzip.open if compressed else open
+    with opener(path, 'rb') as binary:
+        text = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+        first = text.readline()
+        if first.startswith('{'):
+            for line in itertools.chain([first], text):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                yield tuple(record[field] for field in FIELDS[:-1]) + (
+                    datetime.fromisoformat(record['timestamp']),)
+        else:
+            columns = next(csv.reader([first]))
+            index = [columns.index(field) for field in FIELDS]
+            for row in csv.reader(text):
+                if not row:
+                    continue
+                bus_id, lat, lng, speed, heading, ts = (row[i] for i in index)
+                yield bus_id, float(lat), float(lng), float(speed), float(heading), datetime.fromisoformat(ts)
@@ -0,0 +1,103 @@
+# tracking_app/http_pool.py
+"""
+Minimal asyncio HTTP/1.1 client with a pool of keep-alive connections.
+
+Used by the load simulator and the history replayer to post JSON to the
+ingest endpoints without a new dependency. Only plain http:// is supported;
+responses may use Content-Length, chunked encoding or connection close.
+Imports nothing from Django, so scripts can use it without settings.
+"""
+import asyncio
+import json
+from urllib.parse import urlsplit
+
+
+class HTTPError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Minimal HTTP/1.1 keep-alive client for JSON POSTs (asyncio streams, no dependencies)"""
+
+    def __init__(self, server_url, size=8, timeout=10.0):
+        parts = urlsplit(server_url)
+        if parts.scheme != 'http':
+            raise ValueError('Only http:// servers are supported')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self.opened = 0
+
+    async def _connection(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        self.opened += 1
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def post_json(self, path, payload):
+        """(status, body bytes); reuses a pooled connection when the server keeps it open"""
+        body = json.dumps(payload, separators=(',', ':')).encode()
+        request = (
+            f'POST {self.base_path}{path} HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.port}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Connection: keep-alive\r\n\r\n'
+        ).encode() + body
+        async with self._slots:
+            reader, writer = await self._connection()
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, response, keep_alive = await asyncio.wait_for(self._read_response(reader), self.timeout)
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            return status, response
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise HTTPError('Connection closed by server')
+        version, status = status_line.split(b' ', 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == b'HTTP/1.1'
+        if 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b''.join(chunks)
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return int(status), body, keep_alive
+
+    async def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
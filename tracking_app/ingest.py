@@ -0,0 +1,480 @@
+# tracking_app/ingest.py
+"""
+Location ingest pipeline.
+
+Every endpoint that accepts GPS fixes hands them to the pipeline as a batch
+(a single-fix request is a batch of one):
+
+    validate -> dedupe -> dead-band -> persist -> derive -> fan-out
+
+Stages take and return lists of Fix objects, so persistence can use
+bulk_create and everything after it works on the whole batch at once
+(bulk_create does not fire post_save, so no post-ingest behavior lives in
+signals). Each stage is timed; get_pipeline().stats.snapshot() reports the
+cumulative time and microseconds per fix for every stage.
+
+The stage list comes from settings.INGEST_STAGES (dotted paths), so
+deployments can add or reorder stages without touching the views.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import odometer, rollups
+from .models import Bus, BusLocation, Route
+
+DEFAULT_STAGES = [
+    'tracking_app.ingest.ValidateStage',
+    'tracking_app.ingest.DedupeStage',
+    'tracking_app.ingest.DeadBandStage',
+    'tracking_app.ingest.PersistStage',
+    'tracking_app.ingest.DeriveStage',
+    'tracking_app.ingest.FanoutStage',
+]
+
+
+class Fix:
+    """One GPS fix moving through the pipeline"""
+    __slots__ = ('index', 'raw', 'bus_id', 'latitude', 'longitude', 'speed', 'heading',
+                 'recorded_at', 'bus', 'location', 'error')
+
+    def __init__(self, index, raw):
+        self.index = index
+        self.raw = raw
+        self.bus_id = None
+        self.latitude = None
+        self.longitude = None
+        self.speed = 0.0
+        self.heading = 0.0
+        self.recorded_at = None
+        self.bus = None
+        self.location = None
+        self.error = None
+
+
+class IngestContext:
+    """Per-call options and results shared by the stages"""
+
+    def __init__(self, create_missing_buses=False):
+        self.create_missing_buses = create_missing_buses
+        self.rejected = []  # Fix objects with .error set
+        self.buses_created = set()
+        self.duplicates = 0
+        self.suppressed = 0
+
+    def reject(self, fix, error):
+        fix.error = error
+        self.rejected.append(fix)
+
+
+class IngestResult:
+    """What the views need to build their responses"""
+
+    def __init__(self, fixes, context):
+        self.fixes = fixes
+        self.rejected = sorted(context.rejected, key=lambda f: f.index)
+        self.buses_created = context.buses_created
+        self.duplicates = context.duplicates
+        self.suppressed = context.suppressed
+
+    @property
+    def locations(self):
+        return [fix.location for fix in self.fixes if fix.location is not None]
+
+
+# ============= Stages =============
+
+class Stage:
+    """Base class: process(fixes, context) returns the fixes passed on"""
+    name = 'stage'
+
+    def process(self, fixes, context):
+        return fixes
+
+
+class ValidateStage(Stage):
+    """Check required fields and ranges, coerce types and resolve Bus objects in one query"""
+    name = 'validate'
+
+    def process(self, fixes, context):
+        valid = []
+        # Clients stamp their own fixes; one far in the future would stay the
+        # bus's "latest" fix forever, so only allow a little clock skew
+        latest_allowed = timezone.now() + timedelta(seconds=getattr(settings, 'INGEST_MAX_CLOCK_SKEW_SECONDS', 300))
+        for fix in fixes:
+            error = self._parse(fix, latest_allowed)
+            if error:
+                context.reject(fix, error)
+            else:
+                valid.append(fix)
+        if not valid:
+            return valid
+
+        buses = self._resolve_buses({fix.bus_id for fix in valid}, context)
+        resolved = []
+        for fix in valid:
+            fix.bus = buses.get(fix.bus_id)
+            if fix.bus is None:
+                context.reject(fix, 'bus not found')
+            else:
+                resolved.append(fix)
+        return resolved
+
+    def _parse(self, fix, latest_allowed):
+        raw = fix.raw
+        if not isinstance(raw, dict):
+            return 'fix must be an object'
+        bus_id = raw.get('bus_id')
+        latitude = raw.get('latitude')
+        longitude = raw.get('longitude')
+        if not bus_id or latitude is None or longitude is None:
+            return 'Missing required fields'
+        try:
+            fix.latitude = float(latitude)
+            fix.longitude = float(longitude)
+            fix.speed = float(raw.get('speed') or 0.0)
+            fix.heading = float(raw.get('heading') or 0.0)
+        except (TypeError, ValueError):
+            return 'latitude, longitude, speed and heading must be numbers'
+        if not -90.0 <= fix.latitude <= 90.0 or not -180.0 <= fix.longitude <= 180.0:
+            return 'Coordinates out of range'
+        fix.bus_id = str(bus_id)
+        try:
+            fix.recorded_at = parse_timestamp(raw.get('timestamp'))
+        except (TypeError, ValueError, OverflowError, OSError):
+            return 'Invalid timestamp'
+        if fix.recorded_at > latest_allowed:
+            return 'Timestamp is in the future'
+        return None
+
+    def _resolve_buses(self, bus_ids, context):
+        buses = {}
+        # bus_id is only unique per owner; keep the oldest vehicle like a plain lookup would
+        for bus in Bus.objects.filter(bus_id__in=bus_ids).order_by('-id'):
+            buses[bus.bus_id] = bus
+        missing = bus_ids - set(buses)
+        if missing and context.create_missing_buses:
+            default_route = default_simulation_route()
+            for bus_id in missing:
+                bus, created = Bus.objects.get_or_create(
+                    bus_id=bus_id,
+                    defaults={'bus_number': bus_id, 'route': default_route}
+                )
+                buses[bus_id] = bus
+                if created:
+                    context.buses_created.add(bus_id)
+        return buses
+
+
+class DedupeStage(Stage):
+    """
+    Drop retransmitted fixes: the same bus and timestamp twice in a batch, or
+    a bus and timestamp already stored. Senders retry a whole batch when a
+    response is lost, so the stored check is one indexed query per batch
+    against the database, which every worker process shares.
+    """
+    name = 'dedupe'
+
+    def process(self, fixes, context):
+        seen = set()
+        unique = []
+        for fix in fixes:
+            key = (fix.bus.pk, fix.recorded_at)
+            if key in seen:
+                context.duplicates += 1
+                continue
+            seen.add(key)
+            unique.append(fix)
+        if not unique:
+            return unique
+
+        stored = set(
+            BusLocation.objects
+            .filter(bus_id__in={fix.bus.pk for fix in unique},
+                    last_updated__in={fix.recorded_at for fix in unique})
+            .order_by()
+            .values_list('bus_id', 'last_updated')
+        )
+        if not stored:
+            return unique
+        fresh = [fix for fix in unique if (fix.bus.pk, fix.recorded_at) not in stored]
+        context.duplicates += len(unique) - len(fresh)
+        return fresh
+
+
+class DeadBandStage(Stage):
+    """
+    Skip storing fixes of (nearly) stationary vehicles.
+
+    A fix is not persisted when, compared to the last fix stored for the same
+    bus, it moved less than INGEST_DEADBAND_METERS, turned less than
+    INGEST_DEADBAND_DEGREES and arrived less than INGEST_DEADBAND_SECONDS
+    later, so a parked bus still stores one heartbeat row per window.
+    Bus.last_seen is refreshed for every fix, stored or not. The last stored
+    fix and the seen/suppressed counts are kept per process and only updated
+    once the batch commits; after a restart the first fix is always stored.
+    Set INGEST_DEADBAND_METERS to 0 to disable suppression.
+    """
+    name = 'deadband'
+
+    def __init__(self, meters=None, degrees=None, seconds=None):
+        self.meters = meters if meters is not None else getattr(settings, 'INGEST_DEADBAND_METERS', 10.0)
+        self.degrees = degrees if degrees is not None else getattr(settings, 'INGEST_DEADBAND_DEGREES', 15.0)
+        self.seconds = seconds if seconds is not None else getattr(settings, 'INGEST_DEADBAND_SECONDS', 60.0)
+        self._lock = threading.Lock()
+        self._stored = {}  # bus pk -> (latitude, longitude, heading, recorded_at)
+        self._counts = {}  # bus pk -> [seen, suppressed]
+
+    def process(self, fixes, context):
+        kept = []
+        stored = {}
+        counts = {}  # bus pk -> [seen, suppressed] for this batch
+        with self._lock:
+            for fix in sorted(fixes, key=lambda f: f.recorded_at):
+                bus_pk = fix.bus.pk
+                bus_counts = counts.setdefault(bus_pk, [0, 0])
+                bus_counts[0] += 1
+                last = stored.get(bus_pk) or self._stored.get(bus_pk)
+                if last is not None and self._within_band(last, fix):
+                    bus_counts[1] += 1
+                    continue
+                stored[bus_pk] = (fix.latitude, fix.longitude, fix.heading, fix.recorded_at)
+                kept.append(fix)
+        transaction.on_commit(lambda: self._remember(stored, counts))
+        self._touch_last_seen(fixes)
+        context.suppressed = len(fixes) - len(kept)
+        kept.sort(key=lambda f: f.index)
+        return kept
+
+    def _within_band(self, last, fix):
+        if self.meters <= 0:
+            return False
+        latitude, longitude, heading, recorded_at = last
+        gap = (fix.recorded_at - recorded_at).total_seconds()
+        if gap < 0 or gap >= self.seconds:
+            return False
+        turn = abs(fix.heading - heading) % 360.0
+        if min(turn, 360.0 - turn) >= self.degrees:
+            return False
+        moved_m = BusLocation.calculate_distance(latitude, longitude, fix.latitude, fix.longitude) * 1000
+        return moved_m < self.meters
+
+    def _remember(self, stored, counts):
+        with self._lock:
+            self._stored.update(stored)
+            for bus_pk, (seen, suppressed) in counts.items():
+                totals = self._counts.setdefault(bus_pk, [0, 0])
+                totals[0] += seen
+                totals[1] += suppressed
+
+    def _touch_last_seen(self, fixes):
+        touched = {}
+        for fix in fixes:
+            # Fixes of one bus share the Bus instance resolved by ValidateStage
+            bus = fix.bus
+            if bus.last_seen is None or fix.recorded_at > bus.last_seen:
+                bus.last_seen = fix.recorded_at
+                touched[bus.pk] = bus
+        if touched:
+            Bus.objects.bulk_update(list(touched.values()), ['last_seen'])
+
+    def bus_stats(self, bus_pks=None):
+        """{bus pk: {'seen', 'suppressed'}} for all or the given buses"""
+        with self._lock:
+            return {
+                pk: {'seen': seen, 'suppressed': suppressed}
+                for pk, (seen, suppressed) in self._counts.items()
+                if bus_pks is None or pk in bus_pks
+            }
+
+
+class PersistStage(Stage):
+    """Write the batch with a single bulk_create"""
+    name = 'persist'
+
+    def process(self, fixes, context):
+        locations = [
+            BusLocation(
+                bus=fix.bus,
+                latitude=fix.latitude,
+                longitude=fix.longitude,
+                speed=fix.speed,
+                heading=fix.heading,
+                last_updated=fix.recorded_at,
+            )
+            for fix in fixes
+        ]
+        BusLocation.objects.bulk_create(locations)
+        for fix, location in zip(fixes, locations):
+            fix.location = location
+        return fixes
+
+
+class DeriveStage(Stage):
+    """State derived from stored fixes: per-minute rollups and per-bus odometer/speed (rollups.py, odometer.py)"""
+    name = 'derive'
+
+    def process(self, fixes, context):
+        locations = [fix.location for fix in fixes if fix.location is not None]
+        rollups.record(locations)
+        odometer.record(locations)
+        return fixes
+
+
+class FanoutStage(Stage):
+    """Realtime fan-out: outbox rows in the ingest transaction, or the in-process sink"""
+    name = 'fanout'
+
+    def process(self, fixes, context):
+        from . import outbox
+        from .sinks import get_sink, location_payload
+
+        locations = [fix.location for fix in fixes if fix.location is not None]
+        if getattr(settings, 'REALTIME_OUTBOX', True):
+            outbox.enqueue(locations)
+        else:
+            sink = get_sink()
+            if sink is not None:
+                sink.publish_many([location_payload(location) for location in locations])
+        return fixes
+
+
+# ============= Pipeline =============
+
+class StageStats:
+    __slots__ = ('calls', 'fixes', 'total_ns')
+
+    def __init__(self):
+        self.calls = 0
+        self.fixes = 0
+        self.total_ns = 0
+
+
+class PipelineStats:
+    """Cumulative per-stage timings (thread-safe)"""
+
+    def __init__(self, stage_names):
+        self._lock = threading.Lock()
+        self._stages = OrderedDict((name, StageStats()) for name in stage_names)
+        self.batches = 0
+
+    def record(self, name, fixes, elapsed_ns):
+        with self._lock:
+            stats = self._stages[name]
+            stats.calls += 1
+            stats.fixes += fixes
+            stats.total_ns += elapsed_ns
+
+    def count_batch(self):
+        with self._lock:
+            self.batches += 1
+
+    def snapshot(self):
+        with self._lock:
+            stages = []
+            for name, stats in self._stages.items():
+                stages.append({
+                    'stage': name,
+                    'calls': stats.calls,
+                    'fixes': stats.fixes,
+                    'total_ms': round(stats.total_ns / 1e6, 3),
+                    'us_per_fix': round(stats.total_ns / 1e3 / stats.fixes, 2) if stats.fixes else None,
+                })
+            return {'batches': self.batches, 'stages': stages}
+
+    def reset(self):
+        with self._lock:
+            for name in self._stages:
+                self._stages[name] = StageStats()
+            self.batches = 0
+
+
+class IngestPipeline:
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.stats = PipelineStats([stage.name for stage in self.stages])
+
+    def run(self, raw_fixes, create_missing_buses=False):
+        """Ingest a batch of raw fix dicts; returns an IngestResult"""
+        context = IngestContext(create_missing_buses=create_missing_buses)
+        fixes = [Fix(index, raw) for index, raw in enumerate(raw_fixes)]
+        with transaction.atomic():
+            for stage in self.stages:
+                if not fixes:
+                    break
+                count = len(fixes)
+                start = time.perf_counter_ns()
+                fixes = stage.process(fixes, context)
+                self.stats.record(stage.name, count, time.perf_counter_ns() - start)
+        self.stats.count_batch()
+        return IngestResult(fixes, context)
+
+    def stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def build_pipeline():
+    paths = getattr(settings, 'INGEST_STAGES', None) or DEFAULT_STAGES
+    return IngestPipeline(import_string(path)() for path in paths)
+
+
+def get_pipeline():
+    """Process-wide pipeline (stages keep small per-bus caches between requests)"""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = build_pipeline()
+    return _pipeline
+
+
+def reset_pipeline():
+    global _pipeline
+    with _pipeline_lock:
+        _pipeline = None
+
+
+def ingest(raw_fixes, create_missing_buses=False):
+    """Shortcut used by the views"""
+    return get_pipeline().run(raw_fixes, create_missing_buses=create_missing_buses)
+
+
+# ============= Helpers =============
+
+def default_simulation_route():
+    """Route assigned to vehicles that report before an admin registered them"""
+    route, _ = Route.objects.get_or_create(
+        route_id='ROUTE-DEFAULT',
+        defaults={
+            'name': 'Default Simulation Route',
+            'start_location': 'Start',
+            'end_location': 'End',
+            'description': 'Autocreated route for simulator data'
+        }
+    )
+    return route
+
+
+def parse_timestamp(value):
+    """Fix timestamp from ISO-8601 or epoch seconds; server time when absent"""
+    if value in (None, ''):
+        return timezone.now()
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
@@ -6,6 +6,7 @@ from django.utils import timezone
 from datetime import timedelta
 import hashlib
 import json
+from .metrics import record_cache
 
 # Predefined location mappings for common coordinates
 PREDEFINED_LOCATIONS = {
@@ -219,6 +220,7 @@ def get_cached_routes(user_id):
     """
     cache_key = get_cache_key('admin_routes', user_id)
     routes = cache.get(cache_key)
+    record_cache(routes is not None)
     
     if routes is None:
         routes = cache_route_data(user_id)
@@ -250,6 +252,7 @@ def get_cached_drivers(user_id):
     """
     cache_key = get_cache_key('admin_drivers', user_id)
     drivers = cache.get(cache_key)
+    record_cache(drivers is not None)
     
     if drivers is None:
         drivers = cache_driver_data(user_id)
@@ -282,6 +285,7 @@ def get_cached_buses(user_id):
     """
     cache_key = get_cache_key('admin_buses', user_id)
     buses = cache.get(cache_key)
+    record_cache(buses is not None)
     
     if buses is None:
         buses = cache_bus_data(user_id)
@@ -323,7 +327,9 @@ def get_cached_location(latitude, longitude):
     Get cached location name or None if not cached.
     """
     cache_key = get_cache_key('location', round(latitude, 4), round(longitude, 4))
-    return cache.get(cache_key)
+    location_name = cache.get(cache_key)
+    record_cache(location_name is not None)
+    return location_name
 
 def cached_reverse_geocode(latitude, longitude):
     """
@@ -0,0 +1,73 @@
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+
+from tracking_app.archive import archive_day, archive_root
+from tracking_app.models import BusLocation
+
+
+class Command(BaseCommand):
+    help = 'Move BusLocation history older than N days into per-owner, per-day columnar archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Archive whole UTC days older than this many days (default: 30)')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Rows fetched/deleted per query (default: 5000)')
+        parser.add_argument('--root', default=None,
+                            help='Archive directory (default: settings.ARCHIVE_ROOT)')
+        parser.add_argument('--keep', action='store_true',
+                            help='Write archive files but keep the rows in the database')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between delete chunks (default: 0)')
+
+    def handle(self, *args, **options):
+        root = options['root'] or archive_root()
+        chunk_size = options['chunk_size']
+        today = datetime.now(dt_timezone.utc).date()
+        cutoff_day = today - timedelta(days=options['days'])
+        cutoff = datetime(cutoff_day.year, cutoff_day.month, cutoff_day.day, tzinfo=dt_timezone.utc)
+
+        oldest = BusLocation.objects.filter(last_updated__lt=cutoff).aggregate(m=Min('last_updated'))['m']
+        if oldest is None:
+            self.stdout.write(self.style.SUCCESS(f'Nothing older than {cutoff_day.isoformat()} to archive'))
+            return
+
+        self.stdout.write(f'Archiving history before {cutoff_day.isoformat()} to {root}...')
+        total_rows = total_files = 0
+        day = oldest.astimezone(dt_timezone.utc).date()
+        while day < cutoff_day:
+            start = datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
+            day_rows = BusLocation.objects.filter(last_updated__gte=start, last_updated__lt=start + timedelta(days=1))
+            owner_ids = day_rows.order_by().values_list('bus__owner_id', flat=True).distinct()
+            for owner_id in list(owner_ids):
+                path, rows, max_pk = archive_day(owner_id, day, root=root, chunk_size=chunk_size)
+                if not rows:
+                    continue
+                deleted = 0
+                if not options['keep']:
+                    # Only rows that made it into the file; late inserts wait for the next run
+                    archived = day_rows.filter(bus__owner_id=owner_id, pk__lte=max_pk).order_by('pk')
+                    deleted = self._delete_in_chunks(archived, chunk_size, options['sleep'])
+                self.stdout.write(f'✓ owner {owner_id} {day.isoformat()}: {rows} rows -> {path.name}'
+                                  f' ({deleted} deleted)')
+                total_rows += rows
+                total_files += 1
+            day += timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archive complete: {total_rows} rows in {total_files} files'
+        ))
+
+    @staticmethod
+    def _delete_in_chunks(queryset, chunk_size, pause):
+        deleted = 0
+        while True:
+            pks = list(queryset.values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                return deleted
+            deleted += BusLocation.objects.filter(pk__in=pks).delete()[0]
+            if pause:
+                time.sleep(pause)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking_app.query_audit import HOT_QUERIES, audit
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the registered hot queries and fail if any does a full scan of a history table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--query', dest='names', action='append', choices=sorted(HOT_QUERIES),
+                            help='Only audit this query (repeatable)')
+
+    def handle(self, *args, **options):
+        try:
+            results = audit(options['names'])
+        except NotImplementedError as e:
+            raise CommandError(str(e))
+
+        failures = []
+        for query, plan, scanned in results:
+            if scanned:
+                failures.append(query.name)
+                self.stdout.write(self.style.ERROR(f'✗ {query.name}: full scan of {", ".join(scanned)}'))
+            else:
+                self.stdout.write(f'✓ {query.name}')
+            if scanned or options['verbosity'] > 1:
+                if query.description:
+                    self.stdout.write(f'    ({query.description})')
+                for line in plan:
+                    self.stdout.write(f'    {line}')
+
+        if failures:
+            raise CommandError(f'{len(failures)} of {len(results)} hot queries fall back to a full scan: '
+                               f'{", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS(f'Index audit passed: {len(results)} queries use indexes'))
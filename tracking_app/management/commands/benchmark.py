@@ -0,0 +1,77 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking_app.benchmark import (
+    SCENARIOS, check_destructive, compare, default_baseline_path, load_baseline, run_benchmarks, save_baseline,
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ingest and read endpoints on a seeded fleet and compare against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buses', type=int, default=100, help='Buses in the seeded fleet')
+        parser.add_argument('--history', type=int, default=20, help='Stored fixes per bus before the run')
+        parser.add_argument('--iterations', type=int, default=50, help='Calls per scenario')
+        parser.add_argument('--scenario', dest='names', action='append', choices=list(SCENARIOS),
+                            help='Only run this scenario (repeatable)')
+        parser.add_argument('--live', metavar='URL', default=None,
+                            help='Drive a running server (e.g. http://127.0.0.1:8000) instead of the test client')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default=None, help='Baseline JSON file (default: BENCHMARK_BASELINE)')
+        parser.add_argument('--save-baseline', action='store_true', help='Write this run as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=None,
+                            help='Allowed relative slowdown before failing (default: BENCHMARK_TOLERANCE)')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded benchmark data')
+        parser.add_argument('--allow-destructive', action='store_true',
+                            help='Allow seeding and deleting benchmark data outside a test database')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        baseline_path = options['baseline'] or default_baseline_path()
+        tolerance = options['tolerance']
+        if tolerance is None:
+            tolerance = getattr(settings, 'BENCHMARK_TOLERANCE', 0.3)
+
+        try:
+            check_destructive(options['allow_destructive'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        # Without a baseline there is nothing to gate on; fail before spending the run
+        if not options['save_baseline'] and not os.path.exists(baseline_path):
+            raise CommandError(f'No baseline at {baseline_path}; run with --save-baseline to record one')
+
+        self.stdout.write(f'Seeding {options["buses"]} buses x {options["history"]} fixes...')
+        report = run_benchmarks(
+            buses=options['buses'], history=options['history'], iterations=options['iterations'],
+            names=options['names'], live_url=options['live'], seed=options['seed'], keep=options['keep'],
+            allow_destructive=options['allow_destructive'],
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            for result in report['scenarios'].values():
+                queries = result['queries_per_call']
+                self.stdout.write(
+                    f'  {result["scenario"]:<24} {result["throughput"]:>9.1f}/s  '
+                    f'p50 {result["p50_ms"]:>8.2f} ms  p95 {result["p95_ms"]:>8.2f} ms  '
+                    f'p99 {result["p99_ms"]:>8.2f} ms  '
+                    f'{"-" if queries is None else queries:>6} queries/call  '
+                    f'{result["errors"]} errors  peak RSS {result["peak_rss_mb"]} MB'
+                )
+
+        if options['save_baseline']:
+            save_baseline(report, baseline_path)
+            self.stdout.write(self.style.SUCCESS(f'✓ Baseline saved to {baseline_path}'))
+            return
+
+        regressions = compare(report, load_baseline(baseline_path), tolerance)
+        for message in regressions:
+            self.stdout.write(self.style.ERROR(f'✗ {message}'))
+        if regressions:
+            raise CommandError(f'{len(regressions)} benchmark regression(s) against {baseline_path}')
+        self.stdout.write(self.style.SUCCESS(f'✓ Within {tolerance:.0%} of baseline {baseline_path}'))
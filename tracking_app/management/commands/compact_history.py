@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tracking_app.models import Bus
+from tracking_app.trajectory import compact_bus_history
+
+
+class Command(BaseCommand):
+    help = 'Replace old raw BusLocation history with simplified per-trip trajectories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-hours', type=float, default=24,
+                            help='Only compact fixes older than this (default: 24)')
+        parser.add_argument('--tolerance-m', type=float, default=5.0,
+                            help='Douglas-Peucker tolerance in metres (default: 5)')
+        parser.add_argument('--trip-gap-minutes', type=float, default=10,
+                            help='A gap longer than this starts a new trip (default: 10)')
+        parser.add_argument('--bus', dest='bus_ids', action='append',
+                            help='Only compact this bus_id (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows fetched/deleted per query (default: 2000)')
+        parser.add_argument('--max-trip-fixes', type=int, default=10000,
+                            help='Split trips longer than this many fixes (default: 10000)')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(hours=options['older_than_hours'])
+        buses = Bus.objects.filter(locations__last_updated__lt=before).distinct().order_by('id')
+        if options['bus_ids']:
+            buses = buses.filter(bus_id__in=options['bus_ids'])
+
+        self.stdout.write(f'Compacting history older than {before.isoformat()} '
+                          f'(tolerance {options["tolerance_m"]} m)...')
+        total_raw = total_kept = total_trips = 0
+        for bus in buses.iterator():
+            trips, raw, kept = compact_bus_history(
+                bus,
+                before,
+                tolerance_m=options['tolerance_m'],
+                trip_gap_seconds=options['trip_gap_minutes'] * 60,
+                chunk_size=options['chunk_size'],
+                max_trip_fixes=options['max_trip_fixes'],
+            )
+            if trips:
+                self.stdout.write(f'✓ {bus.bus_id}: {trips} trips, {raw} fixes -> {kept} points')
+            total_trips += trips
+            total_raw += raw
+            total_kept += kept
+
+        ratio = f'{total_raw / total_kept:.1f}x' if total_kept else 'n/a'
+        self.stdout.write(self.style.SUCCESS(
+            f'Compaction complete: {total_trips} trips, {total_raw} fixes -> {total_kept} points ({ratio})'
+        ))
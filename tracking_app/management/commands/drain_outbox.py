@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking_app.outbox import drain_batch
+from tracking_app.sinks import build_sink
+
+
+class Command(BaseCommand):
+    help = 'Publish queued realtime location updates (LocationOutbox) to the configured sinks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sink',
+            action='append',
+            dest='sinks',
+            help='Sink to publish to (firestore, memory, file). Repeatable. Defaults to REALTIME_SINK.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Outbox rows per batch')
+        parser.add_argument('--once', action='store_true', help='Drain the current backlog and exit')
+        parser.add_argument('--idle-sleep', type=float, default=1.0, help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--retry-sleep', type=float, default=5.0, help='Seconds to wait after a failed publish')
+
+    def handle(self, *args, **options):
+        names = options['sinks'] or [getattr(settings, 'REALTIME_SINK', 'firestore')]
+        sinks = []
+        for name in names:
+            sink = build_sink(name, background=False)
+            if sink is None:
+                raise CommandError(f'Sink "{name}" is not available')
+            sinks.append(sink)
+
+        self.stdout.write(f'Draining outbox to: {", ".join(names)}')
+        total = 0
+        try:
+            while True:
+                try:
+                    delivered = drain_batch(sinks, batch_size=options['batch_size'])
+                except Exception as e:
+                    self.stderr.write(f'Publish failed, will retry: {e}')
+                    if options['once']:
+                        raise CommandError('Outbox drain failed') from e
+                    time.sleep(options['retry_sleep'])
+                    continue
+
+                total += delivered
+                if delivered:
+                    self.stdout.write(f'✓ Published {delivered} updates ({total} total)')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['idle_sleep'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'Outbox drain stopped, {total} updates published'))
@@ -0,0 +1,73 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tracking_app.retention import Throttle, enforce_owner, retention_windows
+from tracking_app.rollups import fold_days
+
+
+class Command(BaseCommand):
+    help = ('Delete location history (raw, compacted, rollups, archive files) older than each owner\'s '
+            'retention window, in throttled batches, and fold old rollup minutes into days')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'RETENTION_BATCH_SIZE', 1000),
+                            help='Rows deleted per batch/transaction')
+        parser.add_argument('--sleep', type=float, default=0.05, help='Minimum seconds to pause between batches')
+        parser.add_argument('--duty', type=float, default=0.5,
+                            help='Max fraction of wall-clock time spent deleting (default: 0.5)')
+        parser.add_argument('--owner', type=int, dest='owners', action='append',
+                            help='Only enforce this owner id (repeatable)')
+        parser.add_argument('--loop', action='store_true', help='Keep running, one pass every --interval seconds')
+        parser.add_argument('--interval', type=float, default=300.0, help='Seconds between passes with --loop')
+        parser.add_argument('--report-every', type=int, default=10000,
+                            help='Print progress every N deleted rows per owner')
+
+    def handle(self, *args, **options):
+        throttle = Throttle(options['sleep'], options['duty'])
+        total = 0
+        try:
+            while True:
+                total += self._run_pass(throttle, options)
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'Retention stopped, {total} location rows deleted'))
+
+    def _run_pass(self, throttle, options):
+        windows = retention_windows()
+        if options['owners']:
+            windows = {owner: days for owner, days in windows.items() if owner in options['owners']}
+
+        deleted_total = 0
+        started = time.monotonic()
+        for owner_id, days in sorted(windows.items(), key=lambda item: (item[0] is None, item[0] or 0)):
+            folded = fold_days(owner_id)
+            if folded:
+                self.stdout.write(f'✓ owner {owner_id}: {folded} rollup minutes folded into days')
+            if not days:
+                continue
+            reported = [0]
+
+            def progress(deleted, owner_id=owner_id):
+                if deleted - reported[0] >= options['report_every']:
+                    rate = deleted / max(time.monotonic() - started, 1e-6)
+                    self.stdout.write(f'  owner {owner_id}: {deleted} rows deleted ({rate:.0f}/s)')
+                    reported[0] = deleted
+
+            counts = enforce_owner(
+                owner_id, days, batch_size=options['batch_size'], throttle=throttle, progress=progress
+            )
+            if any(counts.values()):
+                self.stdout.write(f'✓ owner {owner_id} ({days} days): {counts["locations"]} locations, '
+                                  f'{counts["trajectories"]} trajectories, {counts["rollups"]} rollups, '
+                                  f'{counts["archive_files"]} archive files deleted')
+            deleted_total += counts['locations']
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Pass complete: {deleted_total} rows in {elapsed:.1f}s')
+        return deleted_total
@@ -0,0 +1,50 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking_app.export import FORMATS, export_rows, stream_export
+from tracking_app.ingest import parse_timestamp
+
+
+class Command(BaseCommand):
+    help = 'Stream an owner\'s BusLocation history as CSV or NDJSON (optionally gzipped)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('owner', help='Username of the owning admin')
+        parser.add_argument('--format', choices=FORMATS, default='csv', help='Output format (default: csv)')
+        parser.add_argument('--gzip', action='store_true', help='Gzip-compress the output')
+        parser.add_argument('--from', dest='start', help='Only rows at or after this ISO-8601 time')
+        parser.add_argument('--to', dest='end', help='Only rows at or before this ISO-8601 time')
+        parser.add_argument('--bus', dest='bus_ids', action='append', help='Only this bus_id (repeatable)')
+        parser.add_argument('--output', '-o', help='Write to this file instead of stdout')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per cursor round trip')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["owner"]}" does not exist')
+        try:
+            start = parse_timestamp(options['start']) if options['start'] else None
+            end = parse_timestamp(options['end']) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid --from/--to: {e}')
+
+        rows = export_rows(owner, start, end, options['bus_ids'], chunk_size=options['chunk_size'])
+        chunks = stream_export(rows, options['format'], options['gzip'])
+
+        written = 0
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f'✓ Exported {written} bytes to {options["output"]}'))
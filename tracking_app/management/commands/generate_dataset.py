@@ -0,0 +1,65 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking_app.synthetic import DatasetSpec, clear, copy_supported, generate
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic dataset (owners, routes, stops, drivers, buses, schedules, history)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owners', type=int, default=1)
+        parser.add_argument('--routes', type=int, default=5, help='Routes per owner')
+        parser.add_argument('--stops', type=int, default=10, help='Stops per route')
+        parser.add_argument('--drivers', type=int, default=10, help='Drivers per owner')
+        parser.add_argument('--buses', type=int, default=20, help='Buses per owner')
+        parser.add_argument('--months', type=float, default=None, help='Months of history (30 days each)')
+        parser.add_argument('--days', type=int, default=7, help='Days of history (ignored with --months)')
+        parser.add_argument('--end', type=date.fromisoformat, default=None,
+                            help='History ends at midnight UTC of this date (default: today)')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between fixes while moving')
+        parser.add_argument('--service-start', type=int, default=6, help='Hour (UTC) the service day starts')
+        parser.add_argument('--service-hours', type=float, default=16)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='SYN', help='Prefix of generated ids and owner usernames')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Rows per bulk_create/COPY')
+        parser.add_argument('--no-copy', action='store_true', help='Use bulk_create even on PostgreSQL')
+        parser.add_argument('--clear', action='store_true', help='Delete a dataset with the same prefix first')
+        parser.add_argument('--dry-run', action='store_true', help='Only print the estimated row count')
+
+    def handle(self, *args, **options):
+        days = round(options['months'] * 30) if options['months'] is not None else options['days']
+        if days < 0 or options['interval'] <= 0 or not 0 < options['service_hours'] <= 24:
+            raise CommandError('days must be >= 0, interval > 0 and service hours in (0, 24]')
+        spec = DatasetSpec(
+            owners=options['owners'], routes=options['routes'], stops=options['stops'],
+            drivers=options['drivers'], buses=options['buses'], days=days, end=options['end'],
+            interval=options['interval'], service_start=options['service_start'],
+            service_hours=options['service_hours'], seed=options['seed'], prefix=options['prefix'],
+        )
+        use_copy = copy_supported() and not options['no_copy']
+        total_buses = spec.owners * spec.buses
+        self.stdout.write(
+            f'{spec.owners} owners, {total_buses} buses, {days} days '
+            f'({spec.start.date()} to {spec.end.date()}): about {spec.estimated_locations():,} locations '
+            f'via {"COPY" if use_copy else "bulk_create"}'
+        )
+        if options['dry_run']:
+            return
+
+        if options['clear']:
+            deleted = clear(spec.prefix)
+            self.stdout.write(f'✓ Cleared previous {spec.prefix} dataset ({deleted:,} locations)')
+
+        report_every = max(options['chunk_size'], 500000)
+        last = [0]
+
+        def progress(written, elapsed):
+            if written - last[0] >= report_every:
+                last[0] = written
+                self.stdout.write(f'  {written:,} locations ({written / max(elapsed, 1e-9):,.0f}/s)')
+
+        buses, written = generate(spec, chunk_size=options['chunk_size'], use_copy=use_copy, progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'✓ Generated {buses} buses and {written:,} locations'))
+        self.stdout.write('Run `python manage.py rebuild_rollups` to populate analytics rollups for this history')
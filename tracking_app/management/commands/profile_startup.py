@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking_app.startup import measure_startup, top_imports
+
+
+class Command(BaseCommand):
+    help = 'Measure cold start: per-module import time and per-app ready() time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='Number of slowest imports to show')
+        parser.add_argument(
+            '--budget-ms',
+            type=float,
+            default=None,
+            help='Fail if django.setup() takes longer (defaults to STARTUP_TIME_BUDGET_MS)',
+        )
+
+    def handle(self, *args, **options):
+        report = measure_startup()
+        budget = options['budget_ms'] or getattr(settings, 'STARTUP_TIME_BUDGET_MS', None)
+
+        self.stdout.write(f"Total boot: {report['total_ms']:.1f} ms (django.setup(): {report['setup_ms']:.1f} ms)")
+
+        self.stdout.write('\nAppConfig.ready():')
+        for label, ms in sorted(report['ready_ms'].items(), key=lambda kv: kv[1], reverse=True):
+            self.stdout.write(f'  {label:<24} {ms:8.2f} ms')
+
+        self.stdout.write(f"\nSlowest imports (cumulative, top {options['top']}):")
+        for entry in top_imports(report, options['top']):
+            self.stdout.write(
+                f"  {entry['module']:<48} {entry['cumulative_us'] / 1000:8.2f} ms"
+                f"  (self {entry['self_us'] / 1000:.2f} ms)"
+            )
+
+        if 'firebase_admin' in report['modules']:
+            self.stdout.write(self.style.WARNING('\nfirebase_admin was imported during startup'))
+
+        if budget is not None:
+            if report['setup_ms'] > budget:
+                raise CommandError(f"Startup budget exceeded: {report['setup_ms']:.1f} ms > {budget:.0f} ms")
+            self.stdout.write(self.style.SUCCESS(f'\nWithin startup budget ({budget:.0f} ms)'))
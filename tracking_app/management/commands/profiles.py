@@ -0,0 +1,75 @@
+import pstats
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking_app.profiling import clear_profiles, list_profiles, load_profile, profile_dir, pstats_path
+
+
+class Command(BaseCommand):
+    help = 'List, inspect or export request profiles captured by the profiling middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', default=None,
+                            help='Show this profile (default: list all, newest first)')
+        parser.add_argument('--top', type=int, default=20, help='Functions to show (default: 20)')
+        parser.add_argument('--sql', action='store_true', help='Also print the SQL timeline')
+        parser.add_argument('--pstats', action='store_true',
+                            help='Print the full pstats report from the raw dump instead of the stored summary')
+        parser.add_argument('--export', metavar='PATH', default=None,
+                            help='Copy the raw pstats dump to PATH (for snakeviz, pstats, ...)')
+        parser.add_argument('--clear', action='store_true', help='Delete all stored profiles')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            removed = clear_profiles()
+            self.stdout.write(self.style.SUCCESS(f'✓ Removed {removed} profile(s) from {profile_dir()}'))
+            return
+        if options['profile_id'] is None:
+            return self._list()
+
+        profile_id = options['profile_id']
+        record = load_profile(profile_id)
+        if record is None:
+            raise CommandError(f'No profile {profile_id} in {profile_dir()}')
+
+        if options['export']:
+            source = pstats_path(profile_id)
+            if source is None:
+                raise CommandError(f'Profile {profile_id} has no pstats dump')
+            shutil.copyfile(source, options['export'])
+            self.stdout.write(self.style.SUCCESS(f'✓ pstats dump written to {options["export"]}'))
+            return
+
+        self.stdout.write(
+            f'{record["method"]} {record["path"]} ({record["view"]}) -> {record["status"]} '
+            f'in {record["duration_ms"]:.1f} ms, {record["query_count"]} queries '
+            f'({record["query_ms"]:.1f} ms), {record["trigger"]} at {record["started_at"]}'
+        )
+        if options['pstats']:
+            stats = pstats.Stats(str(pstats_path(profile_id)), stream=self.stdout)
+            stats.sort_stats('cumulative').print_stats(options['top'])
+        else:
+            self.stdout.write(f'{"cumtime ms":>12} {"tottime ms":>12} {"calls":>8}  function')
+            for row in record['functions'][:options['top']]:
+                self.stdout.write(f'{row["cumtime_ms"]:>12.3f} {row["tottime_ms"]:>12.3f} '
+                                  f'{row["calls"]:>8}  {row["function"]}')
+
+        if options['sql']:
+            self.stdout.write(f'\nSQL timeline ({record["query_count"]} statements):')
+            for query in record['queries']:
+                self.stdout.write(f'  +{query["offset_ms"]:>9.3f} ms  {query["duration_ms"]:>8.3f} ms  {query["sql"]}')
+            if record['queries_dropped']:
+                self.stdout.write(f'  ... {record["queries_dropped"]} more not stored (PROFILE_MAX_QUERIES)')
+
+    def _list(self):
+        profiles = list_profiles()
+        if not profiles:
+            self.stdout.write(f'No profiles in {profile_dir()}; send "X-Profile: 1" as a staff user '
+                              'or set PROFILE_SAMPLE_RATE to capture some')
+            return
+        for summary in profiles:
+            self.stdout.write(
+                f'{summary["id"]}  {summary["duration_ms"]:>9.1f} ms  {summary["query_count"]:>5} queries  '
+                f'{summary["status"]}  {summary["method"]} {summary["path"]}  [{summary["trigger"]}]'
+            )
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from tracking_app.models import BusLocation
+from tracking_app.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-minute LocationRollup rows from raw BusLocation history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=None,
+                            help='Only rebuild the last N hours (default: all stored history)')
+        parser.add_argument('--owner', type=int, default=None, help='Only rebuild this owner id')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows fetched per query')
+
+    def handle(self, *args, **options):
+        end = timezone.now() + timedelta(minutes=1)
+        if options['hours'] is not None:
+            start = end - timedelta(hours=options['hours'])
+        else:
+            start = BusLocation.objects.aggregate(m=Min('last_updated'))['m']
+            if start is None:
+                self.stdout.write(self.style.SUCCESS('No location history to roll up'))
+                return
+
+        self.stdout.write(f'Rebuilding rollups from {start.isoformat()}...')
+        written, skipped = rebuild(start, end, owner_id=options['owner'], chunk_size=options['chunk_size'])
+        if skipped:
+            self.stdout.write(f'✗ Skipped {len(skipped)} bus(es) whose raw history in the range was '
+                              'compacted, archived or folded; their rollups were kept')
+        self.stdout.write(self.style.SUCCESS(f'✓ Rollups rebuilt: {written} bus-minutes'))
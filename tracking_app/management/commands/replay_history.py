@@ -0,0 +1,70 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from tracking_app.export import export_rows, read_export
+from tracking_app.ingest import parse_timestamp
+from tracking_app.replay import TIMESTAMP_MODES, replay
+
+
+class Command(BaseCommand):
+    help = 'Re-send recorded location history (database or export file) to the ingest API at N x real time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server base URL (http only)')
+        parser.add_argument('--speed', type=float, default=1.0, help='Replay speed multiplier (10 = 10x real time)')
+        parser.add_argument('--file', default=None, help='Replay an export file (CSV/NDJSON, optionally gzip)')
+        parser.add_argument('--owner', default=None, help='Only replay buses of this username')
+        parser.add_argument('--from', dest='start', default=None, help='Start time (ISO-8601 or epoch seconds)')
+        parser.add_argument('--to', dest='end', default=None, help='End time (ISO-8601 or epoch seconds)')
+        parser.add_argument('--bus', dest='bus_ids', action='append', default=None, help='Only this bus_id (repeatable)')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many fixes')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Max fixes per request (1 = /api/update_location/)')
+        parser.add_argument('--connections', type=int, default=8, help='Keep-alive connections (send lanes)')
+        parser.add_argument('--timestamps', choices=TIMESTAMP_MODES, default='now',
+                            help='Stamp fixes with their (accelerated) due time (default) or keep the recorded time')
+        parser.add_argument('--report-every', type=float, default=10.0, help='Seconds between progress lines')
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_timestamp(options['start']) if options['start'] else None
+            end = parse_timestamp(options['end']) if options['end'] else None
+        except ValueError:
+            raise CommandError('Invalid --from/--to time')
+
+        if options['file']:
+            rows = read_export(options['file'])
+            if start or end or options['bus_ids']:
+                wanted = set(options['bus_ids'] or [])
+                rows = (
+                    row for row in rows
+                    if (not start or row[5] >= start) and (not end or row[5] <= end)
+                    and (not wanted or row[0] in wanted)
+                )
+            source = options['file']
+        else:
+            owner = None
+            if options['owner']:
+                owner = User.objects.filter(username=options['owner']).first()
+                if owner is None:
+                    raise CommandError(f'User "{options["owner"]}" not found')
+            rows = export_rows(owner, start, end, options['bus_ids'])
+            source = 'BusLocation history'
+        if options['limit']:
+            rows = (row for _, row in zip(range(options['limit']), rows))
+
+        self.stdout.write(f'Replaying {source} to {options["url"]} at {options["speed"]:g}x '
+                          f'({options["connections"]} connections, batches of {options["batch_size"]})...')
+        try:
+            replayer = replay(
+                rows, options['url'], report_every=options['report_every'], report=self.stdout.write,
+                speed=options['speed'], batch_size=options['batch_size'],
+                connections=options['connections'], timestamps=options['timestamps'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        except KeyboardInterrupt:
+            raise CommandError('Replay interrupted')
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Replay finished in {replayer.elapsed:.1f}s: {replayer.stats.summary(replayer.elapsed, window=False)}'
+        ))
@@ -0,0 +1,218 @@
+# tracking_app/metrics.py
+"""
+Per-endpoint request metrics in Prometheus text format.
+
+MetricsMiddleware times every request and records, under the URL name of the
+view that answered it: a latency histogram, DB query count and time (through
+connection.execute_wrapper), response bytes and cache hits/misses. Cache
+lookups report themselves with record_cache(). The /metrics view renders the
+registry.
+
+The cost per request is a few counters. Each URL name gets one preallocated
+ViewMetrics the first time it is seen, and requests that match no URL share
+one label, so memory stays bounded whatever clients send. Counters live in
+the process: with several workers, each scrape shows the worker that
+answered it. Prometheus handles this as counter resets/instances.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+# Upper bounds in seconds; the implicit +Inf bucket is the total count
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED = '<unmatched>'
+
+
+class ViewMetrics:
+    __slots__ = ('buckets', 'count', 'seconds', 'statuses', 'queries', 'query_seconds',
+                 'response_bytes', 'cache_hits', 'cache_misses')
+
+    def __init__(self, bucket_count):
+        self.buckets = [0] * bucket_count
+        self.count = 0
+        self.seconds = 0.0
+        self.statuses = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.response_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def _view(self, view):
+        metrics = self._views.get(view)
+        if metrics is None:
+            metrics = self._views[view] = ViewMetrics(len(self.buckets))
+        return metrics
+
+    def observe(self, view, status, seconds, stats, response_bytes):
+        """Record one finished request (`stats` is its RequestStats)"""
+        status_class = f'{status // 100}xx'
+        bucket = bisect_left(self.buckets, seconds)
+        with self._lock:
+            metrics = self._view(view)
+            if bucket < len(self.buckets):
+                metrics.buckets[bucket] += 1
+            metrics.count += 1
+            metrics.seconds += seconds
+            metrics.statuses[status_class] = metrics.statuses.get(status_class, 0) + 1
+            metrics.queries += stats.queries
+            metrics.query_seconds += stats.query_seconds
+            metrics.response_bytes += response_bytes
+            metrics.cache_hits += stats.cache_hits
+            metrics.cache_misses += stats.cache_misses
+
+    def add_response_bytes(self, view, count):
+        with self._lock:
+            self._view(view).response_bytes += count
+
+    def snapshot(self):
+        """{view: ViewMetrics copy}, consistent across views"""
+        with self._lock:
+            copies = {}
+            for view, metrics in self._views.items():
+                copy = ViewMetrics(0)
+                for field in ViewMetrics.__slots__:
+                    value = getattr(metrics, field)
+                    setattr(copy, field, value.copy() if isinstance(value, (list, dict)) else value)
+                copies[view] = copy
+            return copies
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4"""
+        views = sorted(self.snapshot().items())
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        family('tracking_http_requests_total', 'counter', 'Requests by URL name and status class')
+        for view, metrics in views:
+            for status_class, count in sorted(metrics.statuses.items()):
+                lines.append(f'tracking_http_requests_total{{view="{_escape(view)}",status="{status_class}"}} {count}')
+
+        family('tracking_http_request_duration_seconds', 'histogram', 'Request latency by URL name')
+        for view, metrics in views:
+            label = _escape(view)
+            cumulative = 0
+            for bound, count in zip(self.buckets, metrics.buckets):
+                cumulative += count
+                lines.append(f'tracking_http_request_duration_seconds_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'tracking_http_request_duration_seconds_bucket{{view="{label}",le="+Inf"}} {metrics.count}')
+            lines.append(f'tracking_http_request_duration_seconds_sum{{view="{label}"}} {metrics.seconds:.6f}')
+            lines.append(f'tracking_http_request_duration_seconds_count{{view="{label}"}} {metrics.count}')
+
+        for name, field, help_text in (
+            ('tracking_http_db_queries_total', 'queries', 'Database queries run while serving requests'),
+            ('tracking_http_db_query_seconds_total', 'query_seconds', 'Time spent in database queries'),
+            ('tracking_http_response_bytes_total', 'response_bytes', 'Response body bytes sent'),
+            ('tracking_http_cache_hits_total', 'cache_hits', 'Cache lookups answered from the cache'),
+            ('tracking_http_cache_misses_total', 'cache_misses', 'Cache lookups that had to compute'),
+        ):
+            family(name, 'counter', help_text)
+            for view, metrics in views:
+                value = getattr(metrics, field)
+                value = f'{value:.6f}' if isinstance(value, float) else value
+                lines.append(f'{name}{{view="{_escape(view)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = MetricsRegistry()
+
+
+# ============= Request collection =============
+
+class RequestStats:
+    """Per-request counters; also the execute_wrapper that counts and times queries"""
+    __slots__ = ('queries', 'query_seconds', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - started
+
+
+_current = ContextVar('tracking_request_stats', default=None)
+
+
+def record_cache(hit):
+    """Count a cache lookup against the request being served (no-op outside requests)"""
+    stats = _current.get()
+    if stats is None:
+        return
+    if hit:
+        stats.cache_hits += 1
+    else:
+        stats.cache_misses += 1
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else UNMATCHED
+
+
+def _count_streamed(chunks, view):
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        REGISTRY.add_response_bytes(view, sent)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(stats):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        seconds = time.perf_counter() - started
+
+        view = view_label(request)
+        if response.streaming:
+            # Streamed bodies are counted as they are sent, after this returns
+            response.streaming_content = _count_streamed(response.streaming_content, view)
+            size = 0
+        else:
+            size = len(response.content)
+        REGISTRY.observe(view, response.status_code, seconds, stats, size)
+        return response
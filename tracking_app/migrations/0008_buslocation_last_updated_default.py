@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking_app', '0007_locationoutbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='buslocation',
+            name='last_updated',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking_app', '0008_buslocation_last_updated_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, help_text='Time of the latest fix received, stored or not', null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking_app', '0009_bus_last_seen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompactTrajectory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('raw_points', models.IntegerField(help_text='Number of raw fixes this row replaced')),
+                ('point_count', models.IntegerField(help_text='Number of points kept after simplification')),
+                ('tolerance_m', models.FloatField(help_text='Simplification tolerance in metres')),
+                ('encoded', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('bus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trajectories', to='tracking_app.bus')),
+            ],
+            options={
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['bus', 'started_at'], name='trajectory_bus_start_idx')],
+            },
+        ),
+    ]
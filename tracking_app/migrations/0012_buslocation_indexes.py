@@ -0,0 +1,59 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class AddIndexConcurrentlyOnPostgres(migrations.AddIndex):
+    """
+    CREATE INDEX CONCURRENTLY on PostgreSQL, so building the index doesn't
+    block writes to the table; a plain AddIndex on other databases.
+    """
+
+    def _operation(self, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return None
+        # Imported here: django.contrib.postgres needs psycopg, which SQLite installs don't have
+        from django.contrib.postgres.operations import AddIndexConcurrently
+        return AddIndexConcurrently(self.model_name, self.index)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        operation = self._operation(schema_editor)
+        if operation is None:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            operation.database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        operation = self._operation(schema_editor)
+        if operation is None:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            operation.database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+    # Concurrent index builds can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('tracking_app', '0011_retentionpolicy'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='buslocation',
+            index=models.Index(fields=['bus', '-last_updated'], name='buslocation_bus_time_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='buslocation',
+            index=models.Index(fields=['last_updated'], name='buslocation_time_idx'),
+        ),
+        # Drop the plain FK index only once the composite index covering it exists
+        # (a DROP INDEX, no table rebuild on PostgreSQL)
+        migrations.AlterField(
+            model_name='buslocation',
+            name='bus',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='locations', to='tracking_app.bus'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking_app', '0012_buslocation_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField(help_text='Start of the minute (UTC)')),
+                ('fix_count', models.IntegerField(default=0)),
+                ('distance_m', models.FloatField(default=0.0, help_text='Distance travelled, including the segment from the previous fix')),
+                ('max_speed', models.FloatField(default=0.0)),
+                ('speed_sum', models.FloatField(default=0.0, help_text='Sum of reported speeds; average = speed_sum / fix_count')),
+                ('last_latitude', models.FloatField(blank=True, null=True)),
+                ('last_longitude', models.FloatField(blank=True, null=True)),
+                ('last_at', models.DateTimeField(blank=True, null=True)),
+                ('bus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='tracking_app.bus')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='location_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-minute'],
+                'indexes': [models.Index(fields=['owner', 'minute'], name='rollup_owner_minute_idx')],
+                'constraints': [models.UniqueConstraint(fields=('bus', 'minute'), name='unique_rollup_per_bus_minute')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking_app', '0013_locationrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='idle_seconds',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='last_fix_at',
+            field=models.DateTimeField(blank=True, help_text='Time of the latest stored fix', null=True),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='last_fix_latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='last_fix_longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='last_moved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='moving_seconds',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='odometer_km',
+            field=models.FloatField(default=0.0, help_text='Distance travelled since tracking started'),
+        ),
+    ]
@@ -44,6 +44,15 @@ class Bus(models.Model):
     vehicle_type = models.CharField(max_length=20, choices=VEHICLE_TYPES, default="bus")
     capacity = models.IntegerField(default=50)
     current_speed = models.FloatField(default=0.0, help_text="Current speed in km/h")
+    last_seen = models.DateTimeField(null=True, blank=True, help_text="Time of the latest fix received, stored or not")
+    # Derived incrementally from stored fixes at ingest (see odometer.py)
+    odometer_km = models.FloatField(default=0.0, help_text="Distance travelled since tracking started")
+    moving_seconds = models.FloatField(default=0.0)
+    idle_seconds = models.FloatField(default=0.0)
+    last_moved_at = models.DateTimeField(null=True, blank=True)
+    last_fix_latitude = models.FloatField(null=True, blank=True)
+    last_fix_longitude = models.FloatField(null=True, blank=True)
+    last_fix_at = models.DateTimeField(null=True, blank=True, help_text="Time of the latest stored fix")
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -59,16 +68,23 @@ class Bus(models.Model):
         """Get the latest location of this bus"""
         return self.locations.first()  # Latest location
     
-    def get_current_schedule(self, current_datetime=None):
-        """Get the currently active schedule for this bus with exception handling"""
+    def get_current_schedule(self, current_datetime=None, exceptions=None, schedules=None):
+        """
+        Get the currently active schedule for this bus with exception handling.
+        `exceptions`/`schedules` are this bus's rows for that date when already
+        fetched (see current_schedule_prefetches); otherwise they are queried.
+        """
         if current_datetime is None:
             current_datetime = timezone.now()
         
         # First check for exceptions on this date
-        exception = self.schedule_exceptions.filter(
-            exception_date=current_datetime.date(),
-            is_active=True
-        ).first()
+        if exceptions is None:
+            exception = self.schedule_exceptions.filter(
+                exception_date=current_datetime.date(),
+                is_active=True
+            ).first()
+        else:
+            exception = exceptions[0] if exceptions else None
         
         if exception:
             if exception.exception_type in ['cancel', 'maintenance', 'holiday']:
@@ -86,12 +102,14 @@ class Bus(models.Model):
         
         # No exception, check for active schedules
         current_weekday = current_datetime.weekday()
-        active_schedules = self.schedules.filter(
-            is_active=True,
-            effective_from__lte=current_datetime.date()
-        ).filter(
-            models.Q(effective_to__isnull=True) | models.Q(effective_to__gte=current_datetime.date())
-        ).order_by('-priority', 'start_time')
+        active_schedules = schedules
+        if active_schedules is None:
+            active_schedules = self.schedules.filter(
+                is_active=True,
+                effective_from__lte=current_datetime.date()
+            ).filter(
+                models.Q(effective_to__isnull=True) | models.Q(effective_to__gte=current_datetime.date())
+            ).order_by('-priority', 'start_time')
         
         # Manual check for weekday since SQLite doesn't support contains lookup
         active_schedule = None
@@ -152,17 +170,48 @@ class Bus(models.Model):
                 }
         return {'name': self.driver_name, 'mobile': self.driver_mobile}
 
+def current_schedule_prefetches(day):
+    """
+    Prefetches for a Bus queryset so get_current_schedule(when, bus.todays_exceptions,
+    bus.todays_schedules) for a datetime on `day` runs no queries per bus
+    """
+    return [
+        models.Prefetch(
+            'schedule_exceptions',
+            queryset=ScheduleException.objects.filter(exception_date=day, is_active=True).select_related(
+                'override_route', 'change_route', 'override_driver', 'change_driver',
+                'schedule__route', 'schedule__driver',
+            ).order_by('exception_date', 'id'),
+            to_attr='todays_exceptions',
+        ),
+        models.Prefetch(
+            'schedules',
+            queryset=Schedule.objects.filter(is_active=True, effective_from__lte=day).filter(
+                models.Q(effective_to__isnull=True) | models.Q(effective_to__gte=day)
+            ).select_related('route', 'driver').order_by('-priority', 'start_time'),
+            to_attr='todays_schedules',
+        ),
+    ]
+
 class BusLocation(models.Model):
     """Bus location tracking"""
-    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='locations')
+    # Indexed through buslocation_bus_time_idx (bus_id is its leading column)
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='locations', db_index=False)
     latitude = models.FloatField()
     longitude = models.FloatField()
     speed = models.FloatField(default=0.0)  # Speed in km/h
     heading = models.FloatField(default=0.0)  # Direction in degrees
-    last_updated = models.DateTimeField(auto_now=True)
+    # Time of the fix; defaults to arrival time but batch/offline uploads may set it
+    last_updated = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-last_updated']
+        indexes = [
+            # Latest fix per bus, per-bus time ranges, owner + time (via the bus join)
+            models.Index(fields=['bus', '-last_updated'], name='buslocation_bus_time_idx'),
+            # Fleet-wide time windows and retention/archive cut-offs
+            models.Index(fields=['last_updated'], name='buslocation_time_idx'),
+        ]
     
     def __str__(self):
         return f"Bus {self.bus.bus_id} - {self.latitude}, {self.longitude}"
@@ -180,6 +229,95 @@ class BusLocation(models.Model):
         c = 2 * asin(sqrt(a))
         r = 6371  # Radius of earth in kilometers
         return c * r
+    
+    @classmethod
+    def latest_queryset(cls, buses):
+        """The latest fix of each bus in a Bus queryset (or iterable of bus pks), as one query"""
+        if not isinstance(buses, models.QuerySet):
+            buses = Bus.objects.filter(pk__in=list(buses))
+        # A correlated LIMIT 1 per bus walks buslocation_bus_time_idx, never the whole history
+        latest_ids = buses.order_by().annotate(
+            latest_id=models.Subquery(
+                cls.objects.filter(bus_id=models.OuterRef('pk')).order_by('-last_updated', '-id').values('id')[:1]
+            )
+        ).values('latest_id')
+        return cls.objects.filter(id__in=latest_ids).order_by()
+    
+    @classmethod
+    def latest_for(cls, buses):
+        """{bus pk: latest BusLocation}; buses without fixes are absent"""
+        return {location.bus_id: location for location in cls.latest_queryset(buses)}
+
+class CompactTrajectory(models.Model):
+    """Simplified path of one bus trip, replacing its old raw BusLocation rows"""
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='trajectories')
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    raw_points = models.IntegerField(help_text="Number of raw fixes this row replaced")
+    point_count = models.IntegerField(help_text="Number of points kept after simplification")
+    tolerance_m = models.FloatField(help_text="Simplification tolerance in metres")
+    # Polyline-encoded (lat, lng, seconds since started_at, speed) points, see trajectory.py
+    encoded = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['bus', 'started_at'], name='trajectory_bus_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"Bus {self.bus.bus_id} trip {self.started_at:%Y-%m-%d %H:%M} ({self.point_count}/{self.raw_points} pts)"
+
+class LocationOutbox(models.Model):
+    """Realtime fan-out queue, written in the same transaction as the BusLocation it describes"""
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"Outbox {self.id} - {self.payload.get('bus_id')}"
+
+class LocationRollup(models.Model):
+    """Per-bus, per-minute aggregate of stored fixes, maintained at ingest (see rollups.py)"""
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='location_rollups')
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='rollups')
+    minute = models.DateTimeField(help_text="Start of the minute (UTC)")
+    fix_count = models.IntegerField(default=0)
+    distance_m = models.FloatField(default=0.0, help_text="Distance travelled, including the segment from the previous fix")
+    max_speed = models.FloatField(default=0.0)
+    speed_sum = models.FloatField(default=0.0, help_text="Sum of reported speeds; average = speed_sum / fix_count")
+    # Latest fix in this minute, the starting point for the next segment
+    last_latitude = models.FloatField(null=True, blank=True)
+    last_longitude = models.FloatField(null=True, blank=True)
+    last_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-minute']
+        constraints = [
+            models.UniqueConstraint(fields=['bus', 'minute'], name='unique_rollup_per_bus_minute')
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'minute'], name='rollup_owner_minute_idx'),
+        ]
+
+    @property
+    def avg_speed(self):
+        return self.speed_sum / self.fix_count if self.fix_count else 0.0
+
+    def __str__(self):
+        return f"Bus {self.bus_id} {self.minute:%Y-%m-%d %H:%M} - {self.fix_count} fixes"
+
+class RetentionPolicy(models.Model):
+    """How long an owner's location history is kept (enforced by `manage.py enforce_retention`)"""
+    owner = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='retention_policy')
+    retention_days = models.PositiveIntegerField(help_text="Delete location history older than this; 0 keeps it forever")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.owner} - {self.retention_days} days"
 
 class UserLocation(models.Model):
     """User location for finding nearest buses"""
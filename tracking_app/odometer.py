@@ -0,0 +1,73 @@
+# tracking_app/odometer.py
+"""
+Per-bus derived state, updated incrementally as fixes are stored.
+
+For every pair of consecutive stored fixes of a bus (at most
+ROLLUP_MAX_GAP_SECONDS apart) DeriveStage adds the distance to
+Bus.odometer_km, sets Bus.current_speed to the speed implied by the pair, and
+books the interval as moving (at or above MOVING_SPEED_KMH) or idle. The bus
+rows of a batch are locked, updated in memory and written with one
+bulk_update, so admin lists and analytics read these values directly instead
+of rescanning BusLocation.
+"""
+from django.conf import settings
+
+from .models import Bus, BusLocation
+from .rollups import max_gap_seconds
+
+DERIVED_FIELDS = [
+    'odometer_km', 'current_speed', 'moving_seconds', 'idle_seconds', 'last_moved_at',
+    'last_fix_latitude', 'last_fix_longitude', 'last_fix_at',
+]
+
+
+def moving_speed_kmh():
+    return getattr(settings, 'MOVING_SPEED_KMH', 3.0)
+
+
+def advance(bus, latitude, longitude, reported_speed, recorded_at, gap_seconds=None, moving_kmh=None):
+    """Fold one fix into the bus's derived state; returns False for out-of-order fixes"""
+    gap_seconds = max_gap_seconds() if gap_seconds is None else gap_seconds
+    moving_kmh = moving_speed_kmh() if moving_kmh is None else moving_kmh
+    if bus.last_fix_at is not None and recorded_at <= bus.last_fix_at:
+        return False
+
+    speed = reported_speed or 0.0
+    if bus.last_fix_at is not None:
+        elapsed = (recorded_at - bus.last_fix_at).total_seconds()
+        if elapsed <= gap_seconds:
+            km = BusLocation.calculate_distance(bus.last_fix_latitude, bus.last_fix_longitude, latitude, longitude)
+            speed = km / (elapsed / 3600.0)
+            bus.odometer_km += km
+            if speed >= moving_kmh:
+                bus.moving_seconds += elapsed
+                bus.last_moved_at = recorded_at
+            else:
+                bus.idle_seconds += elapsed
+
+    bus.current_speed = round(speed, 2)
+    bus.last_fix_latitude, bus.last_fix_longitude, bus.last_fix_at = latitude, longitude, recorded_at
+    return True
+
+
+def record(locations):
+    """Advance the derived state of every bus in a stored batch; returns buses updated"""
+    by_bus = {}
+    for location in sorted(locations, key=lambda l: (l.bus_id, l.last_updated)):
+        by_bus.setdefault(location.bus_id, []).append(location)
+    if not by_bus:
+        return 0
+
+    gap, moving = max_gap_seconds(), moving_speed_kmh()
+    changed = []
+    buses = Bus.objects.select_for_update().filter(pk__in=list(by_bus)).only('pk', *DERIVED_FIELDS).order_by('pk')
+    for bus in buses:
+        advanced = [
+            advance(bus, loc.latitude, loc.longitude, loc.speed, loc.last_updated, gap, moving)
+            for loc in by_bus[bus.pk]
+        ]
+        if any(advanced):
+            changed.append(bus)
+    if changed:
+        Bus.objects.bulk_update(changed, DERIVED_FIELDS)
+    return len(changed)
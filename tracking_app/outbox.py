@@ -0,0 +1,52 @@
+# tracking_app/outbox.py
+"""
+Transactional outbox for realtime fan-out.
+
+Ingest appends one LocationOutbox row per stored BusLocation inside the same
+database transaction, so a rolled-back write is never published and the
+request path makes no remote calls. The drain_outbox management command
+reads the rows in large pk-ordered batches, publishes them to the configured
+sinks and deletes them once every sink accepted the batch (at-least-once).
+"""
+import logging
+
+from .models import LocationOutbox
+from .sinks import location_payload
+
+logger = logging.getLogger("tracking_app")
+
+
+def enqueue(locations):
+    """Append outbox rows for saved BusLocation instances (call inside the ingest transaction)"""
+    rows = [LocationOutbox(payload=location_payload(location)) for location in locations]
+    if rows:
+        LocationOutbox.objects.bulk_create(rows)
+    return len(rows)
+
+
+def drain_batch(sinks, batch_size=1000):
+    """
+    Publish and delete the oldest `batch_size` outbox rows.
+    Returns the number of rows delivered; raises if any sink fails, leaving
+    the rows in place so the next attempt re-delivers them.
+    """
+    rows = list(
+        LocationOutbox.objects.order_by('pk').values_list('pk', 'payload')[:batch_size]
+    )
+    if not rows:
+        return 0
+
+    payloads = [payload for _, payload in rows]
+    for sink in sinks:
+        sink.publish_many(payloads)
+        sink.flush(raise_errors=True)
+
+    # Delete exactly what was read: rows committed meanwhile with a lower pk
+    # are picked up by the next batch instead of being dropped.
+    LocationOutbox.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+    return len(rows)
+
+
+def backlog():
+    """Number of rows waiting to be published"""
+    return LocationOutbox.objects.count()
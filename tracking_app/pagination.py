@@ -0,0 +1,121 @@
+# tracking_app/pagination.py
+"""
+Keyset (cursor) pagination and `fields=` projection for list endpoints.
+
+Pagination is opt-in. Without `limit` or `cursor` a list endpoint returns
+everything, as the dashboards expect. With them it returns at most `limit`
+rows in primary-key order, and `next_cursor` fetches the rows after the last
+one. Each page is an index range scan `pk > last ORDER BY pk LIMIT n`, so
+page 1,000 costs the same as page 1 (unlike OFFSET).
+
+A FieldSet declares the output fields of an endpoint. For each field it
+lists the model fields it reads and how to render it. `fields=a,b` then
+loads only those columns (.only(), plus select_related for the relations
+they traverse) and renders only those keys.
+"""
+import base64
+import binascii
+import json
+
+from django.conf import settings
+
+
+class ListParamError(ValueError):
+    """Bad limit/cursor/fields parameter (reported as HTTP 400)"""
+
+
+# ============= Cursor pagination =============
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(json.dumps({'pk': pk}).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        pk = json.loads(base64.urlsafe_b64decode(padded.encode()))['pk']
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise ListParamError('Invalid cursor')
+    if not isinstance(pk, int):
+        raise ListParamError('Invalid cursor')
+    return pk
+
+
+def page_params(request):
+    """(limit, after_pk) from the query string, or None when the caller did not ask for a page"""
+    limit, cursor = request.GET.get('limit'), request.GET.get('cursor')
+    if limit is None and cursor is None:
+        return None
+    max_limit = getattr(settings, 'LIST_PAGE_MAX', 1000)
+    if limit is None:
+        limit = getattr(settings, 'LIST_PAGE_SIZE', 100)
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ListParamError('limit must be an integer')
+        if not 1 <= limit <= max_limit:
+            raise ListParamError(f'limit must be between 1 and {max_limit}')
+    return limit, decode_cursor(cursor) if cursor else None
+
+
+def paginate(queryset, request):
+    """(rows, next_cursor): one page of `queryset` by pk, or every row and None without paging params"""
+    params = page_params(request)
+    if params is None:
+        return list(queryset), None
+    limit, after = params
+    queryset = queryset.order_by('pk')
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    rows = list(queryset[:limit + 1])  # one extra row tells whether another page exists
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1].pk)
+    return rows, None
+
+
+def page_scope(queryset, rows, request):
+    """What to hand a batched per-row lookup: the page's pks, or the whole queryset as a subquery"""
+    if page_params(request) is None:
+        return queryset
+    return [row.pk for row in rows]
+
+
+# ============= Field projection =============
+
+class Field:
+    def __init__(self, reads, render):
+        self.reads = tuple(reads)  # model field paths, e.g. 'route__name'
+        self.render = render  # (obj, context) -> JSON value
+
+
+class FieldSet:
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def selected(self, request):
+        """Requested output names (all by default) in declaration order"""
+        raw = request.GET.get('fields')
+        if not raw:
+            return list(self.fields)
+        names = {name.strip() for name in raw.split(',') if name.strip()}
+        unknown = names - set(self.fields)
+        if unknown:
+            raise ListParamError(f'Unknown field(s): {", ".join(sorted(unknown))}; '
+                                 f'available: {", ".join(self.fields)}')
+        return [name for name in self.fields if name in names]
+
+    def project(self, queryset, names):
+        """Load only the columns `names` read, joining just the relations they traverse"""
+        reads = {path for name in names for path in self.fields[name].reads}
+        relations = set()
+        for path in reads:
+            parts = path.split('__')[:-1]
+            relations.update('__'.join(parts[:i]) for i in range(1, len(parts) + 1))
+        queryset = queryset.select_related(None)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        return queryset.only(*(reads | relations or {'pk'}))
+
+    def render(self, obj, names, context=None):
+        return {name: self.fields[name].render(obj, context) for name in names}
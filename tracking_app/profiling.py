@@ -0,0 +1,233 @@
+# tracking_app/profiling.py
+"""
+Opt-in cProfile capture of individual production requests.
+
+A request is profiled when a staff user sends `X-Profile: 1`, or when it is
+picked by PROFILE_SAMPLE_RATE. The rest of the middleware chain and the view
+then run under cProfile, with a connection.execute_wrapper recording the SQL
+timeline. The response carries `X-Profile-Id`.
+
+Each profile is saved in PROFILE_DIR: `<id>.json` holds the request, the
+top-N functions by cumulative time and the SQL timeline, and `<id>.prof`
+holds the raw pstats dump for offline tools (pstats, snakeviz). The
+directory is a ring buffer of the newest PROFILE_BUFFER_SIZE profiles.
+Because it lives on disk, every worker process and `manage.py profiles`
+read the same profiles. Only one request per process is profiled at a time;
+others that ask while one is running are served normally.
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+from .metrics import view_label
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_RE = re.compile(r'^\d{8}T\d{6}-[0-9a-f]{8}$')
+SQL_PREVIEW_CHARS = 500
+
+_busy = threading.Lock()
+
+logger = logging.getLogger("tracking_app")
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILE_DIR', Path(settings.BASE_DIR) / 'profiles'))
+
+
+class SQLTimeline:
+    """execute_wrapper keeping (offset, duration, sql) of up to `limit` statements"""
+
+    def __init__(self, started, limit):
+        self.started = started
+        self.limit = limit
+        self.queries = []
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - began
+            self.count += 1
+            self.seconds += duration
+            if len(self.queries) < self.limit:
+                self.queries.append({
+                    'offset_ms': round((began - self.started) * 1000, 3),
+                    'duration_ms': round(duration * 1000, 3),
+                    'sql': sql[:SQL_PREVIEW_CHARS],
+                    'many': many,
+                })
+
+
+def _function_label(key):
+    filename, line, name = key
+    if filename == '~':
+        return name  # built-in
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        filename = os.path.relpath(filename, base)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[1]
+    return f'{filename}:{line}({name})'
+
+
+def top_functions(stats, limit):
+    """The `limit` entries of a pstats.Stats with the highest cumulative time"""
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{
+        'function': _function_label(key),
+        'calls': calls,
+        'primitive_calls': primitive,
+        'tottime_ms': round(tottime * 1000, 3),
+        'cumtime_ms': round(cumtime * 1000, 3),
+    } for key, (primitive, calls, tottime, cumtime, _) in rows]
+
+
+# ============= Storage =============
+
+def save_profile(record, profiler):
+    """Write the JSON record and pstats dump, then trim the ring buffer"""
+    root = profile_dir()
+    root.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(str(root / f'{record["id"]}.prof'))
+    tmp = root / f'{record["id"]}.json.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(record, fh)
+    os.replace(tmp, root / f'{record["id"]}.json')  # readers never see a partial record
+
+    keep = max(1, getattr(settings, 'PROFILE_BUFFER_SIZE', 50))
+    for old in sorted(root.glob('*.json'))[:-keep]:
+        for path in (old, old.with_suffix('.prof')):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass  # another worker trimmed it first
+
+
+def list_profiles():
+    """Summaries of the stored profiles, newest first"""
+    summaries = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True):
+        try:
+            with open(path) as fh:
+                record = json.load(fh)
+        except (OSError, ValueError):
+            continue  # trimmed while listing
+        summaries.append({key: record[key] for key in (
+            'id', 'started_at', 'method', 'path', 'view', 'status', 'duration_ms',
+            'query_count', 'query_ms', 'trigger', 'user')})
+    return summaries
+
+
+def load_profile(profile_id):
+    """The full record of one profile, or None"""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    try:
+        with open(profile_dir() / f'{profile_id}.json') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def pstats_path(profile_id):
+    """Path of the raw pstats dump, or None"""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = profile_dir() / f'{profile_id}.prof'
+    return path if path.exists() else None
+
+
+def clear_profiles():
+    removed = 0
+    for path in profile_dir().glob('*.json'):
+        for part in (path, path.with_suffix('.prof')):
+            try:
+                part.unlink()
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
+
+
+# ============= Middleware =============
+
+def _trigger(request):
+    if request.headers.get(PROFILE_HEADER) == '1':
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated and user.is_staff:
+            return 'header'
+    rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+    if rate and random.random() < rate:
+        return 'sample'
+    return None
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trigger = _trigger(request)
+        if trigger is None or not _busy.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self._profile(request, trigger)
+        finally:
+            _busy.release()
+
+    def _profile(self, request, trigger):
+        started_at = datetime.now().astimezone()
+        started = time.perf_counter()
+        timeline = SQLTimeline(started, getattr(settings, 'PROFILE_MAX_QUERIES', 500))
+        profiler = cProfile.Profile()
+        with connection.execute_wrapper(timeline):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - started
+        try:
+            response['X-Profile-Id'] = self._save(request, response, trigger, started_at, duration,
+                                                  timeline, profiler)
+        except Exception:
+            # The request itself succeeded; a full or read-only PROFILE_DIR must not turn it into a 500
+            logger.exception("Failed to store the profile of %s %s", request.method, request.path)
+        return response
+
+    def _save(self, request, response, trigger, started_at, duration, timeline, profiler):
+        profile_id = f'{started_at.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        user = getattr(request, 'user', None)
+        record = {
+            'id': profile_id,
+            'started_at': started_at.isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'view': view_label(request),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'query_count': timeline.count,
+            'query_ms': round(timeline.seconds * 1000, 3),
+            'trigger': trigger,
+            'user': user.username if user is not None and user.is_authenticated else None,
+            'functions': top_functions(pstats.Stats(profiler), getattr(settings, 'PROFILE_TOP_N', 30)),
+            'queries': timeline.queries,
+            'queries_dropped': timeline.count - len(timeline.queries),
+        }
+        save_profile(record, profiler)
+        return profile_id
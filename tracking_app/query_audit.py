@@ -0,0 +1,230 @@
+# tracking_app/query_audit.py
+"""
+Index audit for hot queries.
+
+Every query that runs on a hot path against the large history tables is
+registered here with @hot_query. `python manage.py audit_indexes` EXPLAINs
+each one and fails if the plan falls back to a full scan of a history table,
+so a dropped or mismatched index is caught before it reaches production.
+When adding a new query over BusLocation (or changing one), register it here.
+"""
+import re
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Bus, BusLocation, CompactTrajectory, LocationRollup, Route
+
+# Tables that grow with fleet size x time; a full scan of these is a regression.
+# (LocationOutbox is drained continuously and read from the head in pk order.)
+HISTORY_TABLES = (
+    BusLocation._meta.db_table,
+    CompactTrajectory._meta.db_table,
+    LocationRollup._meta.db_table,
+)
+
+HOT_QUERIES = {}
+
+
+class HotQuery:
+    def __init__(self, name, build, description=''):
+        self.name = name
+        self.build = build
+        self.description = description
+
+    def queryset(self):
+        # Plans don't depend on the data, so fixed sample parameters are fine
+        return self.build(bus_pk=1, owner_id=1, now=timezone.now())
+
+
+def hot_query(name):
+    """Register a function (bus_pk, owner_id, now) -> QuerySet under `name`"""
+    def decorator(build):
+        HOT_QUERIES[name] = HotQuery(name, build, (build.__doc__ or '').strip())
+        return build
+    return decorator
+
+
+# ============= Registry =============
+
+@hot_query('latest_fix_per_bus')
+def _latest_fix(bus_pk, owner_id, now):
+    """Bus.get_current_location / admin_list_buses"""
+    return BusLocation.objects.filter(bus_id=bus_pk).order_by('-last_updated')[:1]
+
+
+@hot_query('latest_fix_batch')
+def _latest_fix_batch(bus_pk, owner_id, now):
+    """BusLocation.latest_for (search_buses, admin_list_buses, get_locations)"""
+    return BusLocation.latest_queryset(Bus.objects.filter(owner_id=owner_id))
+
+
+@hot_query('bus_history_range')
+def _bus_history(bus_pk, owner_id, now):
+    """trajectory.history_points raw side"""
+    return (BusLocation.objects
+            .filter(bus_id=bus_pk, last_updated__gte=now - timedelta(hours=6), last_updated__lte=now)
+            .order_by('last_updated', 'id'))
+
+
+@hot_query('ingest_dedupe')
+def _ingest_dedupe(bus_pk, owner_id, now):
+    """ingest.DedupeStage lookup of already stored (bus, timestamp) pairs"""
+    return (BusLocation.objects
+            .filter(bus_id__in=[bus_pk], last_updated__in=[now, now - timedelta(seconds=5)])
+            .order_by().values_list('bus_id', 'last_updated'))
+
+
+@hot_query('compaction_page')
+def _compaction_page(bus_pk, owner_id, now):
+    """trajectory.compact_bus_history keyset page"""
+    last = now - timedelta(days=2)
+    return (BusLocation.objects
+            .filter(bus_id=bus_pk, last_updated__lt=now - timedelta(days=1)).exclude(id=1)
+            .filter(last_updated__gte=last).exclude(last_updated=last, id__lte=1)
+            .order_by('last_updated', 'id')[:2000])
+
+
+@hot_query('owner_window_count')
+def _owner_window(bus_pk, owner_id, now):
+    """admin_analytics locations in the last hour/day"""
+    return BusLocation.objects.filter(bus__owner_id=owner_id, last_updated__gte=now - timedelta(hours=1)).order_by()
+
+
+@hot_query('owner_active_buses')
+def _owner_active(bus_pk, owner_id, now):
+    """admin_analytics buses seen in the last 5 minutes"""
+    return (BusLocation.objects
+            .filter(bus__owner_id=owner_id, last_updated__gte=now - timedelta(minutes=5))
+            .values_list('bus_id', flat=True).distinct())
+
+
+@hot_query('owner_recent_activity')
+def _owner_recent(bus_pk, owner_id, now):
+    """admin_analytics recent activity feed"""
+    return BusLocation.objects.filter(bus__owner_id=owner_id).order_by('-last_updated')[:20]
+
+
+@hot_query('route_active_buses')
+def _route_active(bus_pk, owner_id, now):
+    """admin_analytics per-route stats (one grouped query)"""
+    recent = BusLocation.objects.filter(last_updated__gte=now - timedelta(minutes=3)).values('bus_id')
+    return (Route.objects.filter(owner_id=owner_id)
+            .annotate(bus_count=Count('buses', distinct=True),
+                      active_count=Count('buses', filter=Q(buses__id__in=recent), distinct=True))
+            .values('route_id', 'bus_count', 'active_count'))
+
+
+@hot_query('retention_batch')
+def _retention(bus_pk, owner_id, now):
+    """retention.delete_in_batches over expired rows of one owner"""
+    return (BusLocation.objects
+            .filter(bus__owner_id=owner_id, last_updated__lt=now - timedelta(days=30), pk__gt=0)
+            .order_by('pk').values_list('pk', flat=True)[:1000])
+
+
+@hot_query('retention_rollups')
+def _retention_rollups(bus_pk, owner_id, now):
+    """retention.delete_in_batches over expired rollups of one owner"""
+    return (LocationRollup.objects
+            .filter(owner_id=owner_id, minute__lt=now - timedelta(days=30), pk__gt=0)
+            .order_by('pk').values_list('pk', flat=True)[:1000])
+
+
+@hot_query('rollup_fold')
+def _rollup_fold(bus_pk, owner_id, now):
+    """rollups.fold_days: unfolded minutes of an owner before the fold horizon"""
+    return (LocationRollup.objects.filter(owner_id=owner_id, minute__lt=now - timedelta(days=7))
+            .exclude(minute__hour=0, minute__minute=0).values_list('bus_id', 'minute')[:500])
+
+
+@hot_query('archive_owner_day')
+def _archive_day(bus_pk, owner_id, now):
+    """archive.archive_day row stream"""
+    return (BusLocation.objects
+            .filter(bus__owner_id=owner_id, last_updated__gte=now - timedelta(days=1), last_updated__lt=now)
+            .order_by('last_updated', 'id'))
+
+
+@hot_query('owner_export')
+def _owner_export(bus_pk, owner_id, now):
+    """export.export_rows for one bus and time range"""
+    return (BusLocation.objects
+            .filter(bus__owner_id=owner_id, bus__bus_id__in=['BUS-1'], last_updated__gte=now - timedelta(days=1))
+            .order_by('last_updated', 'id'))
+
+
+@hot_query('fleet_time_window')
+def _fleet_window(bus_pk, owner_id, now):
+    """archive_history oldest row / fleet-wide time windows"""
+    return BusLocation.objects.filter(last_updated__lt=now - timedelta(days=30)).order_by()
+
+
+@hot_query('bus_trajectories')
+def _trajectories(bus_pk, owner_id, now):
+    """trajectory.history_points compacted side"""
+    return (CompactTrajectory.objects
+            .filter(bus_id=bus_pk, ended_at__gte=now - timedelta(days=7), started_at__lte=now)
+            .order_by('started_at'))
+
+
+@hot_query('owner_rollup_window')
+def _rollup_window(bus_pk, owner_id, now):
+    """rollups.window_totals (admin_analytics counts)"""
+    return LocationRollup.objects.filter(owner_id=owner_id, minute__gte=now - timedelta(days=1)).order_by()
+
+
+@hot_query('rollup_upsert')
+def _rollup_upsert(bus_pk, owner_id, now):
+    """rollups.apply / previous_positions at ingest"""
+    return LocationRollup.objects.filter(bus_id__in=[bus_pk], minute__gte=now - timedelta(minutes=10), minute__lte=now)
+
+
+# ============= Plans =============
+
+_SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?"?(\w+)"?')
+_POSTGRES_SCAN = re.compile(r'Seq Scan on "?(\w+)"?')
+_SUBQUERY_ALIAS = re.compile(r'^[A-Z]\d+$')
+
+
+def explain(queryset):
+    """Plan lines for a queryset on the current database"""
+    sql, params = queryset.query.sql_with_params()
+    with transaction.atomic(using=queryset.db):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                return [row[-1] for row in cursor.fetchall()]
+            if connection.vendor == 'postgresql':
+                # Small (test/staging) tables make seq scans look cheapest; ask
+                # whether an index *can* serve the query instead
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql, params)
+                return [row[0] for row in cursor.fetchall()]
+    raise NotImplementedError(f'Index audit does not support {connection.vendor}')
+
+
+def full_scans(plan, vendor=None, tables=HISTORY_TABLES):
+    """History tables that a plan reads in full"""
+    pattern = _POSTGRES_SCAN if (vendor or connection.vendor) == 'postgresql' else _SQLITE_SCAN
+    scanned = []
+    for line in plan:
+        for table in pattern.findall(line):
+            # Subqueries appear under Django's aliases (U0, T3...), which hide
+            # the table name; treat a full scan of one as a history table scan
+            if (table in tables or _SUBQUERY_ALIAS.match(table)) and table not in scanned:
+                scanned.append(table)
+    return scanned
+
+
+def audit(names=None):
+    """[(HotQuery, plan_lines, full_scan_tables)] for the registered queries"""
+    results = []
+    for name, query in HOT_QUERIES.items():
+        if names and name not in names:
+            continue
+        plan = explain(query.queryset())
+        results.append((query, plan, full_scans(plan)))
+    return results
@@ -0,0 +1,204 @@
+# tracking_app/replay.py
+"""
+Replay recorded location history against the ingest endpoints.
+
+Rows (from BusLocation via export_rows, or an export file via read_export)
+are read in timestamp order on a single reader thread, a chunk ahead of the
+sender. Each fix is due at `first send + (recorded time - first recorded
+time) / speed`. Buses are spread over one lane per pooled keep-alive
+connection by a stable hash of bus_id; a lane posts everything that is due
+in one batch. A bus's fixes therefore always arrive in order, and fixes of
+different buses keep their relative order up to the batching window.
+
+Lag is how late each fix was sent compared with its due time. Lag that keeps
+growing means the server (or the replayer) cannot keep up at this speed.
+"""
+import asyncio
+import itertools
+import random
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connections
+
+from .http_pool import ConnectionPool, HTTPError
+
+TIMESTAMP_MODES = ('now', 'original')
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class ReplayStats:
+    """Counters plus lag samples (seconds late): per report window and a bounded overall sample"""
+    SAMPLE_SIZE = 100000
+
+    def __init__(self):
+        self.fixes = 0
+        self.requests = 0
+        self.errors = 0
+        self.statuses = {}
+        self.window_lags = []
+        self.sampled_lags = []
+        self.lag_count = 0
+        self.max_lag = 0.0
+        self.recorded_at = None  # recorded time of the latest fix sent
+        self._rng = random.Random(0)
+
+    def record(self, status, fixes, lags):
+        self.requests += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 200:
+            self.fixes += fixes
+        self.window_lags.extend(lags)
+        for lag in lags:
+            # Reservoir sampling keeps overall percentiles in bounded memory
+            self.lag_count += 1
+            if len(self.sampled_lags) < self.SAMPLE_SIZE:
+                self.sampled_lags.append(lag)
+            else:
+                slot = self._rng.randrange(self.lag_count)
+                if slot < self.SAMPLE_SIZE:
+                    self.sampled_lags[slot] = lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def summary(self, elapsed, window=True):
+        """One-line report; window=True covers lag since the previous window report"""
+        elapsed = max(elapsed, 1e-9)
+        if window:
+            lags, self.window_lags = self.window_lags, []
+        else:
+            lags = self.sampled_lags
+        position = f', replayed up to {self.recorded_at.isoformat()}' if self.recorded_at else ''
+        return (
+            f'{self.fixes} fixes ({self.fixes / elapsed:.0f}/s) in {self.requests} requests, '
+            f'{self.errors} errors, lag p50 {percentile(lags, 50) * 1000:.0f} ms '
+            f'p99 {percentile(lags, 99) * 1000:.0f} ms max {self.max_lag * 1000:.0f} ms, '
+            f'status {self.statuses}{position}'
+        )
+
+
+class Replayer:
+    def __init__(self, server_url, speed=1.0, batch_size=100, connections=8, timestamps='now',
+                 read_ahead=5000, timeout=10.0):
+        if speed <= 0:
+            raise ValueError('speed must be positive')
+        if timestamps not in TIMESTAMP_MODES:
+            raise ValueError(f'timestamps must be one of {", ".join(TIMESTAMP_MODES)}')
+        self.server_url = server_url
+        self.speed = speed
+        self.batch_size = max(1, batch_size)
+        self.connections = max(1, connections)
+        self.timestamps = timestamps
+        self.read_ahead = read_ahead
+        self.timeout = timeout
+        self.stats = ReplayStats()
+        self.elapsed = 0.0
+
+    def _lane(self, bus_id):
+        return zlib.crc32(str(bus_id).encode()) % self.connections
+
+    async def _send(self, pool, items):
+        now = asyncio.get_running_loop().time()
+        fixes = [fix for _, fix in items]
+        lags = [max(0.0, now - due) for due, _ in items]
+        if len(fixes) == 1:
+            path, payload = '/api/update_location/', fixes[0]
+        else:
+            path, payload = '/api/update_locations/', {'fixes': fixes}
+        try:
+            status, _ = await pool.post_json(path, payload)
+        except (OSError, asyncio.TimeoutError, HTTPError, asyncio.IncompleteReadError):
+            self.stats.errors += 1
+            return
+        self.stats.record(status, len(fixes), lags)
+
+    async def _lane_worker(self, pool, queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch, done = [item], False
+            while len(batch) < self.batch_size and not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+            await self._send(pool, batch)
+            if done:
+                return
+
+    async def run(self, rows, report_every=10.0, report=print):
+        """Replay (bus_id, lat, lng, speed, heading, timestamp) rows; returns ReplayStats"""
+        loop = asyncio.get_running_loop()
+        pool = ConnectionPool(self.server_url, size=self.connections, timeout=self.timeout)
+        lanes = [asyncio.Queue(maxsize=self.batch_size * 4) for _ in range(self.connections)]
+        workers = [loop.create_task(self._lane_worker(pool, queue)) for queue in lanes]
+        # One dedicated thread: database cursors must stay on the thread that opened them
+        reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='replay-reader')
+        iterator = iter(rows)
+
+        def next_chunk():
+            chunk = list(itertools.islice(iterator, self.read_ahead))
+            if not chunk:
+                connections.close_all()  # the reader thread's own connection
+            return chunk
+
+        started = loop.time()
+        last_report = started
+        origin = None
+        try:
+            pending = loop.run_in_executor(reader, next_chunk)
+            while True:
+                chunk = await pending
+                if not chunk:
+                    break
+                pending = loop.run_in_executor(reader, next_chunk)
+                for count, (bus_id, lat, lng, speed, heading, recorded_at) in enumerate(chunk):
+                    if origin is None:
+                        origin = (recorded_at, loop.time(), datetime.now(dt_timezone.utc))
+                    offset = (recorded_at - origin[0]).total_seconds() / self.speed
+                    due = origin[1] + offset
+                    delay = due - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    elif count % 500 == 0:
+                        await asyncio.sleep(0)  # let the lanes send during a burst
+                    await lanes[self._lane(bus_id)].put((due, {
+                        'bus_id': bus_id,
+                        'latitude': lat,
+                        'longitude': lng,
+                        'speed': speed,
+                        'heading': heading,
+                        # 'now': the wall-clock time the fix is due, as a live device would stamp it
+                        'timestamp': (recorded_at if self.timestamps == 'original'
+                                      else origin[2] + timedelta(seconds=offset)).isoformat(),
+                    }))
+                    self.stats.recorded_at = recorded_at
+                    if report_every and loop.time() - last_report >= report_every:
+                        last_report = loop.time()
+                        report(f'[{datetime.now().strftime("%H:%M:%S")}] '
+                               f'{self.stats.summary(last_report - started)}')
+            for queue in lanes:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            reader.shutdown(wait=False, cancel_futures=True)
+            await pool.close()
+        self.elapsed = loop.time() - started
+        return self.stats
+
+
+def replay(rows, server_url, report_every=10.0, report=print, **options):
+    """Synchronous entry point: replay `rows` and return the Replayer (stats, elapsed)"""
+    replayer = Replayer(server_url, **options)
+    asyncio.run(replayer.run(rows, report_every=report_every, report=report))
+    return replayer
@@ -0,0 +1,124 @@
+# tracking_app/retention.py
+"""
+Location history retention.
+
+Each owner keeps history for RetentionPolicy.retention_days (or
+settings.LOCATION_RETENTION_DAYS when they have no policy; 0 keeps it
+forever). The window covers every form history takes: raw fixes, compacted
+trajectories, per-minute rollups and cold archive files. Expired rows are
+deleted in small primary-key-ordered batches, each in its own short
+transaction, with a pause between batches so the delete never holds locks
+long enough to stall ingest.
+
+Retention is the total lifetime of history, not the hot window: set it
+longer than the `archive_history --days` horizon, or rows are deleted
+before they are ever archived.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .archive import expired_files
+from .models import Bus, BusLocation, CompactTrajectory, LocationRollup, RetentionPolicy
+from .rollups import day_of, minute_of
+
+
+def default_retention_days():
+    return getattr(settings, 'LOCATION_RETENTION_DAYS', 0)
+
+
+def retention_windows():
+    """{owner_id: retention_days} for every owner that has vehicles"""
+    policies = dict(RetentionPolicy.objects.values_list('owner_id', 'retention_days'))
+    default = default_retention_days()
+    owner_ids = Bus.objects.order_by().values_list('owner_id', flat=True).distinct()
+    return {owner_id: policies.get(owner_id, default) for owner_id in owner_ids}
+
+
+class Throttle:
+    """
+    Pause between batches: at least `sleep` seconds, and long enough that
+    deleting takes no more than `duty` of wall-clock time.
+    """
+
+    def __init__(self, sleep=0.05, duty=0.5):
+        self.sleep = sleep
+        self.duty = min(max(duty, 0.01), 1.0)
+
+    def pause(self, busy_seconds):
+        delay = max(self.sleep, busy_seconds * (1.0 / self.duty - 1.0))
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+def delete_in_batches(queryset, batch_size=1000, throttle=None, progress=None):
+    """
+    Delete the rows of `queryset` in ascending-pk batches (keyset pagination,
+    so each batch is an index range scan). Returns the number deleted.
+    `progress(deleted_so_far)` is called after every batch.
+    """
+    model = queryset.model
+    deleted, last_pk = 0, None
+    while True:
+        page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        pks = list(page.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        started = time.monotonic()
+        deleted += model.objects.filter(pk__in=pks).delete()[0]
+        busy = time.monotonic() - started
+        last_pk = pks[-1]
+        if progress:
+            progress(deleted)
+        if len(pks) < batch_size:
+            return deleted
+        if throttle:
+            throttle.pause(busy)
+
+
+def expired_locations(owner_id, cutoff):
+    return BusLocation.objects.filter(bus__owner_id=owner_id, last_updated__lt=cutoff)
+
+
+def expired_trajectories(owner_id, cutoff):
+    return CompactTrajectory.objects.filter(bus__owner_id=owner_id, ended_at__lt=cutoff)
+
+
+def expired_rollups(owner_id, cutoff):
+    # Only minutes that ended before the cutoff; the midnight row of the cutoff's
+    # day may be a folded day that is still partly inside the window
+    return (LocationRollup.objects.filter(owner_id=owner_id, minute__lt=minute_of(cutoff))
+            .exclude(minute=day_of(cutoff)))
+
+
+def prune_owner(owner_id, cutoff, batch_size=1000, throttle=None, progress=None, archive_root=None):
+    """
+    Delete an owner's history older than `cutoff`: raw fixes, compacted
+    trajectories, rollups and archive files of whole days before it.
+    Returns {'locations', 'trajectories', 'rollups', 'archive_files'} counts.
+    """
+    counts = {
+        'locations': delete_in_batches(expired_locations(owner_id, cutoff), batch_size, throttle, progress),
+        'trajectories': delete_in_batches(expired_trajectories(owner_id, cutoff), batch_size, throttle),
+        'rollups': delete_in_batches(expired_rollups(owner_id, cutoff), batch_size, throttle),
+        'archive_files': 0,
+    }
+    for path in expired_files(owner_id, cutoff, root=archive_root):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            continue  # removed by a concurrent pass
+        counts['archive_files'] += 1
+    return counts
+
+
+def enforce_owner(owner_id, retention_days, batch_size=1000, throttle=None, progress=None, now=None,
+                  archive_root=None):
+    """Apply one owner's window; returns prune_owner's counts (all zero when retention is off)"""
+    if not retention_days:
+        return {'locations': 0, 'trajectories': 0, 'rollups': 0, 'archive_files': 0}
+    cutoff = (now or timezone.now()) - timedelta(days=retention_days)
+    return prune_owner(owner_id, cutoff, batch_size, throttle, progress, archive_root)
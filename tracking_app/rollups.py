@@ -0,0 +1,293 @@
+# tracking_app/rollups.py
+"""
+Per-minute location rollups.
+
+DeriveStage folds every stored batch into LocationRollup rows (one per bus
+per minute: fix count, distance, max and summed speed), so dashboards sum a
+few rows per bus-minute instead of counting raw history. Rows are upserted:
+missing ones are inserted with ignore_conflicts, then the touched rows are
+locked, updated in memory and written back with one bulk_update, which keeps
+concurrent workers from losing each other's increments.
+
+Distance of the first fix of a batch is measured from the latest fix already
+rolled up for that bus (LocationRollup.last_*), unless that is more than
+ROLLUP_MAX_GAP_SECONDS old.
+
+Rollups count fixes as they were received, so compacting or archiving raw
+rows leaves them unchanged; retention deletes them with the rest of the
+history. Once a day is ROLLUP_MINUTE_DAYS old, fold_days() merges its
+minutes into one row per bus at the day's midnight, which keeps the 'all'
+window at one row per bus-day. rebuild() recomputes a time range from raw
+rows, starting each bus after its compacted, archived or folded history.
+"""
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from .archive import archive_files, file_day
+from .models import Bus, BusLocation, CompactTrajectory, LocationRollup
+
+
+def max_gap_seconds():
+    return getattr(settings, 'ROLLUP_MAX_GAP_SECONDS', 600)
+
+
+def minute_of(value):
+    return value.replace(second=0, microsecond=0)
+
+
+def day_of(value):
+    return value.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def fold_horizon(now=None):
+    """Start of the oldest day still kept per minute"""
+    return day_of((now or timezone.now()) - timedelta(days=getattr(settings, 'ROLLUP_MINUTE_DAYS', 7)))
+
+
+class _Minute:
+    __slots__ = ('owner_id', 'fix_count', 'distance_m', 'max_speed', 'speed_sum',
+                 'last_latitude', 'last_longitude', 'last_at')
+
+    def __init__(self, owner_id):
+        self.owner_id = owner_id
+        self.fix_count = 0
+        self.distance_m = 0.0
+        self.max_speed = 0.0
+        self.speed_sum = 0.0
+        self.last_latitude = self.last_longitude = self.last_at = None
+
+
+def accumulate(points, previous=None):
+    """
+    Fold (bus_pk, owner_id, latitude, longitude, speed, timestamp) points into
+    {(bus_pk, minute): _Minute}. `previous` maps bus_pk -> (lat, lng, timestamp)
+    of the fix before the first point and is updated in place.
+    """
+    previous = {} if previous is None else previous
+    gap = max_gap_seconds()
+    minutes = {}
+    for bus_pk, owner_id, lat, lng, speed, ts in sorted(points, key=lambda p: (p[0], p[5])):
+        key = (bus_pk, minute_of(ts))
+        bucket = minutes.get(key)
+        if bucket is None:
+            bucket = minutes[key] = _Minute(owner_id)
+        speed = speed or 0.0
+        bucket.fix_count += 1
+        bucket.speed_sum += speed
+        bucket.max_speed = max(bucket.max_speed, speed)
+        last = previous.get(bus_pk)
+        if last is not None and 0 <= (ts - last[2]).total_seconds() <= gap:
+            bucket.distance_m += BusLocation.calculate_distance(last[0], last[1], lat, lng) * 1000
+        if bucket.last_at is None or ts >= bucket.last_at:
+            bucket.last_latitude, bucket.last_longitude, bucket.last_at = lat, lng, ts
+        if last is None or ts >= last[2]:
+            previous[bus_pk] = (lat, lng, ts)
+    return minutes
+
+
+def previous_positions(bus_first_fix):
+    """
+    {bus_pk: (lat, lng, timestamp)} of the latest rolled-up fix before each
+    bus's first new fix (within the max gap), in one query.
+    """
+    if not bus_first_fix:
+        return {}
+    gap = timedelta(seconds=max_gap_seconds())
+    earliest = min(bus_first_fix.values())
+    rows = (
+        LocationRollup.objects
+        .filter(bus_id__in=list(bus_first_fix), minute__gte=minute_of(earliest - gap),
+                minute__lte=max(bus_first_fix.values()), last_at__isnull=False)
+        .values_list('bus_id', 'last_latitude', 'last_longitude', 'last_at')
+    )
+    previous = {}
+    for bus_pk, lat, lng, last_at in rows:
+        first = bus_first_fix[bus_pk]
+        if last_at < first and (bus_pk not in previous or last_at > previous[bus_pk][2]):
+            previous[bus_pk] = (lat, lng, last_at)
+    return previous
+
+
+def apply(minutes):
+    """Add accumulated minutes to the stored rollups (call inside a transaction)"""
+    if not minutes:
+        return 0
+    LocationRollup.objects.bulk_create(
+        [LocationRollup(bus_id=bus_pk, minute=minute, owner_id=bucket.owner_id)
+         for (bus_pk, minute), bucket in minutes.items()],
+        ignore_conflicts=True,
+    )
+    bus_pks = {bus_pk for bus_pk, _ in minutes}
+    minute_values = [minute for _, minute in minutes]
+    rows = (
+        LocationRollup.objects.select_for_update()
+        .filter(bus_id__in=bus_pks, minute__gte=min(minute_values), minute__lte=max(minute_values))
+        .order_by('id')
+    )
+    changed = []
+    for row in rows:
+        bucket = minutes.get((row.bus_id, row.minute))
+        if bucket is None:
+            continue
+        row.fix_count += bucket.fix_count
+        row.distance_m += bucket.distance_m
+        row.speed_sum += bucket.speed_sum
+        row.max_speed = max(row.max_speed, bucket.max_speed)
+        if row.last_at is None or bucket.last_at >= row.last_at:
+            row.last_latitude, row.last_longitude, row.last_at = (
+                bucket.last_latitude, bucket.last_longitude, bucket.last_at)
+        changed.append(row)
+    LocationRollup.objects.bulk_update(
+        changed,
+        ['fix_count', 'distance_m', 'speed_sum', 'max_speed', 'last_latitude', 'last_longitude', 'last_at'],
+    )
+    return len(changed)
+
+
+def record(locations):
+    """Roll up freshly stored BusLocation objects (bus attribute already loaded)"""
+    points = [
+        (loc.bus_id, loc.bus.owner_id, loc.latitude, loc.longitude, loc.speed, loc.last_updated)
+        for loc in locations
+    ]
+    first = {}
+    for bus_pk, _, _, _, _, ts in points:
+        if bus_pk not in first or ts < first[bus_pk]:
+            first[bus_pk] = ts
+    return apply(accumulate(points, previous_positions(first)))
+
+
+def raw_history_start(bus_pk, owner_id, start, end, horizon=None):
+    """
+    First minute >= start from which a bus's raw rows are complete up to
+    `end`: after its last compacted trip and last archived day in the range,
+    and on a day boundary where minutes were folded into days.
+    """
+    compacted = (CompactTrajectory.objects.filter(bus_id=bus_pk, started_at__lt=end)
+                 .aggregate(m=Max('ended_at'))['m'])
+    if compacted is not None and compacted >= start:
+        start = minute_of(compacted) + timedelta(minutes=1)
+    archived = archive_files(owner_id, start, end)
+    if archived:
+        start = max(start, file_day(archived[-1]) + timedelta(days=1))
+    if start < (horizon or fold_horizon()) and start != day_of(start):
+        start = day_of(start) + timedelta(days=1)
+    return start
+
+
+def rebuild(start, end, owner_id=None, chunk_size=5000):
+    """
+    Recompute rollups for minutes in [start, end) from raw BusLocation rows,
+    one bus per transaction. A bus is only rebuilt from raw_history_start():
+    its rollups for compacted, archived or folded history are kept, since the
+    raw rows they were counted from are gone.
+    Returns (rollup rows written, pks of buses skipped entirely).
+    """
+    start, end = minute_of(start), minute_of(end)
+    horizon = fold_horizon()
+    written, skipped = 0, []
+    locations = BusLocation.objects.filter(last_updated__gte=start, last_updated__lt=end)
+    if owner_id is not None:
+        locations = locations.filter(bus__owner_id=owner_id)
+    bus_pks = list(locations.order_by().values_list('bus_id', flat=True).distinct())
+    owners = dict(Bus.objects.filter(pk__in=bus_pks).values_list('pk', 'owner_id'))
+
+    for bus_pk in bus_pks:
+        bus_start = raw_history_start(bus_pk, owners[bus_pk], start, end, horizon)
+        if bus_start >= end:
+            skipped.append(bus_pk)
+            continue
+        with transaction.atomic():
+            LocationRollup.objects.filter(bus_id=bus_pk, minute__gte=bus_start, minute__lt=end).delete()
+            rows = (
+                BusLocation.objects
+                .filter(bus_id=bus_pk, last_updated__gte=bus_start, last_updated__lt=end)
+                .order_by('last_updated', 'id')
+                .values_list('bus_id', 'bus__owner_id', 'latitude', 'longitude', 'speed', 'last_updated')
+                .iterator(chunk_size=chunk_size)
+            )
+            previous = previous_positions({bus_pk: bus_start})
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= chunk_size:
+                    written += apply(accumulate(batch, previous))
+                    batch = []
+            written += apply(accumulate(batch, previous))
+    return written, skipped
+
+
+def fold_days(owner_id, before=None, batch_size=500):
+    """
+    Merge an owner's per-minute rollups of whole UTC days before `before`
+    (default: fold_horizon()) into one row per bus per day, stored at the
+    day's midnight. Returns the number of rows removed.
+    """
+    before = day_of(before or fold_horizon())
+    removed = 0
+    with timezone.override(dt_timezone.utc):
+        minutes = (LocationRollup.objects.filter(owner_id=owner_id, minute__lt=before)
+                   .exclude(minute__hour=0, minute__minute=0))
+        while True:
+            days = {(bus_pk, day_of(minute))
+                    for bus_pk, minute in minutes.order_by().values_list('bus_id', 'minute')[:batch_size]}
+            if not days:
+                return removed
+            for bus_pk, day in sorted(days):
+                removed += _fold_day(bus_pk, owner_id, day)
+
+
+def _fold_day(bus_pk, owner_id, day):
+    with transaction.atomic():
+        rows = list(
+            LocationRollup.objects.select_for_update()
+            .filter(bus_id=bus_pk, minute__gte=day, minute__lt=day + timedelta(days=1))
+            .order_by('minute', 'id')
+        )
+        if not rows:
+            return 0
+        total = rows[0] if rows[0].minute == day else LocationRollup(bus_id=bus_pk, owner_id=owner_id, minute=day)
+        merged = [row for row in rows if row is not total]
+        for row in merged:
+            total.fix_count += row.fix_count
+            total.distance_m += row.distance_m
+            total.speed_sum += row.speed_sum
+            total.max_speed = max(total.max_speed, row.max_speed)
+            if row.last_at is not None and (total.last_at is None or row.last_at >= total.last_at):
+                total.last_latitude, total.last_longitude, total.last_at = (
+                    row.last_latitude, row.last_longitude, row.last_at)
+        LocationRollup.objects.filter(pk__in=[row.pk for row in merged]).delete()
+        total.save()
+    return len(merged)
+
+
+def window_totals(owner, windows):
+    """
+    Totals over an owner's rollups for several windows in one query.
+    `windows` maps a name to a start time (None = all history); a start
+    older than fold_horizon() is rounded to whole days. Returns
+    {name: {'fixes', 'distance_km', 'max_speed', 'avg_speed'}}.
+    """
+    aggregates = {}
+    for name, since in windows.items():
+        condition = Q(minute__gte=minute_of(since)) if since is not None else None
+        aggregates[f'{name}_fixes'] = Sum('fix_count', filter=condition)
+        aggregates[f'{name}_distance'] = Sum('distance_m', filter=condition)
+        aggregates[f'{name}_speed_sum'] = Sum('speed_sum', filter=condition)
+        aggregates[f'{name}_max_speed'] = Max('max_speed', filter=condition)
+    totals = LocationRollup.objects.filter(owner=owner).aggregate(**aggregates)
+
+    result = {}
+    for name in windows:
+        fixes = totals[f'{name}_fixes'] or 0
+        result[name] = {
+            'fixes': fixes,
+            'distance_km': round((totals[f'{name}_distance'] or 0.0) / 1000, 3),
+            'max_speed': totals[f'{name}_max_speed'] or 0.0,
+            'avg_speed': round(totals[f'{name}_speed_sum'] / fixes, 2) if fixes else 0.0,
+        }
+    return result
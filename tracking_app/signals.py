@@ -1,46 +1,34 @@
 # tracking_app/signals.py
+from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.utils import timezone
 from .models import BusLocation
-try:
-    from firebase_config import db as firestore_db
-except ImportError:
-    firestore_db = None
-import traceback
+from .sinks import get_sink, location_payload
+from . import outbox
+import logging
+
+logger = logging.getLogger("tracking_app")
 
 @receiver(post_save, sender=BusLocation)
 def push_bus_location_to_firestore(sender, instance: BusLocation, created, **kwargs):
     """
-    Push the latest location to Firestore.
+    Hand the latest location to realtime fan-out (Firestore by default).
     - Document path: buses/{bus_id}
     - Field 'last_location' contains current snapshot
-    - Optionally append to subcollection 'history'
+    - Downsampled trail in subcollection 'history'
+    With REALTIME_OUTBOX (default) an outbox row is written in the same
+    transaction and published later by `manage.py drain_outbox`; otherwise
+    the snapshot is queued on the in-process sink. Neither blocks on Firestore.
     """
+    if getattr(settings, "REALTIME_OUTBOX", True):
+        # Must not be swallowed: a failed outbox write has to roll back the ingest
+        outbox.enqueue([instance])
+        return
     try:
-        if not firestore_db:
+        sink = get_sink()
+        if sink is None:
             return
-        bus_doc_id = str(instance.bus.bus_id)
-        # Prepare data
-        data = {
-            "latitude": float(instance.latitude),
-            "longitude": float(instance.longitude),
-            "speed": float(instance.speed or 0.0),
-            "heading": float(instance.heading or 0.0),
-            "last_updated": instance.last_updated.isoformat(),
-            # optional: server timestamp too
-            "server_ts": firestore_db._client._firestore_api._rpc.metadata if False else None
-        }
-        # Set last_location (merge so we keep other bus fields)
-        firestore_db.collection("buses").document(bus_doc_id).set({
-            "last_location": data,
-            "bus_id": bus_doc_id
-        }, merge=True)
-
-        # Append to history with minimal write cost (optional)
-        # You might want to throttle writes to 'history' to avoid reads/writes cost
-        firestore_db.collection("buses").document(bus_doc_id).collection("history").add(data)
+        sink.publish(location_payload(instance))
     except Exception:
-        # Don't break Django on Firestore errors — log for debug
-        import logging
-        logging.getLogger("tracking_app").exception("Failed pushing BusLocation to Firestore: %s", traceback.format_exc())
+        # Don't break Django on sink errors — log for debug
+        logger.exception("Failed queueing BusLocation for realtime sink")
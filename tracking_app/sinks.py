@@ -0,0 +1,303 @@
+# tracking_app/sinks.py
+"""
+Realtime location sinks.
+
+Ingest hands location snapshots to a sink instead of talking to Firestore
+directly. Sinks coalesce updates per bus (only the newest snapshot of a bus
+is written on each flush), downsample the 'history' trail and write from a
+background thread, so the request thread never waits on a remote service.
+
+Available sinks:
+- FirestoreSink: batched writes to buses/{bus_id} and buses/{bus_id}/history
+- MemorySink: in-process stand-in used by tests and benchmarks
+- FileSink: appends NDJSON write batches to a local file (offline runs)
+"""
+import importlib.util
+import json
+import logging
+import threading
+from datetime import datetime
+
+from django.conf import settings
+
+logger = logging.getLogger("tracking_app")
+
+# Firestore rejects batches with more than 500 operations
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def location_payload(instance):
+    """Build the snapshot dict pushed for a BusLocation instance"""
+    return {
+        "bus_id": str(instance.bus.bus_id),
+        "latitude": float(instance.latitude),
+        "longitude": float(instance.longitude),
+        "speed": float(instance.speed or 0.0),
+        "heading": float(instance.heading or 0.0),
+        "last_updated": instance.last_updated.isoformat(),
+    }
+
+
+class LocationSink:
+    """
+    Base class for coalescing, asynchronously flushed sinks.
+
+    Subclasses implement write_batch(latest, history) where `latest` maps
+    bus_id -> newest snapshot and `history` is a list of (bus_id, snapshot)
+    entries that passed the history downsampling.
+    """
+
+    def __init__(self, flush_interval=1.0, history_interval=30.0, max_pending=1000, background=True):
+        self.flush_interval = flush_interval
+        self.history_interval = history_interval
+        self.max_pending = max_pending
+        # Without a background thread the owner calls flush() itself (outbox drain)
+        self.background = background
+
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._history = []
+        self._last_history_ts = {}  # newest history entry per bus, queued or written
+        self._written_history_ts = {}  # newest history entry per bus that was written
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.published = 0
+        self.flushes = 0
+        self.errors = 0
+
+    # ---- producer side (request thread) ----
+
+    def publish(self, data):
+        """Queue one snapshot; never blocks on the remote service"""
+        self.publish_many([data])
+
+    def publish_many(self, items):
+        """Queue several snapshots at once"""
+        with self._lock:
+            for data in items:
+                bus_id = data["bus_id"]
+                current = self._latest.get(bus_id)
+                if current is None or current["last_updated"] <= data["last_updated"]:
+                    self._latest[bus_id] = data
+                if self._keep_history(bus_id, data):
+                    self._history.append((bus_id, data))
+                self.published += 1
+            pending = len(self._latest) + len(self._history)
+        if not self.background:
+            return
+        self._ensure_thread()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def _keep_history(self, bus_id, data):
+        """Downsample history to at most one entry per bus per history_interval seconds"""
+        if self.history_interval is None:
+            return False
+        ts = _timestamp(data["last_updated"])
+        last = self._last_history_ts.get(bus_id)
+        if last is not None and ts - last < self.history_interval:
+            return False
+        self._last_history_ts[bus_id] = ts
+        return True
+
+    # ---- consumer side (background thread) ----
+
+    def flush(self, raise_errors=False):
+        """
+        Write everything queued so far. Safe to call from any thread.
+        With raise_errors=True a failed write is re-raised so callers that need
+        delivery guarantees (the outbox drain) can retry instead of dropping it.
+        """
+        with self._lock:
+            latest, self._latest = self._latest, {}
+            history, self._history = self._history, []
+        if not latest and not history:
+            return 0
+        try:
+            self.write_batch(latest, history)
+        except Exception:
+            self.errors += 1
+            with self._lock:
+                self._forget_history(history)
+            if raise_errors:
+                raise
+            logger.exception("Failed flushing %d location updates to %s",
+                             len(latest) + len(history), type(self).__name__)
+        else:
+            self.flushes += 1
+            with self._lock:
+                for bus_id, data in history:
+                    self._written_history_ts[bus_id] = _timestamp(data["last_updated"])
+        return len(latest) + len(history)
+
+    def _forget_history(self, history):
+        """
+        Roll the downsampling state back past a failed batch, so re-delivered
+        snapshots (outbox retry) are kept as history again. Buses that queued
+        a newer entry since the batch was taken keep it.
+        """
+        failed = {}
+        for bus_id, data in history:
+            failed[bus_id] = _timestamp(data["last_updated"])
+        for bus_id, ts in failed.items():
+            if self._last_history_ts.get(bus_id) != ts:
+                continue
+            written = self._written_history_ts.get(bus_id)
+            if written is None:
+                self._last_history_ts.pop(bus_id, None)
+            else:
+                self._last_history_ts[bus_id] = written
+
+    def write_batch(self, latest, history):
+        raise NotImplementedError
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=f"{type(self).__name__}-flusher", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the background thread and flush what is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+
+class FirestoreSink(LocationSink):
+    """
+    Writes coalesced updates with Firestore batched writes.
+    Without an explicit client, Firebase is initialized on the first flush.
+    """
+
+    def __init__(self, client=None, **kwargs):
+        super().__init__(**kwargs)
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from firebase_config import get_db
+            self._client = get_db()
+        return self._client
+
+    def write_batch(self, latest, history):
+        buses = self.client.collection("buses")
+        batch = self.client.batch()
+        ops = 0
+        for bus_id, data in latest.items():
+            # Set last_location (merge so we keep other bus fields)
+            batch.set(buses.document(bus_id), {"last_location": data, "bus_id": bus_id}, merge=True)
+            ops += 1
+            if ops >= FIRESTORE_BATCH_LIMIT:
+                batch.commit()
+                batch, ops = self.client.batch(), 0
+        for bus_id, data in history:
+            batch.set(buses.document(bus_id).collection("history").document(), data)
+            ops += 1
+            if ops >= FIRESTORE_BATCH_LIMIT:
+                batch.commit()
+                batch, ops = self.client.batch(), 0
+        if ops:
+            batch.commit()
+
+
+class MemorySink(LocationSink):
+    """Keeps the 'Firestore' state in memory; used for tests and benchmarks"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.documents = {}
+        self.history = {}
+        self.batches = []
+
+    def write_batch(self, latest, history):
+        for bus_id, data in latest.items():
+            self.documents[bus_id] = {"last_location": data, "bus_id": bus_id}
+        for bus_id, data in history:
+            self.history.setdefault(bus_id, []).append(data)
+        self.batches.append(len(latest) + len(history))
+
+
+class FileSink(LocationSink):
+    """Appends each flushed batch to an NDJSON file, one write per line"""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def write_batch(self, latest, history):
+        with open(self.path, "a", encoding="utf-8") as fh:
+            for bus_id, data in latest.items():
+                fh.write(json.dumps({"op": "set", "bus_id": bus_id, "data": data}) + "\n")
+            for bus_id, data in history:
+                fh.write(json.dumps({"op": "history", "bus_id": bus_id, "data": data}) + "\n")
+
+
+def _timestamp(value):
+    """Seconds since epoch for an ISO string or datetime"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+# ============= Sink registry =============
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def build_sink(name=None, background=True):
+    """Create a sink from settings (REALTIME_SINK and friends). Returns None if disabled."""
+    name = name or getattr(settings, "REALTIME_SINK", "firestore")
+    options = {
+        "flush_interval": getattr(settings, "REALTIME_FLUSH_INTERVAL", 1.0),
+        "history_interval": getattr(settings, "REALTIME_HISTORY_INTERVAL", 30.0),
+        "background": background,
+    }
+    if name == "memory":
+        return MemorySink(**options)
+    if name == "file":
+        return FileSink(getattr(settings, "REALTIME_SINK_FILE", "realtime_sink.ndjson"), **options)
+    if name == "firestore":
+        # Only check that the SDK is installed; the client is created on first publish
+        if importlib.util.find_spec("firebase_admin") is None:
+            return None
+        return FirestoreSink(**options)
+    return None
+
+
+def get_sink():
+    """Process-wide sink, created on first use"""
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = build_sink() or False
+    return _sink or None
+
+
+def reset_sink():
+    """Flush and drop the current sink (settings changes, tests)"""
+    global _sink
+    with _sink_lock:
+        if _sink:
+            _sink.close()
+        _sink = None
@@ -0,0 +1,101 @@
+# tracking_app/startup.py
+"""
+Cold-start measurement.
+
+Boots Django in a fresh interpreter (`python -X importtime`) and reports the
+time spent importing each module and running each AppConfig.ready(). Used by
+the profile_startup command and by the startup budget test.
+"""
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+
+# Runs in the child interpreter: times django.setup() and every AppConfig.ready()
+_PROBE = r'''
+import json, os, sys, time
+start = time.perf_counter()
+import django
+from django.apps.config import AppConfig
+
+ready_ms = {}
+_create = AppConfig.create.__func__
+
+def _timed_create(cls, entry):
+    app = _create(cls, entry)
+    ready = app.ready
+    def timed_ready():
+        t = time.perf_counter()
+        try:
+            ready()
+        finally:
+            ready_ms[app.label] = (time.perf_counter() - t) * 1000
+    app.ready = timed_ready
+    return app
+
+AppConfig.create = classmethod(_timed_create)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", sys.argv[1])
+setup_start = time.perf_counter()
+django.setup()
+end = time.perf_counter()
+print(json.dumps({
+    "total_ms": (end - start) * 1000,
+    "setup_ms": (end - setup_start) * 1000,
+    "ready_ms": ready_ms,
+    "modules": sorted(sys.modules),
+}))
+'''
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output into a list of
+    {'module', 'self_us', 'cumulative_us', 'depth'} dicts (import order).
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        raw_name = parts[2].rstrip()
+        stripped = raw_name.lstrip()
+        imports.append({
+            "module": stripped,
+            "self_us": int(parts[0]),
+            "cumulative_us": int(parts[1]),
+            # importtime indents nested imports by two spaces per level
+            "depth": (len(raw_name) - len(stripped) - 1) // 2,
+        })
+    return imports
+
+
+def measure_startup(settings_module=None):
+    """Boot Django in a child process and return timing data"""
+    settings_module = settings_module or os.environ.get(
+        "DJANGO_SETTINGS_MODULE", "mytrackingproject.settings"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE, settings_module],
+        capture_output=True,
+        text=True,
+        cwd=str(settings.BASE_DIR),
+        env=os.environ.copy(),
+        timeout=120,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{result.stderr[-2000:]}")
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["imports"] = parse_importtime(result.stderr)
+    return report
+
+
+def top_imports(report, limit=20):
+    """Top-level imports (depth 0) sorted by cumulative time"""
+    top = [i for i in report["imports"] if i["depth"] == 0]
+    top.sort(key=lambda i: i["cumulative_us"], reverse=True)
+    return top[:limit]
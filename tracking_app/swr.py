@@ -0,0 +1,116 @@
+# tracking_app/swr.py
+"""
+Stale-while-revalidate cache on top of Django's cache.
+
+An entry is fresh for `soft_ttl` seconds. After that it is still served
+immediately, and one caller, chosen by an atomic cache.add() lock, starts a
+background recompute. Only a cold miss computes in the request, and
+concurrent cold misses wait briefly for the winner instead of all hitting
+the database.
+
+Entries and the lock are as shared as the cache backend: with the default
+per-process locmem cache (no CACHE_URL), each worker process holds its own
+copy and refreshes it itself; with a shared backend such as Redis, one
+caller across all workers does.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .location_utils import get_cache_key
+from .metrics import record_cache
+
+logger = logging.getLogger("tracking_app")
+
+
+class CachedValue:
+    """A cached value plus when it was computed and how it was served"""
+    __slots__ = ('value', 'computed_at', 'state')
+
+    def __init__(self, value, computed_at, state):
+        self.value = value
+        self.computed_at = computed_at
+        self.state = state  # 'fresh', 'stale' or 'miss'
+
+    @property
+    def age(self):
+        return max(0.0, time.time() - self.computed_at)
+
+
+class StaleWhileRevalidateCache:
+    def __init__(self, prefix, compute, soft_ttl=15.0, hard_ttl=600.0, lock_ttl=60.0, miss_wait=2.0):
+        self.prefix = prefix
+        self.compute = compute
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.lock_ttl = lock_ttl
+        self.miss_wait = miss_wait
+
+    def _keys(self, args):
+        key = get_cache_key(self.prefix, *args)
+        return key, key + ':refreshing'
+
+    def get(self, *args):
+        """CachedValue for compute(*args)"""
+        result = self._get(args)
+        record_cache(result.state != 'miss')
+        return result
+
+    def _get(self, args):
+        key, lock_key = self._keys(args)
+        entry = cache.get(key)
+        if entry is not None:
+            computed_at, value = entry
+            if time.time() - computed_at < self.soft_ttl:
+                return CachedValue(value, computed_at, 'fresh')
+            if cache.add(lock_key, 1, self.lock_ttl):
+                self._start_refresh(args, key, lock_key)
+            return CachedValue(value, computed_at, 'stale')
+
+        # Cold miss: one caller computes, the others wait for its result
+        if not cache.add(lock_key, 1, self.lock_ttl):
+            deadline = time.monotonic() + self.miss_wait
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                entry = cache.get(key)
+                if entry is not None:
+                    return CachedValue(entry[1], entry[0], 'fresh')
+            value, computed_at = self.compute(*args), time.time()
+            return CachedValue(value, computed_at, 'miss')
+        try:
+            value, computed_at = self._refresh(args, key)
+        finally:
+            cache.delete(lock_key)
+        return CachedValue(value, computed_at, 'miss')
+
+    def _refresh(self, args, key):
+        value = self.compute(*args)
+        computed_at = time.time()
+        cache.set(key, (computed_at, value), self.hard_ttl)
+        return value, computed_at
+
+    def _start_refresh(self, args, key, lock_key):
+        background = getattr(settings, 'SWR_REFRESH_IN_BACKGROUND', True)
+
+        def run():
+            try:
+                self._refresh(args, key)
+            except Exception:
+                logger.exception("Background refresh of %s failed", key)
+            finally:
+                cache.delete(lock_key)
+                if background:
+                    # The thread opened its own connection; don't leak it
+                    connections.close_all()
+
+        if background:
+            threading.Thread(target=run, name=f'swr-{self.prefix}', daemon=True).start()
+        else:
+            run()
+
+    def invalidate(self, *args):
+        cache.delete(self._keys(args)[0])
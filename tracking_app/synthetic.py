@@ -0,0 +1,316 @@
+# tracking_app/synthetic.py
+"""
+Deterministic synthetic datasets for scale testing.
+
+generate() creates owners, routes with stops, drivers, buses with weekly
+schedules, and then days of BusLocation history: every bus leaves the first
+stop of its route each morning, drives the stops back and forth at varying
+speeds with dwell time at each stop, and reports every `interval` seconds
+(every 60 s while standing, like the ingest dead band would store) until its
+service day ends. Everything derives from `seed` and the `end` date, so the
+same arguments always produce the same rows.
+
+History is generated one bus-day at a time and written in chunks with
+bulk_create, or COPY on PostgreSQL, so memory stays bounded however many
+rows are requested.
+"""
+import csv
+import io
+import math
+import random
+import time
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import connection
+
+from .models import Bus, BusLocation, BusStop, Driver, Route, Schedule
+from .retention import delete_in_batches
+
+EARTH_RADIUS_M = 6371000.0
+STANDING_REPORT_SECONDS = 60
+
+CITIES = [
+    ('Delhi', (28.6139, 77.2090)),
+    ('Kanpur', (26.4499, 80.3319)),
+    ('Mumbai', (19.0760, 72.8777)),
+    ('Bengaluru', (12.9716, 77.5946)),
+    ('Kolkata', (22.5726, 88.3639)),
+]
+FIRST_NAMES = ['Amit', 'Priya', 'Rahul', 'Sunita', 'Vikram', 'Anjali', 'Ravi', 'Neha', 'Suresh', 'Kavita']
+LAST_NAMES = ['Sharma', 'Verma', 'Singh', 'Gupta', 'Kumar', 'Yadav', 'Patel', 'Mishra']
+
+
+def _offset(lat, lng, distance_m, bearing_deg):
+    bearing = math.radians(bearing_deg)
+    dlat = distance_m * math.cos(bearing) / EARTH_RADIUS_M
+    dlng = distance_m * math.sin(bearing) / (EARTH_RADIUS_M * math.cos(math.radians(lat)))
+    return lat + math.degrees(dlat), lng + math.degrees(dlng)
+
+
+def _distance_m(a, b):
+    mean_lat = math.radians((a[0] + b[0]) / 2)
+    dx = math.radians(b[1] - a[1]) * math.cos(mean_lat)
+    dy = math.radians(b[0] - a[0])
+    return EARTH_RADIUS_M * math.hypot(dx, dy)
+
+
+def _bearing(a, b):
+    mean_lat = math.radians((a[0] + b[0]) / 2)
+    dx = math.radians(b[1] - a[1]) * math.cos(mean_lat)
+    dy = math.radians(b[0] - a[0])
+    return (math.degrees(math.atan2(dx, dy)) + 360) % 360
+
+
+class DatasetSpec:
+    """What to generate; all counts are per owner except `owners`"""
+
+    def __init__(self, owners=1, routes=5, stops=10, drivers=10, buses=20, days=30, end=None,
+                 interval=30, service_start=6, service_hours=16, seed=0, prefix='SYN'):
+        self.owners = owners
+        self.routes = max(1, routes)
+        self.stops = max(2, stops)
+        self.drivers = drivers
+        self.buses = buses
+        self.days = days
+        # History ends at midnight UTC of `end` (default: today), so reruns on the same day match
+        end = end or datetime.now(dt_timezone.utc).date()
+        self.end = datetime.combine(end, dt_time.min, tzinfo=dt_timezone.utc)
+        self.interval = interval
+        self.service_start = service_start
+        self.service_hours = service_hours
+        self.seed = seed
+        self.prefix = prefix
+
+    @property
+    def start(self):
+        return self.end - timedelta(days=self.days)
+
+    def estimated_locations(self):
+        """Approximate BusLocation rows if buses never stood still (standing reports less often)"""
+        per_day = int(self.service_hours * 3600 / self.interval)
+        return self.owners * self.buses * self.days * per_day
+
+    def rng(self, *key):
+        """Independent generator for one entity, stable across runs"""
+        return random.Random(':'.join(str(part) for part in (self.seed, *key)))
+
+
+# ============= Reference data =============
+
+def route_stops(spec, owner_index, route_index):
+    """(lat, lng) stops of one route: a meandering line across the owner's city"""
+    rng = spec.rng('route', owner_index, route_index)
+    _, center = CITIES[owner_index % len(CITIES)]
+    lat, lng = _offset(center[0], center[1], rng.uniform(3000, 8000), rng.uniform(0, 360))
+    heading = _bearing((lat, lng), center)
+    stops = [(lat, lng)]
+    for _ in range(spec.stops - 1):
+        heading = (heading + rng.uniform(-35, 35)) % 360
+        lat, lng = _offset(lat, lng, rng.uniform(400, 1500), heading)
+        stops.append((lat, lng))
+    return stops
+
+
+def create_reference_data(spec):
+    """Owners, routes, stops, drivers, buses and schedules; returns [(bus pk, stops), ...]"""
+    fleet = []
+    for o in range(spec.owners):
+        city, _ = CITIES[o % len(CITIES)]
+        owner = User.objects.create(username=f'{spec.prefix.lower()}-owner-{o:04d}', is_staff=True)
+        owner.set_unusable_password()
+        owner.save(update_fields=['password'])
+
+        stops_by_route = [route_stops(spec, o, r) for r in range(spec.routes)]
+        routes = Route.objects.bulk_create([
+            Route(owner=owner, route_id=f'{spec.prefix}-{o:04d}-R{r:03d}', name=f'{city} Line {r + 1}',
+                  start_location=f'{city} Stop {r}-0', end_location=f'{city} Stop {r}-{spec.stops - 1}')
+            for r in range(spec.routes)
+        ])
+        stops = BusStop.objects.bulk_create([
+            BusStop(stop_id=f'{spec.prefix}-{o:04d}-R{r:03d}-S{s:03d}', name=f'{city} Stop {r}-{s}',
+                    latitude=lat, longitude=lng)
+            for r, points in enumerate(stops_by_route) for s, (lat, lng) in enumerate(points)
+        ])
+        # bulk_create returns pks on PostgreSQL and SQLite; re-read them elsewhere
+        if stops and stops[0].pk is None:
+            stops = list(BusStop.objects.filter(stop_id__startswith=f'{spec.prefix}-{o:04d}-').order_by('stop_id'))
+        Route.stops.through.objects.bulk_create([
+            Route.stops.through(route_id=routes[i // spec.stops].pk, busstop_id=stop.pk)
+            for i, stop in enumerate(stops)
+        ])
+
+        rng = spec.rng('drivers', o)
+        drivers = Driver.objects.bulk_create([
+            Driver(owner=owner, driver_id=f'{spec.prefix}-{o:04d}-D{d:04d}',
+                   name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                   mobile=f'9{rng.randrange(10 ** 8, 10 ** 9)}', license_number=f'DL{rng.randrange(10 ** 9)}')
+            for d in range(spec.drivers)
+        ])
+
+        buses = Bus.objects.bulk_create([
+            Bus(owner=owner, bus_id=f'{spec.prefix}-{o:04d}-B{b:04d}', bus_number=f'{city[:2].upper()}-{b:04d}',
+                route=routes[b % spec.routes], capacity=spec.rng('bus', o, b).choice([30, 40, 50, 60]))
+            for b in range(spec.buses)
+        ])
+        if buses and buses[0].pk is None:
+            buses = list(Bus.objects.filter(owner=owner).order_by('bus_id'))
+        start = spec.start.date()
+        service_end = (datetime.combine(start, dt_time(spec.service_start))
+                       + timedelta(hours=spec.service_hours)).time()
+        Schedule.objects.bulk_create([
+            Schedule(owner=owner, schedule_id=f'{bus.bus_id}-WEEK', name=f'{bus.bus_number} weekdays',
+                     bus=bus, route=bus.route, driver=drivers[b % len(drivers)] if drivers else None,
+                     start_time=dt_time(spec.service_start), end_time=service_end,
+                     days_of_week=[0, 1, 2, 3, 4, 5], effective_from=start)
+            for b, bus in enumerate(buses)
+        ])
+        fleet.extend((bus.pk, stops_by_route[b % spec.routes]) for b, bus in enumerate(buses))
+    return fleet
+
+
+# ============= Trajectories =============
+
+class _Drive:
+    """Position of one bus shuttling along its stops"""
+
+    def __init__(self, stops, rng):
+        self.stops = stops
+        self.rng = rng
+        self.cruise_kmh = rng.uniform(18, 40)
+        self.reset()
+
+    def reset(self):
+        self.leg, self.direction, self.progress_m = 0, 1, 0.0
+        self.dwell = self.rng.uniform(60, 300)  # at the depot before the first trip
+
+    def _leg_points(self):
+        a = self.stops[self.leg]
+        b = self.stops[self.leg + self.direction]
+        return a, b
+
+    def position(self):
+        a, b = self._leg_points()
+        length = _distance_m(a, b) or 1.0
+        f = min(1.0, self.progress_m / length)
+        return a[0] + (b[0] - a[0]) * f, a[1] + (b[1] - a[1]) * f, _bearing(a, b)
+
+    def step(self, seconds):
+        """Advance `seconds`; returns the speed (km/h) over the step"""
+        if self.dwell > 0:
+            self.dwell -= seconds
+            return 0.0
+        self.cruise_kmh = min(55.0, max(8.0, self.cruise_kmh + self.rng.gauss(0, 4)))
+        remaining = self.cruise_kmh / 3.6 * seconds
+        a, b = self._leg_points()
+        left = _distance_m(a, b) - self.progress_m
+        if remaining < left:
+            self.progress_m += remaining
+            return self.cruise_kmh
+        # Arrived at the next stop: dwell, then continue (turning round at either end)
+        self.leg += self.direction
+        self.progress_m = 0.0
+        if not 0 <= self.leg + self.direction < len(self.stops):
+            self.direction = -self.direction
+        self.dwell = self.rng.uniform(15, 90)
+        return self.cruise_kmh
+
+
+def bus_day_rows(spec, bus_pk, stops, day_index, drive):
+    """(bus_pk, lat, lng, speed, heading, timestamp) rows of one bus for one service day"""
+    rng = drive.rng
+    day = spec.start + timedelta(days=day_index)
+    t = day + timedelta(hours=spec.service_start, seconds=rng.uniform(0, 1800))
+    end = t + timedelta(hours=spec.service_hours)
+    drive.reset()
+    while t < end:
+        standing = drive.dwell > 0
+        lat, lng, heading = drive.position()
+        noise = rng.gauss(0, 4)
+        lat, lng = _offset(lat, lng, abs(noise), rng.uniform(0, 360))
+        step = spec.interval if not standing else max(spec.interval, STANDING_REPORT_SECONDS)
+        speed = drive.step(step)
+        yield (bus_pk, round(lat, 6), round(lng, 6), round(speed, 1), round(heading, 1), t)
+        t += timedelta(seconds=step * rng.uniform(0.9, 1.1))
+
+
+def location_rows(spec, fleet):
+    """All history rows, bus by bus and day by day (a generator; nothing is held in memory)"""
+    for index, (bus_pk, stops) in enumerate(fleet):
+        drive = _Drive(stops, spec.rng('drive', index))
+        for day_index in range(spec.days):
+            yield from bus_day_rows(spec, bus_pk, stops, day_index, drive)
+
+
+# ============= Writers =============
+
+LOCATION_COLUMNS = ['bus_id', 'latitude', 'longitude', 'speed', 'heading', 'last_updated']
+
+
+def copy_supported():
+    """COPY is used on PostgreSQL through psycopg2 (the driver in requirements.txt)"""
+    return connection.vendor == 'postgresql' and connection.Database.__name__ == 'psycopg2'
+
+
+def write_bulk_create(rows):
+    BusLocation.objects.bulk_create([
+        BusLocation(bus_id=bus_pk, latitude=lat, longitude=lng, speed=speed, heading=heading, last_updated=ts)
+        for bus_pk, lat, lng, speed, heading, ts in rows
+    ])
+
+
+def write_copy(rows):
+    """COPY the rows into BusLocation (PostgreSQL with psycopg2)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for bus_pk, lat, lng, speed, heading, ts in rows:
+        writer.writerow((bus_pk, lat, lng, speed, heading, ts.isoformat()))
+    buffer.seek(0)
+    table = connection.ops.quote_name(BusLocation._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(BusLocation._meta.get_field(c).column) for c in LOCATION_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def write_locations(rows, chunk_size=10000, use_copy=None, progress=None):
+    """Write an iterable of rows in chunks; returns the number written"""
+    if use_copy is None:
+        use_copy = copy_supported()
+    write = write_copy if use_copy else write_bulk_create
+    written, chunk = 0, []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            write(chunk)
+            written += len(chunk)
+            chunk = []
+            if progress:
+                progress(written)
+    if chunk:
+        write(chunk)
+        written += len(chunk)
+        if progress:
+            progress(written)
+    return written
+
+
+def clear(prefix):
+    """Delete a previously generated dataset (history first, in batches)"""
+    owners = User.objects.filter(username__startswith=f'{prefix.lower()}-owner-')
+    deleted = delete_in_batches(BusLocation.objects.filter(bus__owner__in=owners), batch_size=10000)
+    BusStop.objects.filter(stop_id__startswith=f'{prefix}-').delete()
+    owners.delete()
+    return deleted
+
+
+def generate(spec, chunk_size=10000, use_copy=None, progress=None):
+    """Create reference data and history for `spec`; returns (buses, locations written)"""
+    fleet = create_reference_data(spec)
+    started = time.monotonic()
+
+    def report(written):
+        if progress:
+            progress(written, time.monotonic() - started)
+
+    written = write_locations(location_rows(spec, fleet), chunk_size, use_copy, report)
+    return len(fleet), written
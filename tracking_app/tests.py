@@ -1,12 +1,59 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, LiveServerTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
 from django.urls import reverse
 from django.utils import timezone
-from datetime import timedelta
+from collections import Counter
+from datetime import date, time as dt_time, timedelta
+from io import StringIO
+from unittest import mock
+import asyncio
+import contextlib
+import csv
+import gzip
+import io
 import json
+import os
+import pstats
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import unittest
 
-from .models import Bus, Route, BusLocation, UserLocation
+from load_simulator import LoadSimulator, VirtualVehicle, build_fleet, distance_m
+from mobile_gps_sender import MobileGPSSender
+
+from .models import (
+    Bus, Route, BusLocation, UserLocation, BusStop, CompactTrajectory, Driver, LocationOutbox, LocationRollup,
+    RetentionPolicy, Schedule, ScheduleException,
+)
 from .location_utils import get_location_name, get_route_display_name
+from .archive import archive_day, archive_files, read_range
+from .benchmark import BENCH_OWNER, SCENARIOS, compare, load_baseline, peak_rss_mb, resource, run_benchmarks
+from .export import export_rows, read_export, stream_export
+from .ingest import get_pipeline, ingest, reset_pipeline
+from .metrics import REGISTRY
+from .odometer import advance
+from .outbox import drain_batch
+from .profiling import list_profiles
+from .query_audit import full_scans
+from .replay import replay
+from .retention import enforce_owner
+from .rollups import day_of, fold_days, rebuild, window_totals
+from .sinks import MemorySink, get_sink, reset_sink
+from .startup import measure_startup, parse_importtime
+from .swr import StaleWhileRevalidateCache
+from .synthetic import DatasetSpec, clear, generate
+from .trajectory import (
+    POINT_PRECISIONS, compact_bus_history, decode_polyline, encode_polyline, history_points, simplify,
+)
 
 
 class BusModelTests(TestCase):
@@ -160,6 +207,7 @@ class AdminAnalyticsTests(TestCase):
     """Test the fixed admin analytics"""
     
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.admin_user = User.objects.create_user(
             username='admin',
@@ -303,3 +351,1514 @@ class AdminVehicleProfileTests(TestCase):
         self.assertEqual(bus_data['driver_name'], 'Profile Test Driver')
         self.assertIn('bus_number', bus_data)
         self.assertEqual(bus_data['bus_number'], 'PB-123')
+
+
+class RealtimeSinkTests(TestCase):
+    """Test the coalescing realtime sink that replaced direct Firestore writes"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='sinkadmin', password='testpass123', is_staff=True)
+        self.route = Route.objects.create(
+            owner=self.user, route_id='SINK-ROUTE', name='Sink Route',
+            start_location='A', end_location='B'
+        )
+        self.bus = Bus.objects.create(owner=self.user, bus_id='SINK-BUS', bus_number='SK-1', route=self.route)
+
+    def _payload(self, bus_id, seconds, lat=28.6):
+        ts = timezone.now().replace(microsecond=0) + timedelta(seconds=seconds)
+        return {'bus_id': bus_id, 'latitude': lat, 'longitude': 77.2, 'speed': 0.0,
+                'heading': 0.0, 'last_updated': ts.isoformat()}
+
+    def test_updates_are_coalesced_per_bus(self):
+        """Only the newest snapshot of each bus is written per flush"""
+        sink = MemorySink(flush_interval=60, history_interval=None)
+        for i in range(5):
+            sink.publish(self._payload('A', i, lat=28.0 + i))
+        sink.publish(self._payload('B', 0))
+        sink.close()
+
+        self.assertEqual(sink.documents['A']['last_location']['latitude'], 32.0)
+        self.assertIn('B', sink.documents)
+        self.assertEqual(sink.batches, [2])
+
+    def test_history_is_downsampled(self):
+        """History keeps at most one entry per history_interval seconds per bus"""
+        sink = MemorySink(flush_interval=60, history_interval=30)
+        for i in range(0, 100, 5):
+            sink.publish(self._payload('A', i))
+        sink.close()
+
+        self.assertEqual(len(sink.history['A']), 4)  # t=0, 30, 60, 90
+
+    def test_signal_queues_to_configured_sink(self):
+        """Saving a BusLocation queues it without a synchronous remote call"""
+        with override_settings(REALTIME_OUTBOX=False, REALTIME_SINK='memory', REALTIME_FLUSH_INTERVAL=60):
+            reset_sink()
+            try:
+                BusLocation.objects.create(bus=self.bus, latitude=28.6, longitude=77.2)
+                sink = get_sink()
+                self.assertEqual(sink.published, 1)
+                sink.flush()
+                self.assertEqual(sink.documents['SINK-BUS']['bus_id'], 'SINK-BUS')
+            finally:
+                reset_sink()
+
+
+class LocationOutboxTests(TestCase):
+    """Test the transactional outbox used for realtime fan-out"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='outboxadmin', password='testpass123', is_staff=True)
+        self.route = Route.objects.create(
+            owner=self.user, route_id='OUTBOX-ROUTE', name='Outbox Route',
+            start_location='A', end_location='B'
+        )
+        self.bus = Bus.objects.create(owner=self.user, bus_id='OUTBOX-BUS', bus_number='OB-1', route=self.route)
+
+    def _post_fix(self, lat):
+        return self.client.post(
+            '/api/device/update-location/',
+            data=json.dumps({'bus_id': 'OUTBOX-BUS', 'latitude': lat, 'longitude': 77.2}),
+            content_type='application/json'
+        )
+
+    def test_ingest_appends_outbox_row(self):
+        """Each stored location gets an outbox row in the same transaction"""
+        self.assertEqual(self._post_fix(28.61).status_code, 200)
+        self.assertEqual(LocationOutbox.objects.count(), 1)
+        self.assertEqual(LocationOutbox.objects.get().payload['bus_id'], 'OUTBOX-BUS')
+
+    def test_drain_publishes_and_deletes(self):
+        """drain_outbox publishes rows in order to every sink and deletes them"""
+        for i in range(3):
+            self._post_fix(28.61 + i * 0.01)
+
+        with override_settings(REALTIME_SINK='memory'):
+            call_command('drain_outbox', '--once', stdout=StringIO())
+        self.assertEqual(LocationOutbox.objects.count(), 0)
+
+    def test_failed_publish_keeps_rows(self):
+        """Rows stay in the outbox when a sink fails, so delivery is retried"""
+        class BrokenSink(MemorySink):
+            def write_batch(self, latest, history):
+                raise RuntimeError('firestore unavailable')
+
+        self._post_fix(28.61)
+        with self.assertRaises(RuntimeError):
+            drain_batch([BrokenSink(background=False)])
+        self.assertEqual(LocationOutbox.objects.count(), 1)
+
+        sink = MemorySink(background=False)
+        self.assertEqual(drain_batch([sink]), 1)
+        self.assertIn('OUTBOX-BUS', sink.documents)
+        self.assertEqual(LocationOutbox.objects.count(), 0)
+
+    def test_retry_after_failed_flush_keeps_history(self):
+        """A sink that failed once still writes the history entries when the outbox re-delivers them"""
+        class FlakySink(MemorySink):
+            failures = 1
+
+            def write_batch(self, latest, history):
+                if self.failures:
+                    self.failures -= 1
+                    raise RuntimeError('firestore unavailable')
+                super().write_batch(latest, history)
+
+        self._post_fix(28.61)
+        sink = FlakySink(background=False, history_interval=30)
+        with self.assertRaises(RuntimeError):
+            drain_batch([sink])
+        self.assertEqual(drain_batch([sink]), 1)
+        self.assertEqual(len(sink.history['OUTBOX-BUS']), 1)
+        self.assertEqual(LocationOutbox.objects.count(), 0)
+
+
+class StartupBudgetTests(TestCase):
+    """Guard cold start: Firebase must stay lazy and django.setup() within budget"""
+
+    def test_startup_within_budget(self):
+        """Boot a fresh interpreter and fail if startup regresses"""
+        report = measure_startup()
+
+        self.assertNotIn('firebase_config', report['modules'])
+        self.assertNotIn('firebase_admin', report['modules'])
+        self.assertIn('tracking_app', report['ready_ms'])
+        self.assertLess(report['setup_ms'], settings.STARTUP_TIME_BUDGET_MS)
+
+    def test_parse_importtime(self):
+        """Nested imports are reported with their depth"""
+        stderr = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |   json.decoder\n"
+            "import time:       300 |        420 | json\n"
+        )
+        imports = parse_importtime(stderr)
+        self.assertEqual([i['module'] for i in imports], ['json.decoder', 'json'])
+        self.assertEqual([i['depth'] for i in imports], [1, 0])
+        self.assertEqual(imports[1]['cumulative_us'], 420)
+
+
+class IngestPipelineTests(TestCase):
+    """Test the batch ingest pipeline behind the location endpoints"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='ingestadmin', password='testpass123', is_staff=True)
+        self.route = Route.objects.create(
+            owner=self.user, route_id='INGEST-ROUTE', name='Ingest Route',
+            start_location='A', end_location='B'
+        )
+        self.bus = Bus.objects.create(owner=self.user, bus_id='INGEST-BUS', bus_number='IN-1', route=self.route)
+
+    def _post_batch(self, fixes):
+        return self.client.post('/api/update_locations/', data=json.dumps({'fixes': fixes}),
+                                content_type='application/json')
+
+    def test_batch_is_persisted_with_fanout(self):
+        """A batch is bulk-inserted and gets outbox rows without post_save"""
+        base = timezone.now() - timedelta(minutes=5)
+        fixes = [{'bus_id': 'INGEST-BUS', 'latitude': 28.6 + i * 0.001, 'longitude': 77.2,
+                  'timestamp': (base + timedelta(seconds=10 * i)).isoformat()} for i in range(5)]
+        response = self._post_batch(fixes)
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['accepted'], 5)
+        self.assertEqual(BusLocation.objects.filter(bus=self.bus).count(), 5)
+        self.assertEqual(LocationOutbox.objects.count(), 5)
+        # Client timestamps are kept
+        self.assertEqual(BusLocation.objects.filter(bus=self.bus).last().last_updated, base)
+
+    def test_invalid_and_duplicate_fixes(self):
+        """Bad fixes are rejected by index and retransmits are dropped"""
+        ts = timezone.now().isoformat()
+        fix = {'bus_id': 'INGEST-BUS', 'latitude': 28.6, 'longitude': 77.2, 'timestamp': ts}
+        response = self._post_batch([fix, dict(fix), {'bus_id': 'INGEST-BUS', 'latitude': 123, 'longitude': 0}])
+
+        data = json.loads(response.content)
+        self.assertEqual(data['accepted'], 1)
+        self.assertEqual(data['duplicates'], 1)
+        self.assertEqual(data['rejected'], [{'index': 2, 'error': 'Coordinates out of range'}])
+
+    def test_future_timestamps_are_rejected(self):
+        """A fix stamped beyond the allowed clock skew never becomes the current location"""
+        now = timezone.now()
+        fixes = [{'bus_id': 'INGEST-BUS', 'latitude': 28.6, 'longitude': 77.2, 'timestamp': ts}
+                 for ts in ((now + timedelta(days=365)).isoformat(), (now + timedelta(seconds=30)).isoformat(),
+                            1e15)]
+        data = self._post_batch(fixes).json()
+        self.assertEqual(data['accepted'], 1)
+        self.assertEqual(data['rejected'], [{'index': 0, 'error': 'Timestamp is in the future'},
+                                            {'index': 2, 'error': 'Invalid timestamp'}])
+        self.assertLess(self.bus.get_current_location().last_updated, now + timedelta(minutes=1))
+
+    def test_single_fix_endpoints_use_pipeline(self):
+        """update_location and device_update_location go through the timed stages"""
+        get_pipeline().stats.reset()
+        self.client.post('/api/update_location/', data=json.dumps(
+            {'bus_id': 'NEW-SIM-BUS', 'latitude': 28.6, 'longitude': 77.2}), content_type='application/json')
+        response = self.client.post('/api/device/update-location/', data=json.dumps(
+            {'bus_id': 'UNKNOWN', 'latitude': 28.6, 'longitude': 77.2}), content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+        snapshot = get_pipeline().stats.snapshot()
+        stages = {s['stage']: s for s in snapshot['stages']}
+        self.assertEqual(snapshot['batches'], 2)
+        self.assertEqual(stages['validate']['fixes'], 2)
+        self.assertEqual(stages['persist']['fixes'], 1)
+        self.assertTrue(Bus.objects.filter(bus_id='NEW-SIM-BUS').exists())
+
+        self.client.login(username='ingestadmin', password='testpass123')
+        response = self.client.get('/api/admin/ingest_stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('us_per_fix', json.loads(response.content)['pipeline']['stages'][0])
+
+
+class DeadBandTests(TestCase):
+    """Test suppression of redundant stationary fixes"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='deadband', password='testpass123', is_staff=True)
+        self.route = Route.objects.create(
+            owner=self.user, route_id='DB-ROUTE', name='Depot Route',
+            start_location='Depot', end_location='Town'
+        )
+        self.bus = Bus.objects.create(owner=self.user, bus_id='DEPOT-BUS', bus_number='DP-1', route=self.route)
+        self.start = timezone.now() - timedelta(minutes=10)
+
+    def _fix(self, seconds, lat=28.6, heading=0.0):
+        return {'bus_id': 'DEPOT-BUS', 'latitude': lat, 'longitude': 77.2, 'heading': heading,
+                'timestamp': (self.start + timedelta(seconds=seconds)).isoformat()}
+
+    def _post(self, fixes):
+        response = self.client.post('/api/update_locations/', data=json.dumps({'fixes': fixes}),
+                                    content_type='application/json')
+        return json.loads(response.content)
+
+    def test_parked_bus_stores_heartbeat_only(self):
+        """Fixes within the band are skipped but last_seen keeps moving"""
+        reset_pipeline()
+        # Every 5 s for 2 minutes, jitter of ~1 m: one row per 60 s window
+        with self.captureOnCommitCallbacks(execute=True):
+            data = self._post([self._fix(s, lat=28.6 + (s % 2) * 0.00001) for s in range(0, 120, 5)])
+
+        self.assertEqual(data['accepted'], 2)
+        self.assertEqual(data['suppressed'], 22)
+        self.bus.refresh_from_db()
+        self.assertEqual(self.bus.last_seen, self.start + timedelta(seconds=115))
+
+        self.client.login(username='deadband', password='testpass123')
+        stats = json.loads(self.client.get('/api/admin/ingest_stats/').content)
+        self.assertEqual(stats['scope'], 'process')
+        self.assertEqual(stats['pid'], os.getpid())
+        self.assertEqual(stats['deadband'][0]['bus_id'], 'DEPOT-BUS')
+        self.assertEqual(stats['deadband'][0]['suppressed'], 22)
+
+    def test_rolled_back_batch_is_not_counted(self):
+        """Counts only move once the batch that produced them commits"""
+        reset_pipeline()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self._post([self._fix(s) for s in range(0, 30, 5)])
+                transaction.set_rollback(True)
+
+        self.client.login(username='deadband', password='testpass123')
+        stats = json.loads(self.client.get('/api/admin/ingest_stats/').content)
+        self.assertEqual(stats['deadband'], [])
+
+    def test_movement_or_turn_is_stored(self):
+        """Moving beyond the distance or heading threshold always stores"""
+        reset_pipeline()
+        data = self._post([
+            self._fix(0),
+            self._fix(5, lat=28.6005),            # ~55 m
+            self._fix(10, lat=28.6005, heading=90),  # turned
+            self._fix(15, lat=28.6005, heading=92),  # within band
+        ])
+        self.assertEqual(data['accepted'], 3)
+        self.assertEqual(data['suppressed'], 1)
+
+
+class TrajectoryCompactionTests(TestCase):
+    """Test Douglas-Peucker compaction of old history"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='compact', password='testpass123', is_staff=True)
+        self.route = Route.objects.create(
+            owner=self.user, route_id='CMP-ROUTE', name='Compact Route',
+            start_location='A', end_location='B'
+        )
+        self.bus = Bus.objects.create(owner=self.user, bus_id='CMP-BUS', bus_number='CP-1', route=self.route)
+
+    def test_polyline_round_trip(self):
+        """Encoded points decode back within precision"""
+        points = [(28.61391, 77.20902, 0, 12.3), (28.61452, 77.21011, 15, 30.0), (28.6, 77.2, 95, 0.0)]
+        decoded = list(decode_polyline(encode_polyline(points, POINT_PRECISIONS), POINT_PRECISIONS))
+        for original, result in zip(points, decoded):
+            for a, b in zip(original, result):
+                self.assertAlmostEqual(a, b, places=4)
+
+    def test_straight_line_simplifies_to_endpoints(self):
+        """Collinear points collapse to the first and last point"""
+        points = [(28.6 + i * 0.0001, 77.2 + i * 0.0001) for i in range(50)]
+        self.assertEqual(simplify(points, 1.0), [points[0], points[-1]])
+
+    def test_compaction_replaces_rows_and_history_merges(self):
+        """Old fixes become trajectories; history reads merge them with recent raw rows"""
+        start = timezone.now() - timedelta(days=2)
+        old = [BusLocation(bus=self.bus, latitude=28.6 + i * 0.0001, longitude=77.2, speed=30,
+                           last_updated=start + timedelta(seconds=5 * i)) for i in range(200)]
+        # Second trip after a long gap
+        old += [BusLocation(bus=self.bus, latitude=28.7, longitude=77.3 + i * 0.0001, speed=20,
+                            last_updated=start + timedelta(hours=3, seconds=5 * i)) for i in range(100)]
+        BusLocation.objects.bulk_create(old)
+        BusLocation.objects.create(bus=self.bus, latitude=28.8, longitude=77.4)
+
+        call_command('compact_history', '--older-than-hours', '24', stdout=StringIO())
+
+        self.assertEqual(CompactTrajectory.objects.filter(bus=self.bus).count(), 2)
+        self.assertEqual(BusLocation.objects.filter(bus=self.bus).count(), 1)
+        points = list(history_points(self.bus))
+        self.assertEqual(len(points), 5)  # 2 + 2 compacted endpoints, 1 raw
+        self.assertEqual([p['compacted'] for p in points], [True] * 4 + [False])
+        self.assertLess(abs((points[0]['timestamp'] - start).total_seconds()), 1)
+        self.assertAlmostEqual(points[1]['latitude'], 28.6199, places=4)
+
+        # Time-range reads cut inside a compacted trip
+        window = list(history_points(self.bus, start=start + timedelta(hours=2), end=start + timedelta(hours=4)))
+        self.assertEqual(len(window), 2)
+
+    def test_compaction_keeps_newest_fix_and_caps_trips(self):
+        """A bus that stopped reporting keeps its last raw fix; long trips are split and paged"""
+        start = timezone.now() - timedelta(days=2)
+        BusLocation.objects.bulk_create([
+            BusLocation(bus=self.bus, latitude=28.6 + i * 0.0001, longitude=77.2, speed=30,
+                        last_updated=start + timedelta(seconds=5 * i)) for i in range(250)])
+        newest = BusLocation.objects.filter(bus=self.bus).order_by('-last_updated').first()
+
+        trips, raw, _ = compact_bus_history(self.bus, timezone.now(), chunk_size=40, max_trip_fixes=100)
+        self.assertEqual((trips, raw), (3, 249))  # 100 + 100 + 49; the newest fix stays raw
+        self.assertEqual(self.bus.get_current_location(), newest)
+        self.assertEqual(BusLocation.latest_for([self.bus.pk]), {self.bus.pk: newest})
+        self.assertEqual(len(list(history_points(self.bus))), 7)
+
+
+class HistoryArchiveTests(TestCase):
+    """Test the columnar cold-history archive"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.user = User.objects.create_user(username='archiver', password='testpass123')
+        self.route = Route.objects.create(
+            owner=self.user, route_id='ARC-ROUTE', name='Archive Route',
+            start_location='A', end_location='B'
+        )
+        self.bus = Bus.objects.create(owner=self.user, bus_id='ARC-BUS', bus_number='AR-1', route=self.route)
+        self.other = Bus.objects.create(owner=self.user, bus_id='ARC-BUS-2', bus_number='AR-2', route=self.route)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_archive_moves_old_days_and_reader_scans_range(self):
+        """Old days go to one file per owner/day, rows are deleted, range scans read them back"""
+
+        day_start = (timezone.now() - timedelta(days=5)).replace(hour=0, minute=0, second=0, microsecond=0)
+        old = [BusLocation(bus=self.bus if i % 2 else self.other, latitude=28.6 + i * 0.001, longitude=77.2,
+                           speed=i, heading=90, last_updated=day_start + timedelta(minutes=i)) for i in range(120)]
+        old += [BusLocation(bus=self.bus, latitude=28.9, longitude=77.5, speed=5,
+                            last_updated=day_start + timedelta(days=1, hours=2))]
+        BusLocation.objects.bulk_create(old)
+        recent = BusLocation.objects.create(bus=self.bus, latitude=28.8, longitude=77.4)
+
+        call_command('archive_history', days=2, chunk_size=50, root=self.root, stdout=StringIO())
+
+        self.assertEqual(list(BusLocation.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertEqual(len(archive_files(self.user.id, root=self.root)), 2)
+
+        window = list(read_range(self.user.id, day_start + timedelta(minutes=10),
+                                 day_start + timedelta(minutes=20), root=self.root))
+        self.assertEqual([p['speed'] for p in window], list(range(10, 20)))
+        self.assertEqual(window[0]['timestamp'], day_start + timedelta(minutes=10))
+        self.assertAlmostEqual(window[0]['latitude'], 28.61)
+
+        one_bus = list(read_range(self.user.id, bus_pk=self.bus.pk, root=self.root))
+        self.assertEqual(len(one_bus), 61)
+        self.assertTrue(all(p['bus_id'] == 'ARC-BUS' for p in one_bus))
+
+    def test_rerun_writes_new_part_file(self):
+        """Archiving the same day twice never overwrites an existing file"""
+        when = timezone.now() - timedelta(days=10)
+        BusLocation.objects.create(bus=self.bus, latitude=28.6, longitude=77.2, last_updated=when)
+        archive_day(self.user.id, when.date(), root=self.root)
+        archive_day(self.user.id, when.date(), root=self.root)
+        self.assertEqual(len(archive_files(self.user.id, root=self.root)), 2)
+
+
+class RetentionTests(TestCase):
+    """Test per-owner retention and the batched cleanup API"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='keeper', password='testpass123', is_staff=True)
+        self.other = User.objects.create_user(username='hoarder', password='testpass123', is_staff=True)
+        route = Route.objects.create(owner=self.user, route_id='RET-ROUTE', name='Retention Route',
+                                     start_location='A', end_location='B')
+        self.bus = Bus.objects.create(owner=self.user, bus_id='RET-BUS', bus_number='RT-1', route=route)
+        self.other_bus = Bus.objects.create(owner=self.other, bus_id='RET-BUS', bus_number='RT-2', route=route)
+        now = timezone.now()
+        rows = []
+        for bus in (self.bus, self.other_bus):
+            for age_days in (0, 3, 10, 40):
+                rows += [BusLocation(bus=bus, latitude=28.6, longitude=77.2,
+                                     last_updated=now - timedelta(days=age_days, minutes=i)) for i in range(5)]
+        BusLocation.objects.bulk_create(rows)
+
+    def test_command_applies_per_owner_windows_in_batches(self):
+        """Owners with a policy use it, others fall back to LOCATION_RETENTION_DAYS"""
+        RetentionPolicy.objects.create(owner=self.user, retention_days=7)
+
+        with self.settings(LOCATION_RETENTION_DAYS=30):
+            call_command('enforce_retention', batch_size=2, sleep=0, duty=1.0, stdout=StringIO())
+
+        self.assertEqual(BusLocation.objects.filter(bus=self.bus).count(), 10)
+        self.assertEqual(BusLocation.objects.filter(bus=self.other_bus).count(), 15)
+
+    def test_zero_days_keeps_history(self):
+        """retention_days=0 disables deletion for that owner"""
+        RetentionPolicy.objects.create(owner=self.user, retention_days=0)
+        self.assertFalse(any(enforce_owner(self.user.id, 0).values()))
+        self.assertEqual(BusLocation.objects.filter(bus=self.bus).count(), 20)
+
+    def test_retention_prunes_rollups_and_archive_files(self):
+        """Rollups and whole archived days past the window go with the raw rows; newer ones stay"""
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        now = timezone.now()
+        for age_days in (3, 40):
+            LocationRollup.objects.create(owner=self.user, bus=self.bus, fix_count=5,
+                                          minute=now.replace(second=0, microsecond=0) - timedelta(days=age_days))
+        for age_days in (3, 40):
+            archive_day(self.user.id, (now - timedelta(days=age_days)).date(), root=root)
+
+        counts = enforce_owner(self.user.id, 7, batch_size=2, now=now, archive_root=root)
+        self.assertEqual(counts, {'locations': 10, 'trajectories': 0, 'rollups': 1, 'archive_files': 1})
+        self.assertEqual(LocationRollup.objects.filter(bus=self.bus).count(), 1)
+        self.assertEqual(len(archive_files(self.user.id, root=root)), 1)
+
+    def test_clean_old_locations_deletes_only_older_rows_of_owner(self):
+        """The dashboard cleanup removes rows older than `days`, not the recent ones"""
+        self.client.login(username='keeper', password='testpass123')
+        response = self.client.post('/api/admin/clean_old_locations/', data=json.dumps({'days': 1}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['deleted'], 15)
+        self.assertEqual(BusLocation.objects.filter(bus=self.bus).count(), 5)
+        self.assertEqual(BusLocation.objects.filter(bus=self.other_bus).count(), 20)
+
+        response = self.client.post('/api/admin/retention_policy/', data=json.dumps({'retention_days': 14}),
+                                    content_type='application/json')
+        self.assertEqual(response.json()['retention_days'], 14)
+        self.assertFalse(response.json()['is_default'])
+
+    def test_non_object_json_is_rejected(self):
+        """A JSON body that is not an object is a 400, not a server error"""
+        self.client.login(username='keeper', password='testpass123')
+        for path in ('/api/admin/clean_old_locations/', '/api/admin/retention_policy/'):
+            for body in ('[]', '5', '"days"'):
+                response = self.client.post(path, data=body, content_type='application/json')
+                self.assertEqual(response.status_code, 400, (path, body))
+        self.assertEqual(BusLocation.objects.count(), 40)
+
+
+class IndexAuditTests(TestCase):
+    """Test that hot history queries are served by indexes"""
+
+    def test_hot_queries_use_indexes(self):
+        """audit_indexes passes against the migrated schema"""
+        out = StringIO()
+        call_command('audit_indexes', stdout=out)
+        self.assertIn('Index audit passed', out.getvalue())
+
+    def test_full_scan_detection(self):
+        """Table scans of history tables are flagged, index searches are not"""
+        self.assertEqual(full_scans(['SCAN tracking_app_buslocation'], vendor='sqlite'),
+                         ['tracking_app_buslocation'])
+        self.assertEqual(full_scans(['SEARCH tracking_app_buslocation USING INDEX buslocation_time_idx (last_updated<?)',
+                                     'SCAN tracking_app_route'], vendor='sqlite'), [])
+        self.assertEqual(full_scans(['LIST SUBQUERY 1', 'SCAN U0'], vendor='sqlite'), ['U0'])
+        self.assertEqual(full_scans(['  ->  Seq Scan on tracking_app_compacttrajectory  (cost=0.00..1.01 rows=1)'],
+                                    vendor='postgresql'), ['tracking_app_compacttrajectory'])
+
+
+class BusHistoryAPITests(TestCase):
+    """Test the simplified per-bus history endpoint"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='historian', password='testpass123')
+        route = Route.objects.create(owner=self.user, route_id='HIS-ROUTE', name='History Route',
+                                     start_location='A', end_location='B')
+        self.bus = Bus.objects.create(owner=self.user, bus_id='HIS-BUS', bus_number='HS-1', route=route)
+        self.start = timezone.now() - timedelta(hours=2)
+        # Zig-zag so simplification can't collapse it to two points
+        BusLocation.objects.bulk_create([
+            BusLocation(bus=self.bus, latitude=28.6 + i * 0.001, longitude=77.2 + (0.002 if i % 2 else 0),
+                        speed=30, last_updated=self.start + timedelta(seconds=10 * i))
+            for i in range(500)
+        ])
+
+    def test_history_is_bounded_by_max_points(self):
+        """A long window is simplified down to max_points"""
+        response = self.client.get('/api/bus/HIS-BUS/history/', {'max_points': 50})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['raw_points'], 500)
+        self.assertLessEqual(data['points'], 50)
+        self.assertEqual(len(data['segments']), 1)
+        decoded = list(decode_polyline(data['segments'][0]['polyline']))
+        self.assertEqual(len(decoded), data['points'])
+        self.assertAlmostEqual(decoded[0][0], 28.6, places=4)
+
+    def test_time_range_and_bbox_filter(self):
+        """from/to and bbox restrict the points considered"""
+        params = {
+            'from': (self.start + timedelta(seconds=100)).isoformat(),
+            'to': str((self.start + timedelta(seconds=590)).timestamp()),
+        }
+        data = self.client.get('/api/bus/HIS-BUS/history/', params).json()
+        self.assertEqual(data['raw_points'], 50)
+
+        params['bbox'] = '77.19,28.6,77.21,28.6155'
+        data = self.client.get('/api/bus/HIS-BUS/history/', params).json()
+        self.assertEqual(data['raw_points'], 6)
+
+    def test_bbox_exit_splits_path(self):
+        """Leaving the bbox ends a segment instead of joining across the gap"""
+        bus = Bus.objects.create(owner=self.user, bus_id='HIS-LOOP', bus_number='HS-2', route=self.bus.route)
+        # East along the bbox, out of it for 50 s, then back in
+        BusLocation.objects.bulk_create([
+            BusLocation(bus=bus, latitude=28.7, longitude=77.5 if 10 <= i < 15 else 77.3 + i * 0.0005,
+                        speed=20, last_updated=self.start + timedelta(seconds=10 * i))
+            for i in range(20)
+        ])
+        data = self.client.get('/api/bus/HIS-LOOP/history/', {'bbox': '77.29,28.69,77.32,28.71'}).json()
+        self.assertEqual(data['raw_points'], 15)
+        self.assertEqual([segment['points'] for segment in data['segments']], [10, 5])
+        second = data['segments'][1]
+        self.assertEqual(second['started_at'], (self.start + timedelta(seconds=150)).isoformat())
+        track = list(decode_polyline(second['track'], POINT_PRECISIONS))
+        self.assertAlmostEqual(track[0][1], 77.3075, places=4)
+        self.assertEqual([point[2] for point in track], [0, 10, 20, 30, 40])
+
+    def test_time_range_is_capped(self):
+        """from/to spanning more than HISTORY_MAX_HOURS is rejected"""
+        params = {'from': (self.start - timedelta(hours=1)).isoformat(), 'to': self.start.isoformat()}
+        with override_settings(HISTORY_MAX_HOURS=2):
+            self.assertEqual(self.client.get('/api/bus/HIS-BUS/history/', params).status_code, 200)
+        with override_settings(HISTORY_MAX_HOURS=0.5):
+            response = self.client.get('/api/bus/HIS-BUS/history/', params)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('0.5 hours', response.json()['error'])
+
+    def test_errors(self):
+        """Unknown bus is 404, bad parameters are 400"""
+        self.assertEqual(self.client.get('/api/bus/NOPE/history/').status_code, 404)
+        self.assertEqual(self.client.get('/api/bus/HIS-BUS/history/', {'bbox': '1,2'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/bus/HIS-BUS/history/', {'from': 'yesterday'}).status_code, 400)
+
+
+class LocationExportTests(TestCase):
+    """Test streaming CSV/NDJSON export"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='exporter', password='testpass123', is_staff=True)
+        other = User.objects.create_user(username='stranger', password='testpass123', is_staff=True)
+        route = Route.objects.create(owner=self.user, route_id='EXP-ROUTE', name='Export Route',
+                                     start_location='A', end_location='B')
+        self.bus = Bus.objects.create(owner=self.user, bus_id='EXP-1', bus_number='EX-1', route=route)
+        bus2 = Bus.objects.create(owner=self.user, bus_id='EXP-2', bus_number='EX-2', route=route)
+        foreign = Bus.objects.create(owner=other, bus_id='EXP-1', bus_number='EX-9', route=route)
+        self.start = timezone.now() - timedelta(hours=1)
+        BusLocation.objects.bulk_create(
+            [BusLocation(bus=bus, latitude=28.6, longitude=77.2 + i * 0.001, last_updated=self.start + timedelta(seconds=i))
+             for bus in (self.bus, bus2, foreign) for i in range(10)]
+        )
+
+    def test_csv_export_is_owner_scoped_and_filtered(self):
+        """Only the admin's rows, limited to the requested bus and time range"""
+        self.client.login(username='exporter', password='testpass123')
+        response = self.client.get('/api/admin/export_locations/', {
+            'bus': 'EXP-1', 'from': (self.start + timedelta(seconds=5)).isoformat(),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['bus_id', 'latitude', 'longitude', 'speed', 'heading', 'timestamp'])
+        self.assertEqual(len(rows), 6)
+        self.assertTrue(all(row[0] == 'EXP-1' for row in rows[1:]))
+
+    def test_gzip_ndjson_export(self):
+        """gzip=1 streams a valid gzip file of NDJSON lines"""
+        self.client.login(username='exporter', password='testpass123')
+        response = self.client.get('/api/admin/export_locations/', {'format': 'ndjson', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 20)
+        self.assertEqual(json.loads(lines[0])['bus_id'], 'EXP-1')
+
+    def test_command_writes_file_and_rejects_non_staff(self):
+        """The command exports to a file; the endpoint is admin-only"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.csv')
+            call_command('export_locations', 'exporter', output=path, stdout=StringIO())
+            with open(path) as fh:
+                self.assertEqual(len(fh.read().splitlines()), 21)
+        self.assertEqual(self.client.get('/api/admin/export_locations/').status_code, 403)
+
+
+class LocationRollupTests(TestCase):
+    """Test per-minute rollups maintained at ingest"""
+
+    def setUp(self):
+        reset_pipeline()
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='roller', password='testpass123', is_staff=True)
+        route = Route.objects.create(owner=self.user, route_id='ROL-ROUTE', name='Rollup Route',
+                                     start_location='A', end_location='B')
+        self.bus = Bus.objects.create(owner=self.user, bus_id='ROL-BUS', bus_number='RL-1', route=route)
+        self.t0 = (timezone.now() - timedelta(minutes=30)).replace(second=0, microsecond=0)
+
+    def _fix(self, seconds, lat, speed=36.0):
+        return {'bus_id': 'ROL-BUS', 'latitude': lat, 'longitude': 77.2, 'speed': speed,
+                'timestamp': (self.t0 + timedelta(seconds=seconds)).isoformat()}
+
+    def test_ingest_updates_rollups_across_batches(self):
+        """Counts, speeds and distance accumulate per minute, including across batch boundaries"""
+        ingest([self._fix(0, 28.600), self._fix(20, 28.601, 54.0)])
+        ingest([self._fix(40, 28.602), self._fix(70, 28.603)])
+
+        rows = {r.minute: r for r in LocationRollup.objects.filter(bus=self.bus)}
+        first, second = rows[self.t0], rows[self.t0 + timedelta(minutes=1)]
+        self.assertEqual((first.fix_count, second.fix_count), (3, 1))
+        self.assertEqual(first.max_speed, 54.0)
+        self.assertAlmostEqual(first.avg_speed, 42.0)
+        # ~111 m per 0.001 degree of latitude; the second batch continues from the first
+        self.assertAlmostEqual(first.distance_m, 222.4, delta=1.0)
+        self.assertAlmostEqual(second.distance_m, 111.2, delta=1.0)
+        self.assertEqual(first.owner_id, self.user.id)
+
+    def test_analytics_sums_rollups(self):
+        """admin_analytics reports counts and distance from rollups"""
+        ingest([self._fix(i * 10, 28.6 + i * 0.001) for i in range(6)])
+        self.client.login(username='roller', password='testpass123')
+        summary = self.client.get('/api/admin/analytics/').json()['summary']
+        self.assertEqual(summary['total_locations'], 6)
+        self.assertEqual(summary['updates_last_hour'], 6)
+        self.assertAlmostEqual(summary['distance_km_24h'], 0.556, delta=0.01)
+
+    def test_rebuild_matches_incremental(self):
+        """rebuild_rollups recomputes the same totals from raw rows"""
+        ingest([self._fix(i * 15, 28.6 + i * 0.0005) for i in range(10)])
+        before = sorted(LocationRollup.objects.values_list('minute', 'fix_count', 'distance_m'))
+        LocationRollup.objects.all().delete()
+        call_command('rebuild_rollups', stdout=StringIO())
+        after = sorted(LocationRollup.objects.values_list('minute', 'fix_count', 'distance_m'))
+        self.assertEqual([r[:2] for r in before], [r[:2] for r in after])
+        for b, a in zip(before, after):
+            self.assertAlmostEqual(b[2], a[2], places=3)
+
+    def test_rebuild_keeps_rollups_of_compacted_history(self):
+        """Minutes whose raw rows were compacted away keep their rollups; the raw tail is recomputed"""
+        ingest([self._fix(i * 15, 28.6 + i * 0.0005) for i in range(10)])
+        compacted_until = self.t0 + timedelta(seconds=75)
+        CompactTrajectory.objects.create(bus=self.bus, started_at=self.t0, ended_at=compacted_until,
+                                         raw_points=6, point_count=2, tolerance_m=5.0, encoded='')
+        BusLocation.objects.filter(bus=self.bus, last_updated__lte=compacted_until).delete()
+        before = sorted(LocationRollup.objects.values_list('minute', 'fix_count'))
+
+        written, skipped = rebuild(self.t0 - timedelta(minutes=5), timezone.now())
+        self.assertEqual((written, skipped), (1, []))
+        self.assertEqual(sorted(LocationRollup.objects.values_list('minute', 'fix_count')), before)
+
+    def test_fold_days_keeps_totals(self):
+        """Old minutes fold into one row per bus-day without changing window totals"""
+        old = self.t0 - timedelta(days=10)
+        self.t0 = old.replace(hour=8)
+        ingest([self._fix(i * 40, 28.6 + i * 0.001) for i in range(6)])
+        before = window_totals(self.user.id, {'all': None})
+        self.assertEqual(LocationRollup.objects.filter(bus=self.bus).count(), 4)
+
+        self.assertEqual(fold_days(self.user.id), 4)  # all four minutes merge into a new midnight row
+        self.assertEqual(fold_days(self.user.id), 0)
+        self.assertEqual(list(LocationRollup.objects.values_list('minute', 'fix_count')), [(day_of(self.t0), 6)])
+        after = window_totals(self.user.id, {'all': None})
+        self.assertEqual(after['all']['fixes'], before['all']['fixes'])
+        self.assertAlmostEqual(after['all']['distance_km'], before['all']['distance_km'], places=3)
+
+        # Rebuilding the folded day recomputes it from the still-stored raw rows, without double counting
+        written, skipped = rebuild(self.t0 - timedelta(hours=1), self.t0 + timedelta(hours=1))
+        self.assertEqual(skipped, [self.bus.pk])
+        written, skipped = rebuild(day_of(self.t0), day_of(self.t0) + timedelta(days=1))
+        self.assertEqual(window_totals(self.user.id, {'all': None})['all']['fixes'], 6)
+
+
+class AnalyticsQueryCountTests(TestCase):
+    """admin_analytics must not issue queries per route or per bus"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='counter', password='testpass123', is_staff=True)
+        self.routes = 0
+
+    def _add_routes(self, count):
+        now = timezone.now()
+        for _ in range(count):
+            self.routes += 1
+            route = Route.objects.create(owner=self.user, route_id=f'QC-{self.routes}', name=f'Route {self.routes}',
+                                         start_location='A', end_location='B')
+            for b in range(2):
+                bus = Bus.objects.create(owner=self.user, bus_id=f'QC-{self.routes}-{b}', bus_number='Q', route=route)
+                BusLocation.objects.create(bus=bus, latitude=28.6, longitude=77.2,
+                                           last_updated=now - timedelta(minutes=b * 10))
+
+    def _query_count(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/admin/analytics/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_query_count_is_constant_in_routes(self):
+        """Same number of queries for 3 and 30 routes, with correct per-route numbers"""
+        self.client.login(username='counter', password='testpass123')
+        self._add_routes(3)
+        small, _ = self._query_count()
+        self._add_routes(27)
+        large, data = self._query_count()
+        self.assertEqual(small, large)
+        self.assertEqual(len(data['routes']), 30)
+        self.assertTrue(all(r['buses'] == 2 and r['active_recent'] == 1 for r in data['routes']))
+
+
+@override_settings(SWR_REFRESH_IN_BACKGROUND=False)
+class AnalyticsCacheTests(TestCase):
+    """Test the stale-while-revalidate analytics cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def _cache(self):
+
+        def compute(owner_id):
+            self.calls.append(owner_id)
+            return {'n': len(self.calls)}
+        return StaleWhileRevalidateCache('test_swr', compute, soft_ttl=10)
+
+    def test_stale_value_served_then_refreshed_once(self):
+        """A stale entry is returned as-is while a single refresh runs"""
+        swr = self._cache()
+        first = swr.get(1)
+        self.assertEqual((first.value, first.state), ({'n': 1}, 'miss'))
+        self.assertEqual(swr.get(1).state, 'fresh')
+
+        with mock.patch('tracking_app.swr.time.time', return_value=first.computed_at + 11):
+            stale = swr.get(1)
+        self.assertEqual((stale.value, stale.state), ({'n': 1}, 'stale'))
+        self.assertGreaterEqual(stale.age, 0)
+        self.assertEqual(swr.get(1).value, {'n': 2})
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_single_flight_while_refresh_in_progress(self):
+        """No second recompute starts while another caller holds the refresh lock"""
+        swr = self._cache()
+        first = swr.get(7)
+        cache.add(swr._keys((7,))[1], 1, 60)
+        with mock.patch('tracking_app.swr.time.time', return_value=first.computed_at + 11):
+            for _ in range(5):
+                self.assertEqual(swr.get(7).state, 'stale')
+        self.assertEqual(self.calls, [7])
+
+    def test_analytics_response_reports_age(self):
+        """The endpoint includes cache state and computation age"""
+        User.objects.create_user(username='swr', password='testpass123', is_staff=True)
+        client = Client()
+        client.login(username='swr', password='testpass123')
+        data = client.get('/api/admin/analytics/').json()
+        self.assertEqual(data['cache']['state'], 'miss')
+        data = client.get('/api/admin/analytics/').json()
+        self.assertEqual(data['cache']['state'], 'fresh')
+        self.assertIn('age_seconds', data['cache'])
+
+
+class BusOdometerTests(TestCase):
+    """Test per-bus odometer, derived speed and moving/idle time maintained at ingest"""
+
+    def setUp(self):
+        reset_pipeline()
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='odo', password='testpass123', is_staff=True)
+        route = Route.objects.create(owner=self.user, route_id='ODO-ROUTE', name='Odometer Route',
+                                     start_location='A', end_location='B')
+        self.bus = Bus.objects.create(owner=self.user, bus_id='ODO-BUS', bus_number='OD-1', route=route)
+        self.t0 = (timezone.now() - timedelta(minutes=30)).replace(second=0, microsecond=0)
+
+    def _fix(self, seconds, lat, speed=0.0):
+        return {'bus_id': 'ODO-BUS', 'latitude': lat, 'longitude': 77.2, 'speed': speed,
+                'timestamp': (self.t0 + timedelta(seconds=seconds)).isoformat()}
+
+    def test_ingest_accumulates_across_batches(self):
+        """Distance and moving time continue from the previous batch; speed is derived from the fixes"""
+        ingest([self._fix(0, 28.600), self._fix(20, 28.601)])
+        ingest([self._fix(40, 28.602)])
+        self.bus.refresh_from_db()
+        self.assertAlmostEqual(self.bus.odometer_km, 0.2224, delta=0.001)
+        self.assertEqual(self.bus.moving_seconds, 40.0)
+        # 111 m in 20 s ~ 20 km/h, although the device reported 0
+        self.assertAlmostEqual(self.bus.current_speed, 20.0, delta=0.1)
+        self.assertEqual(self.bus.last_moved_at, self.t0 + timedelta(seconds=40))
+
+    def test_advance_idle_gaps_and_out_of_order(self):
+        """Slow intervals count as idle, long gaps add nothing, older fixes are ignored"""
+        bus = Bus(odometer_km=0.0, moving_seconds=0.0, idle_seconds=0.0)
+        self.assertTrue(advance(bus, 28.6, 77.2, 12.0, self.t0))
+        self.assertEqual(bus.current_speed, 12.0)
+        advance(bus, 28.60001, 77.2, 0.0, self.t0 + timedelta(seconds=30))
+        self.assertEqual((bus.moving_seconds, bus.idle_seconds), (0.0, 30.0))
+        self.assertIsNone(bus.last_moved_at)
+        advance(bus, 28.7, 77.2, 30.0, self.t0 + timedelta(hours=2))
+        self.assertLess(bus.odometer_km, 0.01)
+        self.assertEqual(bus.current_speed, 30.0)
+        self.assertFalse(advance(bus, 28.8, 77.2, 0.0, self.t0))
+
+    def test_admin_views_read_stored_state(self):
+        """admin_list_buses and analytics report the stored odometer"""
+        ingest([self._fix(i * 10, 28.6 + i * 0.001) for i in range(6)])
+        self.client.login(username='odo', password='testpass123')
+        bus = self.client.get('/api/admin/list_buses/').json()['buses'][0]
+        self.assertAlmostEqual(bus['odometer_km'], 0.556, delta=0.01)
+        self.assertEqual(bus['moving_seconds'], 50.0)
+        summary = self.client.get('/api/admin/analytics/').json()['summary']
+        self.assertAlmostEqual(summary['fleet_odometer_km'], 0.556, delta=0.01)
+
+
+class LoadSimulatorTests(LiveServerTestCase):
+    """Test the asyncio load simulator (load_simulator.py) against a live server"""
+
+    def setUp(self):
+        reset_pipeline()
+
+    def test_fleet_is_deterministic_and_moves(self):
+        """Routes depend only on the seed; vehicles advance along them"""
+        first, second = build_fleet(50, seed=7), build_fleet(50, seed=7)
+        self.assertEqual([v.route for v in first], [v.route for v in second])
+        self.assertEqual(len({v.bus_id for v in first}), 50)
+        vehicle = first[0]
+        vehicle.speed_range = (36.0, 36.0)
+        vehicle.speed_kmh = 36.0
+        before = vehicle.position()
+        vehicle.advance(10)
+        self.assertAlmostEqual(distance_m(before, vehicle.position()), 100.0, delta=1.0)
+
+    def test_zero_length_route_is_rejected(self):
+        """A route that goes nowhere fails at construction instead of hanging advance()"""
+        point = (28.6139, 77.2090)
+        with self.assertRaises(ValueError):
+            VirtualVehicle('STUCK', [point, point, point], (10, 50), random.Random(0))
+        with self.assertRaises(ValueError):
+            build_fleet(1, radius_km=0)
+
+    def test_run_posts_batches_over_keep_alive_connections(self):
+        """A short run stores fixes from every vehicle and reuses its connections"""
+        fleet = build_fleet(30, seed=1, prefix='SIM')
+        simulator = LoadSimulator(fleet, server_url=self.live_server_url, interval=0.5, batch_size=10,
+                                  connections=1, seed=1, linger=0.05)
+        stats = asyncio.run(simulator.run(duration=1.5, report_every=0))
+
+        self.assertEqual(stats.errors, 0)
+        self.assertEqual(stats.statuses, {200: stats.requests})
+        self.assertGreater(stats.requests, 3)
+        self.assertLess(simulator.connections_opened, stats.requests)
+        self.assertEqual(Bus.objects.filter(bus_id__startswith='SIM-').count(), 30)
+        self.assertGreaterEqual(BusLocation.objects.filter(bus__bus_id__startswith='SIM-').count(), 30)
+
+
+class BenchmarkTests(TestCase):
+    """Test the benchmark harness (tracking_app/benchmark.py)"""
+
+    def setUp(self):
+        reset_pipeline()
+
+    def test_run_reports_every_scenario_and_cleans_up(self):
+        """A tiny run measures all scenarios without errors and removes its data"""
+        report = run_benchmarks(buses=5, history=3, iterations=3)
+        self.assertEqual(list(report['scenarios']), list(SCENARIOS))
+        for result in report['scenarios'].values():
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['throughput'], 0)
+            self.assertGreater(result['queries_per_call'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(report['scenarios']['update_locations_batch']['items'], 150)
+        self.assertFalse(Bus.objects.filter(bus_id__startswith='BENCH-').exists())
+        self.assertFalse(User.objects.filter(username=BENCH_OWNER).exists())
+
+    def test_compare_flags_regressions(self):
+        """Slower throughput/latency beyond tolerance and extra queries are regressions"""
+        params = {'buses': 5, 'history': 3, 'iterations': 3, 'driver': 'client'}
+        base = {'errors': 0, 'throughput': 100.0, 'p50_ms': 10.0, 'p99_ms': 20.0, 'queries_per_call': 5.0}
+        baseline = {'params': params, 'scenarios': {'get_locations': base}}
+
+        within = dict(base, throughput=80.0, p99_ms=25.0)
+        self.assertEqual(compare({'params': params, 'scenarios': {'get_locations': within}}, baseline, 0.3), [])
+        worse = dict(base, throughput=60.0, p50_ms=14.0, queries_per_call=6.0)
+        messages = compare({'params': params, 'scenarios': {'get_locations': worse}}, baseline, 0.3)
+        self.assertEqual(len(messages), 3)
+        other = dict(params, buses=50)
+        self.assertEqual(len(compare({'params': other, 'scenarios': {}}, baseline)), 1)
+
+    def test_refuses_outside_test_database(self):
+        """Seeding/cleanup need allow_destructive unless the database is a test one"""
+        User.objects.create_user(username='benchmark', password='testpass123')
+        with mock.patch.dict(connection.settings_dict, {'NAME': '/srv/tracking/db.sqlite3'}):
+            with self.assertRaises(ValueError):
+                run_benchmarks(buses=2, history=1, iterations=1)
+            with self.assertRaises(CommandError):
+                call_command('benchmark', '--buses', '2', stdout=StringIO())
+        self.assertFalse(Bus.objects.filter(bus_id__startswith='BENCH-').exists())
+        # A real user that happens to be called "benchmark" is never touched
+        run_benchmarks(buses=2, history=1, iterations=1)
+        self.assertTrue(User.objects.filter(username='benchmark').exists())
+
+    def test_missing_baseline_fails_the_command(self):
+        """Without a stored baseline the command errors unless it records one"""
+        args = ['--buses', '2', '--history', '1', '--iterations', '1', '--scenario', 'get_locations']
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'baseline.json')
+            with self.assertRaisesMessage(CommandError, 'No baseline'):
+                call_command('benchmark', *args, '--baseline', path, stdout=StringIO())
+            self.assertFalse(Bus.objects.filter(bus_id__startswith='BENCH-').exists())
+            call_command('benchmark', *args, '--baseline', path, '--save-baseline', stdout=StringIO())
+            self.assertEqual(list(load_baseline(path)['scenarios']), ['get_locations'])
+
+    @unittest.skipIf(resource is None, 'resource module not available')
+    def test_peak_rss_units_follow_platform(self):
+        """ru_maxrss is bytes on macOS and kilobytes on Linux"""
+        usage = mock.Mock(ru_maxrss=200 * 1024 * 1024)
+        with mock.patch.object(resource, 'getrusage', return_value=usage):
+            with mock.patch.object(sys, 'platform', 'darwin'):
+                self.assertEqual(peak_rss_mb(), 200.0)
+            with mock.patch.object(sys, 'platform', 'linux'):
+                self.assertEqual(peak_rss_mb(), 200.0 * 1024)
+
+    @unittest.skipUnless(os.environ.get('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run the benchmark suite')
+    def test_benchmarks_within_baseline(self):
+        """Full benchmark run compared against BENCHMARK_BASELINE (fails on regression)"""
+        out = StringIO()
+        try:
+            call_command('benchmark', stdout=out)
+        except CommandError as e:
+            self.fail(f'{e}\n{out.getvalue()}')
+
+
+class SyntheticDatasetTests(TestCase):
+    """Test the synthetic dataset generator (tracking_app/synthetic.py, generate_dataset)"""
+
+    def _spec(self, **kwargs):
+        options = dict(owners=2, routes=2, stops=4, drivers=3, buses=3, days=2, end=date(2026, 1, 10),
+                       interval=60, service_hours=1, seed=5)
+        options.update(kwargs)
+        return DatasetSpec(**options)
+
+    def _history(self):
+        return list(BusLocation.objects.order_by('bus__bus_id', 'last_updated')
+                    .values_list('bus__bus_id', 'latitude', 'longitude', 'speed', 'last_updated'))
+
+    def test_generation_is_deterministic(self):
+        """The same seed and end date produce identical rows; another seed does not"""
+        generate(self._spec())
+        first = self._history()
+        clear('SYN')
+        self.assertEqual(BusLocation.objects.count(), 0)
+        generate(self._spec())
+        self.assertEqual(self._history(), first)
+        clear('SYN')
+        generate(self._spec(seed=6))
+        self.assertNotEqual(self._history(), first)
+
+    def test_reference_data_and_chunked_history(self):
+        """All entity types are created and history is written in bounded chunks"""
+        chunks = []
+        spec = self._spec()
+        buses, written = generate(spec, chunk_size=50, progress=lambda n, elapsed: chunks.append(n))
+        self.assertEqual(buses, 6)
+        self.assertEqual(Route.objects.filter(route_id__startswith='SYN-').count(), 4)
+        self.assertEqual(BusStop.objects.filter(stop_id__startswith='SYN-').count(), 16)
+        self.assertEqual(Route.stops.through.objects.count(), 16)
+        self.assertEqual(Driver.objects.count(), 6)
+        self.assertEqual(Schedule.objects.count(), 6)
+        self.assertEqual(written, BusLocation.objects.count())
+        self.assertLess(written, spec.estimated_locations() * 1.2)
+        self.assertGreater(written, spec.estimated_locations() // 2)
+        self.assertTrue(all(b - a <= 50 for a, b in zip([0] + chunks, chunks)))
+        first_fix = BusLocation.objects.order_by('last_updated').first().last_updated
+        self.assertGreaterEqual(first_fix, spec.start + timedelta(hours=6))
+
+    def test_command_dry_run_writes_nothing(self):
+        """--dry-run only prints the estimate"""
+        out = StringIO()
+        call_command('generate_dataset', '--owners', '10', '--buses', '100', '--months', '3', '--dry-run', stdout=out)
+        self.assertIn('about 172,800,000 locations', out.getvalue())
+        self.assertFalse(Bus.objects.exists())
+
+
+class HistoryReplayTests(LiveServerTestCase):
+    """Test replaying recorded history (tracking_app/replay.py, replay_history)"""
+
+    def setUp(self):
+        reset_pipeline()
+        self.user = User.objects.create_user(username='replayer', password='testpass123', is_staff=True)
+        route = Route.objects.create(owner=self.user, route_id='RPL-ROUTE', name='Replay Route',
+                                     start_location='A', end_location='B')
+        t0 = timezone.now() - timedelta(hours=1)
+        for n, bus_id in enumerate(['RPL-1', 'RPL-2']):
+            bus = Bus.objects.create(owner=self.user, bus_id=bus_id, bus_number=bus_id, route=route)
+            for i in range(5):
+                BusLocation.objects.create(bus=bus, latitude=28.6 + i * 0.002, longitude=77.2 + n * 0.01,
+                                           speed=30.0, last_updated=t0 + timedelta(seconds=i + n * 0.5))
+
+    def test_replay_history_in_order_at_speed(self):
+        """Fixes are re-sent 10x faster, each bus in recorded order, stamped with their due time"""
+        rows = list(export_rows(self.user))
+        BusLocation.objects.all().delete()
+        started = timezone.now()
+        replayer = replay(rows, self.live_server_url, report_every=0, speed=10, batch_size=10, connections=2)
+
+        self.assertEqual(replayer.stats.fixes, 10)
+        self.assertEqual(replayer.stats.errors, 0)
+        # 4.5 s of recorded history at 10x
+        self.assertGreaterEqual(replayer.elapsed, 0.4)
+        for bus_id in ['RPL-1', 'RPL-2']:
+            stored = list(BusLocation.objects.filter(bus__bus_id=bus_id).order_by('id')
+                          .values_list('latitude', 'last_updated'))
+            self.assertEqual([lat for lat, _ in stored], sorted(lat for lat, _ in stored))
+            self.assertEqual(len(stored), 5)
+            self.assertGreaterEqual(stored[0][1], started - timedelta(seconds=1))
+            self.assertAlmostEqual((stored[-1][1] - stored[0][1]).total_seconds(), 0.4, delta=0.01)
+
+    def test_read_export_round_trip(self):
+        """read_export parses CSV and NDJSON exports, gzipped or not"""
+        expected = list(export_rows(self.user))
+        for fmt, compress in [('csv', True), ('ndjson', False)]:
+            with tempfile.NamedTemporaryFile(suffix=f'.{fmt}') as fh:
+                for chunk in stream_export(iter(expected), fmt, compress):
+                    fh.write(chunk)
+                fh.flush()
+                self.assertEqual(list(read_export(fh.name)), expected)
+
+
+class CompressedBatchUploadTests(TestCase):
+    """Test Content-Encoding: gzip on /api/update_locations/"""
+
+    def setUp(self):
+        reset_pipeline()
+        self.client = Client()
+
+    def post(self, body, encoding):
+        return self.client.post('/api/update_locations/', data=body, content_type='application/json',
+                                HTTP_CONTENT_ENCODING=encoding)
+
+    def test_gzip_batch_is_accepted(self):
+        """A gzip-compressed batch is decoded and ingested like a plain one"""
+        fixes = [{'bus_id': 'GZ-1', 'latitude': 28.6 + i * 0.001, 'longitude': 77.2,
+                  'timestamp': (timezone.now() - timedelta(seconds=10 - i)).isoformat()} for i in range(3)]
+        response = self.post(gzip.compress(json.dumps({'fixes': fixes}).encode()), 'gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['accepted'], 3)
+
+    @override_settings(INGEST_MAX_DECODED_BYTES=1000)
+    def test_bad_encodings_are_refused(self):
+        """Unknown encodings, corrupt gzip and oversized decoded bodies are refused"""
+        self.assertEqual(self.post(b'{}', 'br').status_code, 415)
+        self.assertEqual(self.post(b'not gzip', 'gzip').status_code, 400)
+        self.assertEqual(self.post(gzip.compress(b' ' * 5000), 'gzip').status_code, 413)
+        self.assertEqual(BusLocation.objects.count(), 0)
+
+
+class OfflineSenderTests(LiveServerTestCase):
+    """Test the offline queue and batched upload of mobile_gps_sender"""
+
+    def setUp(self):
+        reset_pipeline()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queue_path = os.path.join(self.tmp.name, 'queue.sqlite3')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_sender(self, server_url):
+        sender = MobileGPSSender(server_url, 'OFFLINE-1', queue_path=self.queue_path)
+        self.addCleanup(sender.queue.close)
+        return sender
+
+    def test_fixes_survive_outage_and_upload_in_one_batch(self):
+        """Fixes taken offline are kept on disk and later uploaded together, in order"""
+        offline = self.make_sender('http://127.0.0.1:9')  # discard port: connection refused
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(5):
+                offline.retry_at = 0.0
+                self.assertFalse(offline.send_gps_data(28.6 + i * 0.001, 77.2, force=True))
+        self.assertEqual(offline.failures, 5)
+        self.assertEqual(len(offline.queue), 5)
+
+        sender = self.make_sender(self.live_server_url)  # e.g. after a restart
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(sender.flush(force=True), 5)
+        self.assertEqual(len(sender.queue), 0)
+        latitudes = list(BusLocation.objects.filter(bus__bus_id='OFFLINE-1')
+                         .order_by('last_updated').values_list('latitude', flat=True))
+        self.assertEqual(latitudes, [28.6 + i * 0.001 for i in range(5)])
+
+    def test_backoff_suppresses_retries(self):
+        """After a failure no request is made until the backoff has passed, and it grows per failure"""
+        sender = self.make_sender('http://127.0.0.1:9')
+        with contextlib.redirect_stdout(io.StringIO()):
+            sender.send_gps_data(28.6, 77.2, force=True)
+            first_wait = sender.retry_at - time.monotonic()
+            sender.server_url = self.live_server_url
+            self.assertEqual(sender.flush(force=True), 0)
+            self.assertEqual(len(sender.queue), 1)
+            sender.retry_at = 0.0
+            sender.server_url = 'http://127.0.0.1:9'
+            sender.flush(force=True)
+        self.assertGreater(sender.retry_at - time.monotonic(), first_wait)
+
+    def test_oversized_batches_are_split_not_dropped(self):
+        """A 413 halves the batch size until the server accepts it, so no fix is lost"""
+        sender = self.make_sender(self.live_server_url)
+        sender.batch_size = 25
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(25):
+                sender.queue.push({'bus_id': 'OFFLINE-1', 'latitude': 28.6 + i * 0.001, 'longitude': 77.2,
+                                   'timestamp': (timezone.now() - timedelta(seconds=60 - i)).isoformat()})
+            with override_settings(INGEST_MAX_BATCH=10):
+                self.assertEqual(sender.flush(force=True), 25)
+        self.assertEqual(sender.batch_size, 6)
+        self.assertEqual(len(sender.queue), 0)
+        self.assertEqual(BusLocation.objects.filter(bus__bus_id='OFFLINE-1').count(), 25)
+
+    def test_non_json_success_is_retried(self):
+        """A 200 that is not the API's JSON (captive portal) keeps the fixes queued"""
+        sender = self.make_sender(self.live_server_url)
+        portal = mock.Mock(status_code=200, text='<html>Sign in to Wi-Fi</html>')
+        portal.json.side_effect = ValueError('not json')
+        with contextlib.redirect_stdout(io.StringIO()), mock.patch.object(sender.session, 'post', return_value=portal):
+            self.assertFalse(sender.send_gps_data(28.6, 77.2, force=True))
+        self.assertEqual(len(sender.queue), 1)
+        self.assertEqual(sender.failures, 1)
+
+    def test_resent_batch_is_stored_once(self):
+        """A batch re-sent after a lost response is deduplicated against stored rows"""
+        sender = self.make_sender(self.live_server_url)
+        fixes = [{'bus_id': 'OFFLINE-1', 'latitude': 28.6 + i * 0.001, 'longitude': 77.2,
+                  'timestamp': (timezone.now() - timedelta(seconds=30 - i)).isoformat()} for i in range(5)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(sender._upload(fixes), 'sent')
+            reset_pipeline()  # as if another worker process answered the retry
+            self.assertEqual(sender._upload(fixes + [dict(fixes[0], timestamp=timezone.now().isoformat())]), 'sent')
+        self.assertEqual(BusLocation.objects.filter(bus__bus_id='OFFLINE-1').count(), 6)
+
+
+class RequestMetricsTests(TestCase):
+    """Test the metrics middleware and the /metrics endpoint"""
+
+    def setUp(self):
+        REGISTRY.reset()
+        cache.clear()
+        self.client = Client()
+        self.staff = User.objects.create_user(username='metrics_admin', password='testpass123', is_staff=True)
+        route = Route.objects.create(owner=self.staff, route_id='MET-ROUTE', name='Metrics Route',
+                                     start_location='A', end_location='B')
+        bus = Bus.objects.create(owner=self.staff, bus_id='MET-1', bus_number='MET-1', route=route)
+        BusLocation.objects.create(bus=bus, latitude=28.6139, longitude=77.2090)
+
+    def scrape(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_requests_recorded_per_url_name(self):
+        """Latency, status, query and byte counters are kept per URL name; unknown paths share one label"""
+        for _ in range(2):
+            self.client.get('/api/get_locations/')
+        self.client.get('/no/such/page/')
+        samples = self.scrape()
+        self.assertEqual(samples['tracking_http_requests_total{view="get_locations",status="2xx"}'], 2)
+        self.assertEqual(samples['tracking_http_request_duration_seconds_count{view="get_locations"}'], 2)
+        self.assertEqual(samples['tracking_http_request_duration_seconds_bucket{view="get_locations",le="+Inf"}'], 2)
+        self.assertGreater(samples['tracking_http_db_queries_total{view="get_locations"}'], 0)
+        self.assertGreater(samples['tracking_http_response_bytes_total{view="get_locations"}'], 0)
+        self.assertEqual(samples['tracking_http_requests_total{view="<unmatched>",status="4xx"}'], 1)
+
+    def test_cache_hits_and_misses(self):
+        """The analytics cache reports a miss, then a hit"""
+        self.client.force_login(self.staff)
+        for _ in range(2):
+            self.assertEqual(self.client.get('/api/admin/analytics/').status_code, 200)
+        samples = self.scrape()
+        self.assertEqual(samples['tracking_http_cache_misses_total{view="admin_analytics"}'], 1)
+        self.assertEqual(samples['tracking_http_cache_hits_total{view="admin_analytics"}'], 1)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_requires_staff_or_token(self):
+        """Anonymous scrapes are refused; the bearer token or a staff session is accepted"""
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer sécret').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+
+class RequestProfilingTests(TestCase):
+    """Test the opt-in profiling middleware, its staff endpoints and the profiles command"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        overrides = override_settings(PROFILE_DIR=self.tmp.name, PROFILE_BUFFER_SIZE=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.client = Client()
+        self.staff = User.objects.create_user(username='profiler', password='testpass123', is_staff=True)
+
+    def test_staff_header_captures_profile(self):
+        """X-Profile: 1 from staff stores top functions and the SQL timeline; others are not profiled"""
+        response = self.client.get('/api/admin/get_current_schedules/', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/admin/get_current_schedules/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        profile_id = response['X-Profile-Id']
+
+        detail = self.client.get(f'/api/admin/profiles/{profile_id}/').json()
+        self.assertEqual(detail['view'], 'admin_get_current_schedules')
+        self.assertEqual(detail['trigger'], 'header')
+        self.assertTrue(detail['functions'])
+        self.assertGreater(detail['query_count'], 0)
+        self.assertEqual(len(detail['queries']), detail['query_count'])
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in detail['queries']))
+        self.assertEqual([p['id'] for p in self.client.get('/api/admin/profiles/').json()['profiles']], [profile_id])
+        self.assertEqual(self.client.get('/api/admin/profiles/../../etc/').status_code, 404)
+
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/admin/profiles/').status_code, 403)
+
+    def test_sampling_ring_buffer_and_command(self):
+        """Sampled requests are profiled, only the newest PROFILE_BUFFER_SIZE are kept"""
+        with override_settings(PROFILE_SAMPLE_RATE=1.0):
+            ids = [self.client.get('/api/routes/')['X-Profile-Id'] for _ in range(3)]
+        kept = [summary['id'] for summary in list_profiles()]
+        self.assertEqual(sorted(kept), sorted(ids)[1:])
+
+        self.assertIn('SQL timeline', self._call('profiles', kept[0], '--sql'))
+        self.assertIn('[sample]', self._call('profiles'))
+        export = os.path.join(self.tmp.name, 'out.prof')
+        self._call('profiles', kept[0], '--export', export)
+        self.assertTrue(pstats.Stats(export).total_calls > 0)
+
+    def test_unwritable_profile_dir_keeps_response(self):
+        """A failure storing the profile is logged; the request still gets its normal response"""
+        blocker = os.path.join(self.tmp.name, 'not-a-dir')
+        open(blocker, 'w').close()
+        with override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=os.path.join(blocker, 'profiles')), \
+                self.assertLogs('tracking_app', level='ERROR'):
+            response = self.client.get('/api/routes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+
+    def _call(self, *args):
+        out = io.StringIO()
+        call_command(*args, stdout=out)
+        return out.getvalue()
+
+
+class QueryBudgetMixin:
+    """
+    assertQueriesConstant(): the queries a request makes must not grow with the
+    number of rows it lists, so a reintroduced per-row (N+1) query fails the build.
+    """
+    QUERY_BUDGET_SIZES = (1, 10, 100)
+
+    def assertQueriesConstant(self, seed, request, sizes=None):
+        """
+        For each size, seed(start, stop) adds rows start..stop-1 and request() makes the
+        call; fails with the most repeated statement if the query counts differ.
+        """
+
+        counts, statements, seeded = {}, {}, 0
+        for size in sizes or self.QUERY_BUDGET_SIZES:
+            seed(seeded, size)
+            seeded = size
+            cache.clear()  # a warm cache on later calls would hide per-row cache misses
+            with CaptureQueriesContext(connection) as queries:
+                request()
+            counts[size] = len(queries)
+            statements[size] = [query['sql'] for query in queries.captured_queries]
+        if len(set(counts.values())) > 1:
+            largest = statements[max(counts)]
+            sql, repeats = Counter(re.sub(r'\d+', 'N', sql) for sql in largest).most_common(1)[0]
+            self.fail(f'Query count grows with rows {counts}; most repeated ({repeats}x): {sql[:300]}')
+        return counts
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Every list API runs the same number of queries for 1, 10 and 100 rows"""
+
+    def setUp(self):
+        self.client = Client()
+        self.staff = User.objects.create_user(username='budget_admin', password='testpass123', is_staff=True)
+        self.client.force_login(self.staff)
+        self.today = timezone.now().date()
+
+    def seed(self, start, stop):
+        """Per row: route, driver, bus with two fixes, an all-day schedule; odd rows get an override today"""
+        for i in range(start, stop):
+            route = Route.objects.create(owner=self.staff, route_id=f'QB-R{i}', name=f'Budget Route {i}',
+                                         start_location='A', end_location='B')
+            driver = Driver.objects.create(owner=self.staff, driver_id=f'QB-D{i}', name=f'Driver {i}')
+            bus = Bus.objects.create(owner=self.staff, bus_id=f'QB-{i}', bus_number=f'QB-{i}', route=route)
+            for step in range(2):
+                # Within the New Delhi match radius: no reverse geocoding
+                BusLocation.objects.create(bus=bus, latitude=28.6139 + i * 0.00005, longitude=77.2090 + step * 0.0001,
+                                           last_updated=timezone.now() - timedelta(minutes=2 - step))
+            schedule = Schedule.objects.create(
+                owner=self.staff, schedule_id=f'QB-S{i}', name=f'Schedule {i}', bus=bus, route=route, driver=driver,
+                start_time=dt_time(0, 0), end_time=dt_time(23, 59), days_of_week=list(range(7)),
+                effective_from=self.today - timedelta(days=1),
+            )
+            if i % 2:
+                ScheduleException.objects.create(owner=self.staff, schedule=schedule, bus=bus, exception_date=self.today,
+                                                 exception_type='override', override_route=route, override_driver=driver)
+
+    def unseed(self):
+        Route.objects.all().delete()  # cascades to buses, fixes and schedules
+        Driver.objects.all().delete()
+
+    def get(self, path, params=None):
+        def request():
+            response = self.client.get(path, params or {})
+            self.assertEqual(response.status_code, 200, response.content[:200])
+        return request
+
+    def test_public_apis(self):
+        for path, params in [
+            ('/api/get_locations/', None),
+            ('/api/find_nearest_buses/', {'lat': 28.6139, 'lng': 77.2090, 'radius': 5, 'limit': 500}),
+            ('/api/routes/', None),
+        ]:
+            with self.subTest(path=path):
+                self.assertQueriesConstant(self.seed, self.get(path, params))
+                self.unseed()
+
+    def test_admin_apis(self):
+        for path in [
+            '/api/admin/list_routes/',
+            '/api/admin/list_drivers/',
+            '/api/admin/list_schedules/',
+            '/api/admin/list_schedule_exceptions/',
+            '/api/admin/get_current_schedules/',
+        ]:
+            with self.subTest(path=path):
+                self.assertQueriesConstant(self.seed, self.get(path))
+                self.unseed()
+
+    def test_search_buses(self):
+        self.assertQueriesConstant(self.seed, self.get('/api/search_buses/', {'q': 'QB'}))
+
+    def test_admin_list_buses(self):
+        self.assertQueriesConstant(self.seed, self.get('/api/admin/list_buses/'))
+
+
+class LatestLocationBatchTests(TestCase):
+    """Test BusLocation.latest_for, the batched latest-fix lookup"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='latest_owner', password='testpass123', is_staff=True)
+        self.route = Route.objects.create(owner=self.user, route_id='LAT-ROUTE', name='Latest Route',
+                                          start_location='A', end_location='B')
+        self.buses = [Bus.objects.create(owner=self.user, bus_id=f'LAT-{i}', bus_number=f'LAT-{i}', route=self.route)
+                      for i in range(3)]
+        now = timezone.now()
+        self.expected = {}
+        for n, bus in enumerate(self.buses[:2]):
+            for minutes in (5, 1, 3):
+                location = BusLocation.objects.create(bus=bus, latitude=28.6 + n, longitude=77.2 + minutes,
+                                                      last_updated=now - timedelta(minutes=minutes))
+                if minutes == 1:
+                    self.expected[bus.pk] = location
+
+    def test_latest_fix_per_bus_in_one_query(self):
+        """Each bus maps to its newest fix, buses without fixes are absent, in a single query"""
+        with self.assertNumQueries(1):
+            latest = BusLocation.latest_for(Bus.objects.filter(owner=self.user))
+        self.assertEqual(latest, self.expected)
+        self.assertEqual(latest, {bus.pk: bus.get_current_location() for bus in self.buses[:2]})
+        self.assertEqual(BusLocation.latest_for([self.buses[1].pk]), {self.buses[1].pk: self.expected[self.buses[1].pk]})
+
+    def test_admin_list_buses_uses_two_queries_for_the_fleet(self):
+        """One query for the buses and one for all their latest fixes (after the session/user lookups)"""
+        client = Client()
+        client.force_login(self.user)
+        client.get('/api/admin/list_buses/')  # warm up the session
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/admin/list_buses/')
+        fleet_queries = [q['sql'] for q in queries.captured_queries if 'tracking_app_' in q['sql']]
+        self.assertEqual(len(fleet_queries), 2, fleet_queries)
+        locations = {bus['bus_id']: bus['current_location'] for bus in response.json()['buses']}
+        self.assertIsNone(locations['LAT-2'])
+        self.assertAlmostEqual(locations['LAT-0']['longitude'], 78.2)
+
+
+class ListPaginationTests(TestCase):
+    """Test cursor pagination and fields= projection on the list endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='page_owner', password='testpass123', is_staff=True)
+        self.route = Route.objects.create(owner=self.user, route_id='PAGE-ROUTE', name='Page Route',
+                                          start_location='A', end_location='B')
+        self.buses = [Bus.objects.create(owner=self.user, bus_id=f'PAGE-{i:02d}', bus_number=f'PG-{i:02d}',
+                                         route=self.route) for i in range(7)]
+        BusLocation.objects.create(bus=self.buses[0], latitude=28.61, longitude=77.21)
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_cursor_pages_cover_every_bus_once(self):
+        """Following next_cursor visits each bus exactly once; the default response is unpaged"""
+        seen, cursor, pages = [], None, 0
+        while True:
+            params = {'limit': 3} if cursor is None else {'limit': 3, 'cursor': cursor}
+            body = self.client.get('/api/admin/list_buses/', params).json()
+            pages += 1
+            self.assertLessEqual(body['count'], 3)
+            seen.extend(bus['bus_id'] for bus in body['buses'])
+            cursor = body['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, [bus.bus_id for bus in self.buses])
+
+        body = self.client.get('/api/admin/list_buses/').json()
+        self.assertEqual(body['count'], 7)
+        self.assertIsNone(body['next_cursor'])
+        search = self.client.get('/api/search_buses/', {'q': 'PAGE', 'limit': 5}).json()
+        self.assertEqual(search['count'], 5)
+        self.assertIsNotNone(search['next_cursor'])
+
+    def test_fields_limit_keys_and_columns(self):
+        """fields= renders only the requested keys and skips the location lookup when not asked for"""
+        self.client.get('/api/admin/list_buses/')  # warm up the session
+        with CaptureQueriesContext(connection) as queries:
+            body = self.client.get('/api/admin/list_buses/', {'fields': 'bus_id'}).json()
+        self.assertEqual({tuple(bus) for bus in body['buses']}, {('bus_id',)})
+        fleet_queries = [q['sql'] for q in queries.captured_queries if 'tracking_app_' in q['sql']]
+        self.assertEqual(len(fleet_queries), 1, fleet_queries)
+        self.assertNotIn('driver_mobile', fleet_queries[0])
+        self.assertNotIn('tracking_app_route', fleet_queries[0])
+
+        body = self.client.get('/api/search_buses/', {'fields': 'current_location,bus_id'}).json()
+        first = body['buses'][0]
+        self.assertEqual(list(first), ['bus_id', 'current_location'])
+        self.assertAlmostEqual(first['current_location']['longitude'], 77.21)
+
+        driver = Driver.objects.create(owner=self.user, driver_id='PAGE-D', name='Pat', mobile='9000000001',
+                                       license_number='PAGE-LIC')
+        Schedule.objects.create(owner=self.user, schedule_id='PAGE-S', name='Morning', bus=self.buses[0],
+                                route=self.route, driver=driver, start_time='08:00', end_time='10:00',
+                                days_of_week=[0, 1, 2, 3, 4], effective_from=timezone.now().date())
+        body = self.client.get('/api/admin/list_schedules/', {'fields': 'schedule_id,driver'}).json()
+        self.assertEqual(body['schedules'], [{'schedule_id': 'PAGE-S',
+                                              'driver': {'driver_id': 'PAGE-D', 'name': 'Pat', 'mobile': '9000000001'}}])
+
+    def test_bad_parameters_are_rejected(self):
+        """Unknown fields and malformed limit/cursor values are 400s"""
+        for path, params in (
+            ('/api/admin/list_buses/', {'fields': 'bus_id,secret'}),
+            ('/api/admin/list_buses/', {'limit': 'ten'}),
+            ('/api/admin/list_drivers/', {'limit': 0}),
+            ('/api/admin/list_schedule_exceptions/', {'limit': 100000}),
+            ('/api/search_buses/', {'cursor': 'not-a-cursor'}),
+        ):
+            response = self.client.get(path, params)
+            self.assertEqual(response.status_code, 400, (path, params))
+            self.assertIn('error', response.json())
@@ -0,0 +1,280 @@
+# tracking_app/trajectory.py
+"""
+Trajectory simplification and compaction.
+
+Old BusLocation history is replaced, per bus and per trip, by one
+CompactTrajectory row holding a Douglas-Peucker simplified path encoded with
+the (multi-dimensional) Google polyline algorithm:
+latitude/longitude at 1e-5 degrees, seconds since trip start and speed at
+0.1 km/h. history_points() merges compacted and raw history so readers do
+not need to know which part of a window has been compacted.
+"""
+import heapq
+from datetime import timedelta
+from math import cos, radians
+
+from django.db import transaction
+
+from .models import BusLocation, CompactTrajectory
+
+# Scale factors for the encoded dimensions: lat, lng, seconds offset, speed
+POINT_PRECISIONS = (1e5, 1e5, 1, 10)
+
+# Metres per degree of latitude (good enough for tolerances of a few metres)
+METERS_PER_DEGREE = 111320.0
+
+
+# ============= Polyline encoding =============
+
+def _encode_value(value, out):
+    value = ~(value << 1) if value < 0 else (value << 1)
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode_polyline(points, precisions=(1e5, 1e5)):
+    """Encode a sequence of equal-length tuples as a delta-encoded polyline string"""
+    out = []
+    previous = [0] * len(precisions)
+    for point in points:
+        for i, factor in enumerate(precisions):
+            value = int(round(point[i] * factor))
+            _encode_value(value - previous[i], out)
+            previous[i] = value
+    return ''.join(out)
+
+
+def decode_polyline(text, precisions=(1e5, 1e5)):
+    """Inverse of encode_polyline; yields tuples"""
+    dims = len(precisions)
+    values = [0] * dims
+    index, length = 0, len(text)
+    while index < length:
+        point = []
+        for i in range(dims):
+            shift, result = 0, 0
+            while True:
+                b = ord(text[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            values[i] += ~(result >> 1) if result & 1 else (result >> 1)
+            point.append(values[i] / precisions[i])
+        yield tuple(point)
+
+
+# ============= Simplification =============
+
+def _segment_distance_m(p, a, b, lat_scale):
+    """Distance in metres from p to segment a-b (equirectangular projection)"""
+    px, py = p[1] * lat_scale, p[0] * METERS_PER_DEGREE
+    ax, ay = a[1] * lat_scale, a[0] * METERS_PER_DEGREE
+    bx, by = b[1] * lat_scale, b[0] * METERS_PER_DEGREE
+    dx, dy = bx - ax, by - ay
+    if dx == 0 and dy == 0:
+        return ((px - ax) ** 2 + (py - ay) ** 2) ** 0.5
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)))
+    cx, cy = ax + t * dx, ay + t * dy
+    return ((px - cx) ** 2 + (py - cy) ** 2) ** 0.5
+
+
+def simplify(points, tolerance_m):
+    """
+    Douglas-Peucker on (latitude, longitude, ...) tuples; returns the kept points.
+    Iterative, so long trips don't hit the recursion limit.
+    """
+    n = len(points)
+    if n < 3 or tolerance_m <= 0:
+        return list(points)
+    lat_scale = METERS_PER_DEGREE * cos(radians(points[0][0]))
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_dist, index = 0.0, None
+        for i in range(first + 1, last):
+            dist = _segment_distance_m(points[i], points[first], points[last], lat_scale)
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if index is not None and max_dist > tolerance_m:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+class StreamingSimplifier:
+    """
+    Douglas-Peucker over a stream of points with bounded memory and output.
+    Points are buffered and re-simplified whenever the buffer fills; if the
+    result still has more than max_points, the tolerance is doubled until it
+    fits. `tolerance_m` is the effective tolerance after the stream ends.
+    split() ends the current segment so no line is drawn across the gap;
+    each segment keeps its endpoints, so output can't drop below two points
+    per segment.
+    """
+
+    def __init__(self, tolerance_m=0.0, max_points=2000, buffer_size=None):
+        self.tolerance_m = tolerance_m
+        self.max_points = max(max_points, 2)
+        self.buffer_size = buffer_size or max(2 * self.max_points, 1024)
+        self.seen = 0
+        self._segments = [[]]
+        self._buffered = 0
+        self._compact_at = self.buffer_size
+
+    def add(self, point):
+        self.seen += 1
+        self._segments[-1].append(point)
+        self._buffered += 1
+        if self._buffered >= self._compact_at:
+            self._compact()
+
+    def split(self):
+        """Start a new segment with the next point"""
+        if self._segments[-1]:
+            self._segments.append([])
+
+    def _compact(self):
+        segments = [simplify(points, self.tolerance_m) for points in self._segments]
+        while sum(map(len, segments)) > self.max_points and any(len(points) > 2 for points in segments):
+            self.tolerance_m = self.tolerance_m * 2 if self.tolerance_m > 0 else 1.0
+            segments = [simplify(points, self.tolerance_m) for points in segments]
+        self._segments = segments
+        self._buffered = sum(map(len, segments))
+        # Many short segments can't shrink further; don't re-simplify on every point
+        self._compact_at = max(self.buffer_size, 2 * self._buffered)
+
+    def segments(self):
+        """Simplified points of each non-empty segment"""
+        self._compact()
+        return [list(points) for points in self._segments if points]
+
+    def result(self):
+        """Simplified points of all segments joined together"""
+        return [point for points in self.segments() for point in points]
+
+
+# ============= Compaction =============
+
+def build_trajectory(bus, fixes, tolerance_m):
+    """
+    Unsaved CompactTrajectory for fixes given as
+    (latitude, longitude, speed, timestamp) tuples sorted by time.
+    """
+    started_at = fixes[0][3]
+    points = [
+        (lat, lng, (ts - started_at).total_seconds(), speed or 0.0)
+        for lat, lng, speed, ts in fixes
+    ]
+    kept = simplify(points, tolerance_m)
+    return CompactTrajectory(
+        bus=bus,
+        started_at=started_at,
+        ended_at=fixes[-1][3],
+        raw_points=len(fixes),
+        point_count=len(kept),
+        tolerance_m=tolerance_m,
+        encoded=encode_polyline(kept, POINT_PRECISIONS),
+    )
+
+
+def compact_bus_history(bus, before, tolerance_m=5.0, trip_gap_seconds=600, chunk_size=2000,
+                        max_trip_fixes=10000):
+    """
+    Replace raw fixes of `bus` older than `before` with one CompactTrajectory
+    per trip (a new trip starts after a gap longer than trip_gap_seconds, or
+    after max_trip_fixes fixes). The bus's newest fix always stays raw, so
+    its current location survives. Rows are read in (last_updated, id)
+    keyset pages, so no cursor is open while trips are deleted, and memory
+    is bounded by max_trip_fixes.
+    Returns (trajectories_created, raw_rows_replaced, points_kept).
+    """
+    old = BusLocation.objects.filter(bus=bus, last_updated__lt=before)
+    newest = BusLocation.objects.filter(bus=bus).order_by('-last_updated', '-id').values_list('id', flat=True).first()
+    if newest is not None:
+        old = old.exclude(id=newest)
+    created = replaced = kept = 0
+    trip_ids, trip_fixes = [], []
+
+    def flush():
+        nonlocal created, replaced, kept
+        if not trip_fixes:
+            return
+        trajectory = build_trajectory(bus, trip_fixes, tolerance_m)
+        with transaction.atomic():
+            trajectory.save()
+            for i in range(0, len(trip_ids), chunk_size):
+                BusLocation.objects.filter(id__in=trip_ids[i:i + chunk_size]).delete()
+        created += 1
+        replaced += trajectory.raw_points
+        kept += trajectory.point_count
+
+    last = None
+    while True:
+        page = old if last is None else old.filter(last_updated__gte=last[1]).exclude(
+            last_updated=last[1], id__lte=last[0])
+        rows = list(page.order_by('last_updated', 'id')
+                    .values_list('id', 'latitude', 'longitude', 'speed', 'last_updated')[:chunk_size])
+        for pk, lat, lng, speed, ts in rows:
+            if trip_fixes and ((ts - trip_fixes[-1][3]).total_seconds() > trip_gap_seconds
+                               or len(trip_fixes) >= max_trip_fixes):
+                flush()
+                trip_ids, trip_fixes = [], []
+            trip_ids.append(pk)
+            trip_fixes.append((lat, lng, speed, ts))
+        if len(rows) < chunk_size:
+            break
+        last = (rows[-1][0], rows[-1][4])
+    flush()
+    return created, replaced, kept
+
+
+# ============= Reading =============
+
+def trajectory_points(trajectory):
+    """Decode a CompactTrajectory into point dicts"""
+    for lat, lng, offset, speed in decode_polyline(trajectory.encoded, POINT_PRECISIONS):
+        yield {
+            'latitude': lat,
+            'longitude': lng,
+            'speed': speed,
+            'timestamp': trajectory.started_at + timedelta(seconds=offset),
+            'compacted': True,
+        }
+
+
+def history_points(bus, start=None, end=None, chunk_size=2000):
+    """
+    Time-ordered history of a bus between start and end (inclusive), merging
+    compacted trajectories and raw BusLocation rows. Streams both sources.
+    """
+    trajectories = CompactTrajectory.objects.filter(bus=bus).order_by('started_at')
+    raw = BusLocation.objects.filter(bus=bus).order_by('last_updated', 'id')
+    if start is not None:
+        trajectories = trajectories.filter(ended_at__gte=start)
+        raw = raw.filter(last_updated__gte=start)
+    if end is not None:
+        trajectories = trajectories.filter(started_at__lte=end)
+        raw = raw.filter(last_updated__lte=end)
+
+    def compacted():
+        for trajectory in trajectories.iterator(chunk_size=100):
+            for point in trajectory_points(trajectory):
+                if start is not None and point['timestamp'] < start:
+                    continue
+                if end is not None and point['timestamp'] > end:
+                    break
+                yield point
+
+    def stored():
+        for lat, lng, speed, ts in raw.values_list(
+                'latitude', 'longitude', 'speed', 'last_updated').iterator(chunk_size=chunk_size):
+            yield {'latitude': lat, 'longitude': lng, 'speed': speed, 'timestamp': ts, 'compacted': False}
+
+    return heapq.merge(compacted(), stored(), key=lambda p: p['timestamp'])
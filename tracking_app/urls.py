@@ -4,7 +4,9 @@ from . import views
 urlpatterns = [
     # Bus location APIs
     path('update_location/', views.update_location, name='update_location'),
+    path('update_locations/', views.update_locations_batch, name='update_locations_batch'),
     path('get_locations/', views.get_locations, name='get_locations'),
+    path('bus/<str:bus_id>/history/', views.bus_history, name='bus_history'),
     
     # User location & nearest bus APIs
     path('update_user_location/', views.update_user_location, name='update_user_location'),
@@ -30,10 +32,15 @@ urlpatterns = [
     path('admin/add_bus/', views.admin_add_bus, name='admin_add_bus'),
     path('admin/list_buses/', views.admin_list_buses, name='admin_list_buses'),
     path('admin/analytics/', views.admin_analytics, name='admin_analytics'),
+    path('admin/profiles/', views.admin_profiles, name='admin_profiles'),
+    path('admin/profiles/<str:profile_id>/', views.admin_profile_detail, name='admin_profile_detail'),
     path('admin/toggle_bus_status/', views.admin_toggle_bus_status, name='admin_toggle_bus_status'),
     path('admin/add_route/', views.admin_add_route, name='admin_add_route'),
     path('admin/clean_old_locations/', views.admin_clean_old_locations, name='admin_clean_old_locations'),
+    path('admin/retention_policy/', views.admin_retention_policy, name='admin_retention_policy'),
+    path('admin/export_locations/', views.admin_export_locations, name='admin_export_locations'),
     path('admin/list_routes/', views.admin_list_routes, name='admin_list_routes'),
+    path('admin/ingest_stats/', views.admin_ingest_stats, name='admin_ingest_stats'),
     
     # Dynamic Bus Management APIs
     path('admin/update_bus_route/', views.admin_update_bus_route, name='admin_update_bus_route'),
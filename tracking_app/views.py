@@ -1,18 +1,30 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.conf import settings
+from django.db.models import Count, Q, Sum
 from django.utils import timezone
 from datetime import timedelta
+import hmac
 import json
+import os
 import uuid
+import zlib
 from math import cos, radians
-from .models import BusLocation, Bus, Route, UserLocation, BusStop, Driver, Schedule, ScheduleException
+from .models import BusLocation, Bus, Route, UserLocation, BusStop, Driver, Schedule, ScheduleException, RetentionPolicy, current_schedule_prefetches
 from .location_utils import get_location_name, get_route_display_name, invalidate_user_cache
+from . import profiling, rollups
+from .ingest import ingest, get_pipeline, parse_timestamp
+from .export import FORMATS as EXPORT_FORMATS, CONTENT_TYPES as EXPORT_CONTENT_TYPES, export_rows, stream_export
+from .retention import default_retention_days, prune_owner
+from .metrics import REGISTRY as metrics_registry
+from .pagination import Field, FieldSet, ListParamError, page_scope, paginate
+from .swr import StaleWhileRevalidateCache
+from .trajectory import POINT_PRECISIONS, StreamingSimplifier, encode_polyline, history_points
 
 # Create your views here.
 
@@ -24,52 +36,89 @@ def update_location(request):
     """API endpoint for buses to send their location updates"""
     try:
         data = json.loads(request.body)
-        bus_id = data.get('bus_id')
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        speed = data.get('speed', 0.0)
-        heading = data.get('heading', 0.0)
         
-        if not bus_id or latitude is None or longitude is None:
-            return JsonResponse({'error': 'Missing required fields'}, status=400)
+        # Unknown vehicles are auto-created on the default simulation route
+        result = ingest([data], create_missing_buses=True)
+        if result.rejected:
+            return JsonResponse({'error': result.rejected[0].error}, status=400)
         
-        # Ensure a default route exists for simulated data
-        default_route, _ = Route.objects.get_or_create(
-            route_id='ROUTE-DEFAULT',
-            defaults={
-                'name': 'Default Simulation Route',
-                'start_location': 'Start',
-                'end_location': 'End',
-                'description': 'Autocreated route for simulator data'
-            }
-        )
+        bus_location = result.locations[0] if result.locations else None
+        if bus_location:
+            message = 'Location updated successfully'
+        elif result.suppressed:
+            message = 'Vehicle stationary, last seen updated'
+        else:
+            message = 'Duplicate location ignored'
+        return JsonResponse({
+            'status': 'success',
+            'message': message,
+            'bus_created': str(data.get('bus_id')) in result.buses_created,
+            'location_id': bus_location.id if bus_location else None
+        })
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
 
-        # Get or create bus object
-        bus, bus_created = Bus.objects.get_or_create(
-            bus_id=bus_id,
-            defaults={
-                'bus_number': bus_id,
-                'route': default_route
-            }
-        )
+class BodyDecodeError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def decoded_body(request):
+    """Request body with a `Content-Encoding: gzip` undone, capped at INGEST_MAX_DECODED_BYTES"""
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if encoding in ('', 'identity'):
+        return request.body
+    if encoding != 'gzip':
+        raise BodyDecodeError(f'Unsupported Content-Encoding: {encoding}', 415)
+    limit = getattr(settings, 'INGEST_MAX_DECODED_BYTES', 10 * 1024 * 1024)
+    decompressor = zlib.decompressobj(31)  # wbits=31: gzip container
+    try:
+        body = decompressor.decompress(request.body, limit + 1)
+    except zlib.error:
+        raise BodyDecodeError('Invalid gzip body', 400)
+    if len(body) > limit:
+        raise BodyDecodeError(f'Decoded body too large (max {limit} bytes)', 413)
+    if not decompressor.eof:
+        raise BodyDecodeError('Truncated gzip body', 400)
+    return body
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def update_locations_batch(request):
+    """
+    Batch location upload for devices that buffer fixes.
+    POST JSON: {"fixes": [{"bus_id", "latitude", "longitude", "speed", "heading", "timestamp"}, ...]}
+    The body may be sent with `Content-Encoding: gzip`.
+    """
+    try:
+        data = json.loads(decoded_body(request))
+        fixes = data.get('fixes') if isinstance(data, dict) else None
+        if not isinstance(fixes, list) or not fixes:
+            return JsonResponse({'error': 'fixes must be a non-empty list'}, status=400)
         
-        # Create new location record (keeping history)
-        bus_location = BusLocation.objects.create(
-            bus=bus,
-            latitude=latitude,
-            longitude=longitude,
-            speed=speed,
-            heading=heading
-        )
+        max_batch = getattr(settings, 'INGEST_MAX_BATCH', 1000)
+        if len(fixes) > max_batch:
+            return JsonResponse({'error': f'Too many fixes in one batch (max {max_batch})'}, status=413)
         
+        result = ingest(fixes, create_missing_buses=True)
         return JsonResponse({
             'status': 'success',
-            'message': 'Location updated successfully',
-            'bus_created': bus_created,
-            'location_id': bus_location.id
+            'accepted': len(result.locations),
+            'duplicates': result.duplicates,
+            'suppressed': result.suppressed,
+            'rejected': [{'index': fix.index, 'error': fix.error} for fix in result.rejected],
+            'location_ids': [location.id for location in result.locations],
+            'buses_created': sorted(result.buses_created),
         })
         
-    except json.JSONDecodeError:
+    except BodyDecodeError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    except (json.JSONDecodeError, UnicodeDecodeError):
         return JsonResponse({'error': 'Invalid JSON data'}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
@@ -80,10 +129,11 @@ def get_locations(request):
     try:
         # Get the latest location for each bus
         latest_locations = []
-        buses = Bus.objects.filter(is_active=True).prefetch_related('locations')
+        buses = Bus.objects.filter(is_active=True).select_related('route')
+        latest = BusLocation.latest_for(buses)
         
         for bus in buses:
-            latest_location = bus.locations.first()  # Latest due to ordering
+            latest_location = latest.get(bus.pk)
             if latest_location:
                 # Get human-readable location name
                 location_name = get_location_name(latest_location.latitude, latest_location.longitude)
@@ -233,15 +283,45 @@ def find_nearest_buses(request):
 
 # ============= Bus Search APIs =============
 
+def _location_json(location, heading=False):
+    if location is None:
+        return None
+    data = {
+        'latitude': location.latitude,
+        'longitude': location.longitude,
+        'speed': location.speed,
+    }
+    if heading:
+        data['heading'] = location.heading
+    data['last_updated'] = location.last_updated.isoformat()
+    return data
+
+
+SEARCH_BUS_FIELDS = FieldSet(
+    bus_id=Field(['bus_id'], lambda bus, ctx: bus.bus_id),
+    bus_number=Field(['bus_number'], lambda bus, ctx: bus.bus_number),
+    route_id=Field(['route__route_id'], lambda bus, ctx: bus.route.route_id if bus.route else None),
+    route_name=Field(['route__name'], lambda bus, ctx: bus.route.name if bus.route else None),
+    driver_name=Field(['driver_name'], lambda bus, ctx: bus.driver_name),
+    capacity=Field(['capacity'], lambda bus, ctx: bus.capacity),
+    vehicle_type=Field(['vehicle_type'], lambda bus, ctx: bus.vehicle_type),
+    current_location=Field([], lambda bus, latest: _location_json(latest.get(bus.pk))),
+)
+
+
 @require_http_methods(["GET"])
 def search_buses(request):
-    """Search vehicles by various criteria"""
+    """
+    Search vehicles by various criteria.
+    Optional: `limit`/`cursor` for keyset pages, `fields=a,b` to return only those fields.
+    """
     try:
         query = request.GET.get('q', '').strip()
         route_id = request.GET.get('route')
         vtype = (request.GET.get('type') or '').strip().lower()
+        fields = SEARCH_BUS_FIELDS.selected(request)
         
-        buses = Bus.objects.filter(is_active=True).select_related('route')
+        buses = SEARCH_BUS_FIELDS.project(Bus.objects.filter(is_active=True), fields)
         
         if query:
             buses = buses.filter(
@@ -256,34 +336,22 @@ def search_buses(request):
         if vtype:
             buses = buses.filter(vehicle_type=vtype)
         
+        rows, next_cursor = paginate(buses, request)
         # Get current locations for found vehicles
-        buses_data = []
-        for bus in buses:
-            current_location = bus.get_current_location()
-            buses_data.append({
-                'bus_id': bus.bus_id,
-                'bus_number': bus.bus_number,
-                'route_id': bus.route.route_id if bus.route else None,
-                'route_name': bus.route.name if bus.route else None,
-                'driver_name': bus.driver_name,
-                'capacity': bus.capacity,
-                'vehicle_type': bus.vehicle_type,
-                'current_location': {
-                    'latitude': current_location.latitude,
-                    'longitude': current_location.longitude,
-                    'speed': current_location.speed,
-                    'last_updated': current_location.last_updated.isoformat()
-                } if current_location else None
-            })
+        latest = BusLocation.latest_for(page_scope(buses, rows, request)) if 'current_location' in fields else {}
+        buses_data = [SEARCH_BUS_FIELDS.render(bus, fields, latest) for bus in rows]
         
         return JsonResponse({
             'status': 'success',
             'buses': buses_data,
             'count': len(buses_data),
+            'next_cursor': next_cursor,
             'query': query,
             'type': vtype,
         })
         
+    except ListParamError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -291,18 +359,19 @@ def search_buses(request):
 def get_routes(request):
     """Get all available routes (public aggregator across owners)"""
     try:
-        routes = Route.objects.filter(is_active=True).prefetch_related('buses')
+        routes = Route.objects.filter(is_active=True).annotate(
+            active_buses=Count('buses', filter=Q(buses__is_active=True))
+        )
         
         routes_data = []
         for route in routes:
-            active_buses = route.buses.filter(is_active=True).count()
             routes_data.append({
                 'route_id': route.route_id,
                 'name': route.name,
                 'start_location': route.start_location,
                 'end_location': route.end_location,
                 'description': route.description,
-                'active_buses': active_buses,
+                'active_buses': route.active_buses,
                 'created_at': route.created_at.isoformat()
             })
         
@@ -315,6 +384,95 @@ def get_routes(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+# ============= Bus History APIs =============
+
+def _query_time(value):
+    """Query-string timestamp: epoch seconds or ISO-8601"""
+    try:
+        return parse_timestamp(float(value))
+    except ValueError:
+        return parse_timestamp(value)
+
+@require_http_methods(["GET"])
+def bus_history(request, bus_id):
+    """
+    Path of one bus between `from` and `to` (default: last 24 hours, at most
+    HISTORY_MAX_HOURS) as encoded polylines, simplified server-side to at most
+    `max_points` points. Optional `bbox=min_lng,min_lat,max_lng,max_lat` and
+    `tolerance` (metres). The path is split into segments wherever it leaves
+    the bbox, so no line is drawn across the part outside it.
+    """
+    try:
+        if request.user.is_authenticated and request.user.is_staff:
+            bus = Bus.objects.filter(owner=request.user, bus_id=bus_id).first()
+        else:
+            bus = Bus.objects.filter(bus_id=bus_id, is_active=True).order_by('id').first()
+        if not bus:
+            return JsonResponse({'error': 'Bus not found'}, status=404)
+
+        try:
+            end = _query_time(request.GET['to']) if request.GET.get('to') else timezone.now()
+            start = (_query_time(request.GET['from']) if request.GET.get('from')
+                     else end - timedelta(hours=getattr(settings, 'HISTORY_DEFAULT_HOURS', 24)))
+        except (ValueError, OverflowError, OSError):
+            return JsonResponse({'error': 'Invalid from/to timestamp'}, status=400)
+        if start > end:
+            return JsonResponse({'error': '"from" must be before "to"'}, status=400)
+        max_hours = getattr(settings, 'HISTORY_MAX_HOURS', 168)
+        if end - start > timedelta(hours=max_hours):
+            return JsonResponse({'error': f'Time range must not exceed {max_hours:g} hours'}, status=400)
+
+        try:
+            limit = getattr(settings, 'HISTORY_MAX_POINTS', 2000)
+            max_points = max(2, min(int(request.GET.get('max_points', limit)), limit))
+            tolerance = max(0.0, float(request.GET.get('tolerance', 0)))
+            bbox = None
+            if request.GET.get('bbox'):
+                min_lng, min_lat, max_lng, max_lat = (float(v) for v in request.GET['bbox'].split(','))
+                bbox = (min_lat, min_lng, max_lat, max_lng)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid max_points, tolerance or bbox'}, status=400)
+
+        simplifier = StreamingSimplifier(tolerance_m=tolerance, max_points=max_points)
+        started_at = None
+        for point in history_points(bus, start, end):
+            lat, lng = point['latitude'], point['longitude']
+            if bbox and not (bbox[0] <= lat <= bbox[2] and bbox[1] <= lng <= bbox[3]):
+                simplifier.split()
+                continue
+            if started_at is None:
+                started_at = point['timestamp']
+            simplifier.add((lat, lng, (point['timestamp'] - started_at).total_seconds(), point['speed'] or 0.0))
+
+        segments = []
+        for points in simplifier.segments():
+            offset = points[0][2]
+            points = [(lat, lng, seconds - offset, speed) for lat, lng, seconds, speed in points]
+            segments.append({
+                'started_at': (started_at + timedelta(seconds=offset)).isoformat(),
+                'points': len(points),
+                # Standard Google polyline (lat, lng at 1e-5 degrees)
+                'polyline': encode_polyline(points),
+                # Same points with seconds since started_at and speed (km/h), see track_precisions
+                'track': encode_polyline(points, POINT_PRECISIONS),
+            })
+
+        return JsonResponse({
+            'status': 'success',
+            'bus_id': bus.bus_id,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'raw_points': simplifier.seen,
+            'points': sum(segment['points'] for segment in segments),
+            'tolerance_m': simplifier.tolerance_m,
+            'started_at': started_at.isoformat() if started_at else None,
+            'segments': segments,
+            'track_precisions': list(POINT_PRECISIONS),
+        })
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
 # ============= Admin APIs =============
 
 @csrf_exempt
@@ -378,46 +536,53 @@ def admin_add_bus(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+ADMIN_BUS_FIELDS = FieldSet(
+    id=Field(['id'], lambda bus, ctx: bus.id),
+    bus_id=Field(['bus_id'], lambda bus, ctx: bus.bus_id),
+    bus_number=Field(['bus_number'], lambda bus, ctx: bus.bus_number),
+    route_id=Field(['route__route_id'], lambda bus, ctx: bus.route.route_id if bus.route else None),
+    route_name=Field(['route__name'], lambda bus, ctx: bus.route.name if bus.route else None),
+    driver_name=Field(['driver_name'], lambda bus, ctx: bus.driver_name),
+    driver_mobile=Field(['driver_mobile'], lambda bus, ctx: bus.driver_mobile),
+    capacity=Field(['capacity'], lambda bus, ctx: bus.capacity),
+    vehicle_type=Field(['vehicle_type'], lambda bus, ctx: bus.vehicle_type),
+    current_speed=Field(['current_speed'], lambda bus, ctx: bus.current_speed),
+    odometer_km=Field(['odometer_km'], lambda bus, ctx: round(bus.odometer_km, 3)),
+    moving_seconds=Field(['moving_seconds'], lambda bus, ctx: bus.moving_seconds),
+    idle_seconds=Field(['idle_seconds'], lambda bus, ctx: bus.idle_seconds),
+    last_moved_at=Field(['last_moved_at'], lambda bus, ctx: bus.last_moved_at.isoformat() if bus.last_moved_at else None),
+    is_active=Field(['is_active'], lambda bus, ctx: bus.is_active),
+    last_seen=Field(['last_seen'], lambda bus, ctx: bus.last_seen.isoformat() if bus.last_seen else None),
+    created_at=Field(['created_at'], lambda bus, ctx: bus.created_at.isoformat()),
+    current_location=Field([], lambda bus, latest: _location_json(latest.get(bus.pk), heading=True)),
+)
+
+
 @require_http_methods(["GET"])
 def admin_list_buses(request):
-    """Admin endpoint to list all vehicles owned by current admin"""
+    """
+    Admin endpoint to list all vehicles owned by current admin.
+    Optional: `limit`/`cursor` for keyset pages, `fields=a,b` to return only those fields.
+    """
     try:
         if not request.user.is_authenticated or not request.user.is_staff:
             return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
 
-        buses = Bus.objects.filter(owner=request.user).select_related('route')
-        
-        buses_data = []
-        for bus in buses:
-            current_location = bus.get_current_location()
-            buses_data.append({
-                'id': bus.id,
-                'bus_id': bus.bus_id,
-                'bus_number': bus.bus_number,
-                'route_id': bus.route.route_id if bus.route else None,
-                'route_name': bus.route.name if bus.route else None,
-                'driver_name': bus.driver_name,
-                'driver_mobile': bus.driver_mobile,
-                'capacity': bus.capacity,
-                'vehicle_type': bus.vehicle_type,
-                'current_speed': bus.current_speed,
-                'is_active': bus.is_active,
-                'created_at': bus.created_at.isoformat(),
-                'current_location': {
-                    'latitude': current_location.latitude,
-                    'longitude': current_location.longitude,
-                    'speed': current_location.speed,
-                    'heading': current_location.heading,
-                    'last_updated': current_location.last_updated.isoformat()
-                } if current_location else None
-            })
+        fields = ADMIN_BUS_FIELDS.selected(request)
+        buses = ADMIN_BUS_FIELDS.project(Bus.objects.filter(owner=request.user), fields)
+        rows, next_cursor = paginate(buses, request)
+        latest = BusLocation.latest_for(page_scope(buses, rows, request)) if 'current_location' in fields else {}
+        buses_data = [ADMIN_BUS_FIELDS.render(bus, fields, latest) for bus in rows]
         
         return JsonResponse({
             'status': 'success',
             'buses': buses_data,
-            'count': len(buses_data)
+            'count': len(buses_data),
+            'next_cursor': next_cursor,
         })
         
+    except ListParamError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -852,19 +1017,113 @@ def admin_add_route(request):
 @csrf_exempt
 @require_http_methods(["POST"])
 def admin_clean_old_locations(request):
-    """Delete BusLocation rows from the last 24 hours for current admin's vehicles."""
+    """Delete location history older than `days` (default 1) for current admin's vehicles, in batches."""
     try:
         if not request.user.is_authenticated or not request.user.is_staff:
             return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
 
-        cutoff = timezone.now() - timedelta(hours=2)  # last 24 hours
-        deleted, _ = BusLocation.objects.filter(bus__owner=request.user, last_updated__gte=cutoff).delete()
+        data = json.loads(request.body) if request.body else {}
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+        days = float(data.get('days', 1))
+        if days <= 0:
+            return JsonResponse({'error': 'days must be positive'}, status=400)
+
+        cutoff = timezone.now() - timedelta(days=days)
+        counts = prune_owner(request.user.id, cutoff, batch_size=getattr(settings, 'RETENTION_BATCH_SIZE', 1000))
 
-        return JsonResponse({'status': 'success', 'deleted': deleted, 'message': 'Deleted data from last 24 hours'})
+        return JsonResponse({'status': 'success', 'deleted': counts['locations'], 'pruned': counts,
+                             'message': f'Deleted data older than {days:g} days'})
 
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def admin_retention_policy(request):
+    """Get or set how many days of location history are kept for current admin's vehicles (0 = forever)."""
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
+
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            days = int(data.get('retention_days') if isinstance(data, dict) else None)
+        except (json.JSONDecodeError, TypeError, ValueError):
+            return JsonResponse({'error': 'retention_days must be a whole number of days'}, status=400)
+        if days < 0:
+            return JsonResponse({'error': 'retention_days cannot be negative'}, status=400)
+        RetentionPolicy.objects.update_or_create(owner=request.user, defaults={'retention_days': days})
+
+    policy = RetentionPolicy.objects.filter(owner=request.user).first()
+    return JsonResponse({
+        'status': 'success',
+        'retention_days': policy.retention_days if policy else default_retention_days(),
+        'is_default': policy is None,
+    })
+
+@require_http_methods(["GET"])
+def admin_export_locations(request):
+    """
+    Stream current admin's location history as CSV or NDJSON (`format`),
+    optionally gzip-compressed (`gzip=1`), filtered by `from`/`to` and `bus` (repeatable).
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
+
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': f'format must be one of: {", ".join(EXPORT_FORMATS)}'}, status=400)
+    try:
+        start = _query_time(request.GET['from']) if request.GET.get('from') else None
+        end = _query_time(request.GET['to']) if request.GET.get('to') else None
+    except (ValueError, OverflowError, OSError):
+        return JsonResponse({'error': 'Invalid from/to timestamp'}, status=400)
+    compress = request.GET.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    rows = export_rows(request.user, start, end, request.GET.getlist('bus'))
+    filename = f"locations-{timezone.now():%Y%m%d-%H%M%S}.{fmt}" + ('.gz' if compress else '')
+    response = StreamingHttpResponse(
+        stream_export(rows, fmt, compress),
+        content_type='application/gzip' if compress else EXPORT_CONTENT_TYPES[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@require_http_methods(["GET"])
+def admin_ingest_stats(request):
+    """
+    Per-stage ingest pipeline timings and per-vehicle dead-band counts of
+    committed batches (cumulative since this worker process started).
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
+
+    pipeline = get_pipeline()
+    deadband = []
+    stage = pipeline.stage('deadband')
+    if stage is not None:
+        owned = dict(Bus.objects.filter(owner=request.user).values_list('id', 'bus_id'))
+        for pk, counts in stage.bus_stats(set(owned)).items():
+            deadband.append({
+                'bus_id': owned[pk],
+                'seen': counts['seen'],
+                'suppressed': counts['suppressed'],
+                'suppressed_pct': round(100.0 * counts['suppressed'] / counts['seen'], 1) if counts['seen'] else 0.0,
+            })
+        deadband.sort(key=lambda row: row['suppressed'], reverse=True)
+
+    return JsonResponse({
+        'status': 'success',
+        # Counters are kept per worker process; other workers report their own
+        'scope': 'process',
+        'pid': os.getpid(),
+        'pipeline': pipeline.stats.snapshot(),
+        'deadband': deadband,
+    })
+
 # ============= Admin Routes List =============
 
 @require_http_methods(["GET"])
@@ -887,107 +1146,169 @@ def admin_list_routes(request):
 
 # ============= Admin Analytics =============
 
+def _compute_admin_analytics(owner_id):
+    """Dashboard analytics for one admin (served through analytics_cache)"""
+    now = timezone.now()
+    one_hour_ago = now - timedelta(hours=1)
+    one_day_ago = now - timedelta(days=1)
+    five_min_ago = now - timedelta(minutes=5)
+    three_min_ago = now - timedelta(minutes=3)
+    
+    # Counts and fleet totals (odometer/moving time are maintained per bus at ingest)
+    fleet = Bus.objects.filter(owner_id=owner_id).aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        odometer_km=Sum('odometer_km'),
+        moving_seconds=Sum('moving_seconds'),
+        idle_seconds=Sum('idle_seconds'),
+    )
+    total_buses, active_buses = fleet['total'], fleet['active']
+    total_routes = Route.objects.filter(owner_id=owner_id).count()
+    # Fix counts come from per-minute rollups (one aggregate query), not raw history
+    totals = rollups.window_totals(owner_id, {'all': None, 'hour': one_hour_ago, 'day': one_day_ago})
+    
+    # FIXED: Active vehicles count based on last_seen in last 5 minutes
+    recent_bus_ids = BusLocation.objects.filter(
+        bus__owner_id=owner_id, 
+        last_updated__gte=five_min_ago
+    ).values_list('bus__id', flat=True).distinct()
+    active_recent = Bus.objects.filter(owner_id=owner_id, id__in=recent_bus_ids, is_active=True).count()
+    
+    # Vehicle type distribution (per-admin)
+    type_counts_qs = (
+        Bus.objects.filter(owner_id=owner_id)
+        .values('vehicle_type')
+        .annotate(count=Count('id'))
+    )
+    # Ensure all types appear with zeros if missing
+    allowed_types = [t for t, _ in Bus.VEHICLE_TYPES]
+    vehicle_type_counts = {t: 0 for t in allowed_types}
+    for row in type_counts_qs:
+        vehicle_type_counts[row['vehicle_type']] = row['count']
+    status_counts = {
+        'active': active_buses,
+        'inactive': total_buses - active_buses,
+    }
+    
+    # Per-route stats: one grouped query over Route -> Bus; recent activity is
+    # an IN-subquery over the (indexed) last three minutes of locations
+    reporting_recently = BusLocation.objects.filter(last_updated__gte=three_min_ago).values('bus_id')
+    route_rows = (
+        Route.objects.filter(owner_id=owner_id)
+        .annotate(
+            bus_count=Count('buses', distinct=True),
+            active_count=Count('buses', filter=Q(buses__id__in=reporting_recently), distinct=True),
+        )
+        .order_by('id')
+        .values('route_id', 'name', 'bus_count', 'active_count')
+    )
+    route_stats = [{
+        'route_id': row['route_id'],
+        'name': row['name'],
+        'buses': row['bus_count'],
+        'active_recent': row['active_count'],
+    } for row in route_rows]
+    
+    # Recent activity entries
+    recent_locations = (
+        BusLocation.objects.select_related('bus', 'bus__route')
+        .filter(bus__owner_id=owner_id)
+        .order_by('-last_updated')[:20]
+    )
+    recent_activity = [{
+        'bus_id': bl.bus.bus_id,
+        'bus_number': bl.bus.bus_number,
+        'route_id': bl.bus.route.route_id if bl.bus.route else None,
+        'latitude': bl.latitude,
+        'longitude': bl.longitude,
+        'speed': bl.speed,
+        'heading': bl.heading,
+        'last_updated': bl.last_updated.isoformat(),
+    } for bl in recent_locations]
+    
+    data = {
+        'status': 'success',
+        'summary': {
+            'total_buses': total_buses,
+            'active_buses': active_buses,
+            'total_routes': total_routes,
+            'total_locations': totals['all']['fixes'],
+            'updates_last_hour': totals['hour']['fixes'],
+            'updates_last_24h': totals['day']['fixes'],
+            'active_recent': active_recent,
+            'distance_km_24h': totals['day']['distance_km'],
+            'avg_speed_24h': totals['day']['avg_speed'],
+            'max_speed_24h': totals['day']['max_speed'],
+            'fleet_odometer_km': round(fleet['odometer_km'] or 0.0, 3),
+            'fleet_moving_hours': round((fleet['moving_seconds'] or 0.0) / 3600, 2),
+            'fleet_idle_hours': round((fleet['idle_seconds'] or 0.0) / 3600, 2),
+        },
+        'vehicle_type_counts': vehicle_type_counts,
+        'status_counts': status_counts,
+        'routes': route_stats,
+        'recent_activity': recent_activity,
+        'generated_at': now.isoformat(),
+    }
+    return data
+
+# Soft TTL: entries older than this are served while one background recompute runs
+analytics_cache = StaleWhileRevalidateCache(
+    'admin_analytics',
+    _compute_admin_analytics,
+    soft_ttl=getattr(settings, 'ANALYTICS_CACHE_SOFT_TTL', 15),
+    hard_ttl=getattr(settings, 'ANALYTICS_CACHE_HARD_TTL', 600),
+)
+
 @require_http_methods(["GET"])
 @login_required
 def admin_analytics(request):
     """Return analytics data for admin dashboard, scoped to current admin.
     Includes vehicle type distribution for per-admin isolated charts.
+    Served from a per-owner stale-while-revalidate cache; `cache.age_seconds`
+    says how old the numbers are.
     """
     if not request.user.is_staff:
         return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
     try:
-        from django.db.models import Count
-        now = timezone.now()
-        one_hour_ago = now - timedelta(hours=1)
-        one_day_ago = now - timedelta(days=1)
-        five_min_ago = now - timedelta(minutes=5)
-        three_min_ago = now - timedelta(minutes=3)
-        
-        total_buses = Bus.objects.filter(owner=request.user).count()
-        active_buses = Bus.objects.filter(owner=request.user, is_active=True).count()
-        total_routes = Route.objects.filter(owner=request.user).count()
-        total_locations = BusLocation.objects.filter(bus__owner=request.user).count()
-        loc_last_hour = BusLocation.objects.filter(bus__owner=request.user, last_updated__gte=one_hour_ago).count()
-        loc_last_day = BusLocation.objects.filter(bus__owner=request.user, last_updated__gte=one_day_ago).count()
-        
-        # FIXED: Active vehicles count based on last_seen in last 5 minutes
-        recent_bus_ids = BusLocation.objects.filter(
-            bus__owner=request.user, 
-            last_updated__gte=five_min_ago
-        ).values_list('bus__id', flat=True).distinct()
-        active_recent = Bus.objects.filter(owner=request.user, id__in=recent_bus_ids, is_active=True).count()
-        
-        # Vehicle type distribution (per-admin)
-        type_counts_qs = (
-            Bus.objects.filter(owner=request.user)
-            .values('vehicle_type')
-            .annotate(count=Count('id'))
-        )
-        # Ensure all types appear with zeros if missing
-        allowed_types = [t for t, _ in Bus.VEHICLE_TYPES]
-        vehicle_type_counts = {t: 0 for t in allowed_types}
-        for row in type_counts_qs:
-            vehicle_type_counts[row['vehicle_type']] = row['count']
-        status_counts = {
-            'active': active_buses,
-            'inactive': total_buses - active_buses,
-        }
-        
-        # Per-route stats
-        route_stats = []
-        for route in Route.objects.filter(owner=request.user):
-            buses_qs = route.buses.all()
-            bus_ids = list(buses_qs.values_list('id', flat=True))
-            recent_count = (
-                BusLocation.objects
-                .filter(bus_id__in=bus_ids, last_updated__gte=three_min_ago)
-                .values('bus_id').distinct().count()
-            )
-            route_stats.append({
-                'route_id': route.route_id,
-                'name': route.name,
-                'buses': buses_qs.count(),
-                'active_recent': recent_count,
-            })
-        
-        # Recent activity entries
-        recent_locations = (
-            BusLocation.objects.select_related('bus')
-            .filter(bus__owner=request.user)
-            .order_by('-last_updated')[:20]
-        )
-        recent_activity = [{
-            'bus_id': bl.bus.bus_id,
-            'bus_number': bl.bus.bus_number,
-            'route_id': bl.bus.route.route_id if bl.bus.route else None,
-            'latitude': bl.latitude,
-            'longitude': bl.longitude,
-            'speed': bl.speed,
-            'heading': bl.heading,
-            'last_updated': bl.last_updated.isoformat(),
-        } for bl in recent_locations]
-        
-        data = {
-            'status': 'success',
-            'summary': {
-                'total_buses': total_buses,
-                'active_buses': active_buses,
-                'total_routes': total_routes,
-                'total_locations': total_locations,
-                'updates_last_hour': loc_last_hour,
-                'updates_last_24h': loc_last_day,
-                'active_recent': active_recent,
-            },
-            'vehicle_type_counts': vehicle_type_counts,
-            'status_counts': status_counts,
-            'routes': route_stats,
-            'recent_activity': recent_activity,
-            'generated_at': now.isoformat(),
-        }
+        cached = analytics_cache.get(request.user.id)
+        data = dict(cached.value, cache={'state': cached.state, 'age_seconds': round(cached.age, 3)})
         return JsonResponse(data)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+# ============= Metrics & Profiling =============
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """Request metrics in Prometheus text format (METRICS_TOKEN bearer token or a staff session)"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    # Compare bytes: compare_digest rejects non-ASCII str, which a client controls here
+    authorized = bool(token) and hmac.compare_digest(
+        request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())
+    if not authorized and not (request.user.is_authenticated and request.user.is_staff):
+        return JsonResponse({'error': 'Access denied. Admin privileges or metrics token required.'}, status=403)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@require_http_methods(["GET"])
+def admin_profiles(request):
+    """Stored request profiles, newest first (send "X-Profile: 1" as staff to capture one)"""
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
+    return JsonResponse({'profiles': profiling.list_profiles()})
+
+
+@require_http_methods(["GET"])
+def admin_profile_detail(request, profile_id):
+    """One profile: top functions by cumulative time and the SQL timeline"""
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
+    record = profiling.load_profile(profile_id)
+    if record is None:
+        return JsonResponse({'error': 'Profile not found'}, status=404)
+    return JsonResponse(record)
+
+
 # ============= Web Views =============
 
 def home(request):
@@ -1057,32 +1378,42 @@ def admin_add_driver(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+DRIVER_FIELDS = FieldSet(
+    id=Field(['id'], lambda driver, ctx: driver.id),
+    driver_id=Field(['driver_id'], lambda driver, ctx: driver.driver_id),
+    name=Field(['name'], lambda driver, ctx: driver.name),
+    mobile=Field(['mobile'], lambda driver, ctx: driver.mobile),
+    license_number=Field(['license_number'], lambda driver, ctx: driver.license_number),
+    email=Field(['email'], lambda driver, ctx: driver.email),
+    is_active=Field(['is_active'], lambda driver, ctx: driver.is_active),
+    created_at=Field(['created_at'], lambda driver, ctx: driver.created_at.isoformat()),
+)
+
+
 @require_http_methods(["GET"])
 def admin_list_drivers(request):
-    """List all drivers owned by current admin"""
+    """
+    List all drivers owned by current admin.
+    Optional: `limit`/`cursor` for keyset pages, `fields=a,b` to return only those fields.
+    """
     try:
         if not request.user.is_authenticated or not request.user.is_staff:
             return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
         
-        drivers = Driver.objects.filter(owner=request.user, is_active=True)
-        
-        drivers_data = [{
-            'id': driver.id,
-            'driver_id': driver.driver_id,
-            'name': driver.name,
-            'mobile': driver.mobile,
-            'license_number': driver.license_number,
-            'email': driver.email,
-            'is_active': driver.is_active,
-            'created_at': driver.created_at.isoformat(),
-        } for driver in drivers]
+        fields = DRIVER_FIELDS.selected(request)
+        drivers = DRIVER_FIELDS.project(Driver.objects.filter(owner=request.user, is_active=True), fields)
+        rows, next_cursor = paginate(drivers, request)
+        drivers_data = [DRIVER_FIELDS.render(driver, fields) for driver in rows]
         
         return JsonResponse({
             'status': 'success',
             'drivers': drivers_data,
-            'count': len(drivers_data)
+            'count': len(drivers_data),
+            'next_cursor': next_cursor,
         })
         
+    except ListParamError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -1197,58 +1528,68 @@ def admin_add_schedule(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+SCHEDULE_FIELDS = FieldSet(
+    id=Field(['id'], lambda schedule, ctx: schedule.id),
+    schedule_id=Field(['schedule_id'], lambda schedule, ctx: schedule.schedule_id),
+    name=Field(['name'], lambda schedule, ctx: schedule.name),
+    bus=Field(['bus__bus_id', 'bus__bus_number', 'bus__vehicle_type'], lambda schedule, ctx: {
+        'bus_id': schedule.bus.bus_id,
+        'bus_number': schedule.bus.bus_number,
+        'vehicle_type': schedule.bus.vehicle_type,
+    }),
+    route=Field(['route__route_id', 'route__name', 'route__start_location', 'route__end_location'],
+                lambda schedule, ctx: {
+        'route_id': schedule.route.route_id,
+        'name': schedule.route.name,
+        'start_location': schedule.route.start_location,
+        'end_location': schedule.route.end_location,
+    }),
+    driver=Field(['driver__driver_id', 'driver__name', 'driver__mobile'], lambda schedule, ctx: {
+        'driver_id': schedule.driver.driver_id,
+        'name': schedule.driver.name,
+        'mobile': schedule.driver.mobile,
+    } if schedule.driver else None),
+    start_time=Field(['start_time'], lambda schedule, ctx: schedule.start_time.strftime('%H:%M')),
+    end_time=Field(['end_time'], lambda schedule, ctx: schedule.end_time.strftime('%H:%M')),
+    days_of_week=Field(['days_of_week'], lambda schedule, ctx: schedule.days_of_week),
+    weekdays_display=Field(['days_of_week'], lambda schedule, ctx: schedule.get_weekdays_display()),
+    effective_from=Field(['effective_from'], lambda schedule, ctx: schedule.effective_from.isoformat()),
+    effective_to=Field(['effective_to'],
+                       lambda schedule, ctx: schedule.effective_to.isoformat() if schedule.effective_to else None),
+    priority=Field(['priority'], lambda schedule, ctx: schedule.priority),
+    is_active=Field(['is_active'], lambda schedule, ctx: schedule.is_active),
+    is_active_now=Field(['is_active', 'effective_from', 'effective_to', 'days_of_week', 'start_time', 'end_time'],
+                        lambda schedule, now: schedule.is_active_now(now)),
+    created_at=Field(['created_at'], lambda schedule, ctx: schedule.created_at.isoformat()),
+    updated_at=Field(['updated_at'], lambda schedule, ctx: schedule.updated_at.isoformat()),
+)
+
+
 @require_http_methods(["GET"])
 def admin_list_schedules(request):
-    """List all schedules owned by current admin"""
+    """
+    List all schedules owned by current admin.
+    Optional: `limit`/`cursor` for keyset pages, `fields=a,b` to return only those fields.
+    """
     try:
         if not request.user.is_authenticated or not request.user.is_staff:
             return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
         
-        schedules = Schedule.objects.filter(
-            owner=request.user
-        ).select_related('bus', 'route', 'driver')
-        
-        schedules_data = []
-        for schedule in schedules:
-            schedules_data.append({
-                'id': schedule.id,
-                'schedule_id': schedule.schedule_id,
-                'name': schedule.name,
-                'bus': {
-                    'bus_id': schedule.bus.bus_id,
-                    'bus_number': schedule.bus.bus_number,
-                    'vehicle_type': schedule.bus.vehicle_type,
-                },
-                'route': {
-                    'route_id': schedule.route.route_id,
-                    'name': schedule.route.name,
-                    'start_location': schedule.route.start_location,
-                    'end_location': schedule.route.end_location,
-                },
-                'driver': {
-                    'driver_id': schedule.driver.driver_id,
-                    'name': schedule.driver.name,
-                    'mobile': schedule.driver.mobile,
-                } if schedule.driver else None,
-                'start_time': schedule.start_time.strftime('%H:%M'),
-                'end_time': schedule.end_time.strftime('%H:%M'),
-                'days_of_week': schedule.days_of_week,
-                'weekdays_display': schedule.get_weekdays_display(),
-                'effective_from': schedule.effective_from.isoformat(),
-                'effective_to': schedule.effective_to.isoformat() if schedule.effective_to else None,
-                'priority': schedule.priority,
-                'is_active': schedule.is_active,
-                'is_active_now': schedule.is_active_now(),
-                'created_at': schedule.created_at.isoformat(),
-                'updated_at': schedule.updated_at.isoformat(),
-            })
+        fields = SCHEDULE_FIELDS.selected(request)
+        schedules = SCHEDULE_FIELDS.project(Schedule.objects.filter(owner=request.user), fields)
+        rows, next_cursor = paginate(schedules, request)
+        now = timezone.now()
+        schedules_data = [SCHEDULE_FIELDS.render(schedule, fields, now) for schedule in rows]
         
         return JsonResponse({
             'status': 'success',
             'schedules': schedules_data,
-            'count': len(schedules_data)
+            'count': len(schedules_data),
+            'next_cursor': next_cursor,
         })
         
+    except ListParamError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -1351,49 +1692,57 @@ def admin_add_schedule_exception(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+SCHEDULE_EXCEPTION_FIELDS = FieldSet(
+    id=Field(['id'], lambda exception, ctx: exception.id),
+    bus=Field(['bus__bus_id', 'bus__bus_number'], lambda exception, ctx: {
+        'bus_id': exception.bus.bus_id,
+        'bus_number': exception.bus.bus_number,
+    }),
+    exception_date=Field(['exception_date'], lambda exception, ctx: exception.exception_date.isoformat()),
+    exception_type=Field(['exception_type'], lambda exception, ctx: exception.exception_type),
+    exception_type_display=Field(['exception_type'], lambda exception, ctx: exception.get_exception_type_display()),
+    reason=Field(['reason'], lambda exception, ctx: exception.reason),
+    override_route=Field(['override_route__route_id', 'override_route__name'], lambda exception, ctx: {
+        'route_id': exception.override_route.route_id,
+        'name': exception.override_route.name,
+    } if exception.override_route else None),
+    override_driver=Field(['override_driver__driver_id', 'override_driver__name'], lambda exception, ctx: {
+        'driver_id': exception.override_driver.driver_id,
+        'name': exception.override_driver.name,
+    } if exception.override_driver else None),
+    override_start_time=Field(['override_start_time'], lambda exception, ctx: (
+        exception.override_start_time.strftime('%H:%M') if exception.override_start_time else None)),
+    override_end_time=Field(['override_end_time'], lambda exception, ctx: (
+        exception.override_end_time.strftime('%H:%M') if exception.override_end_time else None)),
+    is_active=Field(['is_active'], lambda exception, ctx: exception.is_active),
+    created_at=Field(['created_at'], lambda exception, ctx: exception.created_at.isoformat()),
+)
+
+
 @require_http_methods(["GET"])
 def admin_list_schedule_exceptions(request):
-    """List schedule exceptions"""
+    """
+    List schedule exceptions.
+    Optional: `limit`/`cursor` for keyset pages, `fields=a,b` to return only those fields.
+    """
     try:
         if not request.user.is_authenticated or not request.user.is_staff:
             return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
         
-        exceptions = ScheduleException.objects.filter(
-            owner=request.user
-        ).select_related('bus', 'override_route', 'override_driver')
-        
-        exceptions_data = []
-        for exception in exceptions:
-            exceptions_data.append({
-                'id': exception.id,
-                'bus': {
-                    'bus_id': exception.bus.bus_id,
-                    'bus_number': exception.bus.bus_number,
-                },
-                'exception_date': exception.exception_date.isoformat(),
-                'exception_type': exception.exception_type,
-                'exception_type_display': exception.get_exception_type_display(),
-                'reason': exception.reason,
-                'override_route': {
-                    'route_id': exception.override_route.route_id,
-                    'name': exception.override_route.name,
-                } if exception.override_route else None,
-                'override_driver': {
-                    'driver_id': exception.override_driver.driver_id,
-                    'name': exception.override_driver.name,
-                } if exception.override_driver else None,
-                'override_start_time': exception.override_start_time.strftime('%H:%M') if exception.override_start_time else None,
-                'override_end_time': exception.override_end_time.strftime('%H:%M') if exception.override_end_time else None,
-                'is_active': exception.is_active,
-                'created_at': exception.created_at.isoformat(),
-            })
+        fields = SCHEDULE_EXCEPTION_FIELDS.selected(request)
+        exceptions = SCHEDULE_EXCEPTION_FIELDS.project(ScheduleException.objects.filter(owner=request.user), fields)
+        rows, next_cursor = paginate(exceptions, request)
+        exceptions_data = [SCHEDULE_EXCEPTION_FIELDS.render(exception, fields) for exception in rows]
         
         return JsonResponse({
             'status': 'success',
             'exceptions': exceptions_data,
-            'count': len(exceptions_data)
+            'count': len(exceptions_data),
+            'next_cursor': next_cursor,
         })
         
+    except ListParamError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -1404,11 +1753,14 @@ def admin_get_current_schedules(request):
         if not request.user.is_authenticated or not request.user.is_staff:
             return JsonResponse({'error': 'Access denied. Admin privileges required.'}, status=403)
         
-        buses = Bus.objects.filter(owner=request.user, is_active=True)
+        now = timezone.now()
+        buses = Bus.objects.filter(owner=request.user, is_active=True).select_related('route').prefetch_related(
+            *current_schedule_prefetches(now.date())
+        )
         
         current_schedules = []
         for bus in buses:
-            current_schedule = bus.get_current_schedule()
+            current_schedule = bus.get_current_schedule(now, bus.todays_exceptions, bus.todays_schedules)
             if current_schedule:
                 schedule_data = {
                     'bus_id': bus.bus_id,
@@ -1427,10 +1779,9 @@ def admin_get_current_schedules(request):
                         'mobile': current_schedule['driver'].mobile,
                     }
                 elif current_schedule['type'] == 'static':
-                    driver_info = bus.get_effective_driver_info()
                     schedule_data['driver_static'] = {
-                        'name': driver_info.get('name', ''),
-                        'mobile': driver_info.get('mobile', ''),
+                        'name': current_schedule.get('driver_name', ''),
+                        'mobile': current_schedule.get('driver_mobile', ''),
                     }
                 
                 current_schedules.append(schedule_data)
@@ -1552,26 +1903,16 @@ def device_update_location(request):
     except Exception:
         return JsonResponse({"detail": "invalid json"}, status=400)
 
-    bus_id = payload.get("bus_id")
-    lat = payload.get("latitude")
-    lng = payload.get("longitude")
-    speed = payload.get("speed", 0.0)
-    heading = payload.get("heading", 0.0)
-
-    if not bus_id or lat is None or lng is None:
-        return JsonResponse({"detail": "missing fields"}, status=400)
-
-    try:
-        bus = Bus.objects.get(bus_id=bus_id)
-    except Bus.DoesNotExist:
-        return JsonResponse({"detail": "bus not found"}, status=404)
-
-    bl = BusLocation.objects.create(
-        bus=bus,
-        latitude=lat,
-        longitude=lng,
-        speed=speed,
-        heading=heading
-    )
-    # post_save signal will push to Firebase
-    return JsonResponse({"status": "ok", "id": bl.id})
\ No newline at end of file
+    # Only registered vehicles may report through the device endpoint
+    result = ingest([payload])
+    if result.rejected:
+        error = result.rejected[0].error
+        if error == "bus not found":
+            return JsonResponse({"detail": error}, status=404)
+        if error == "Missing required fields":
+            return JsonResponse({"detail": "missing fields"}, status=400)
+        return JsonResponse({"detail": error}, status=400)
+
+    # The fan-out stage wrote the outbox row in the same transaction; drain_outbox pushes it to Firebase
+    bl = result.locations[0] if result.locations else None
+    return JsonResponse({"status": "ok", "id": bl.id if bl else None})
\ No newline at end of file